@@ -0,0 +1,247 @@
+import json
+import re
+
+# JSON中影响括号配对的字符，其余字符直接跳过
+_JSON_SIGNIFICANT = re.compile(r'[{}"\\]')
+
+
+class StreamingActionParser:
+    """增量解析模型流式输出中的Action JSON
+
+    每个片段只扫描一次：文本阶段只在片段（加上一小段跨片段的尾巴）中查找标记，
+    JSON阶段识别字符串和转义，字符串内的花括号不会影响配对。
+    Action对象闭合或遇到Observation时done置为True，调用方即可停止接收。
+    """
+
+    ACTION_MARKER = "Action:"
+    STOP_MARKER = "Observation:"
+
+    def __init__(self):
+        self.action = None
+        self.done = False
+        self._parts = []
+        self._state = "text"  # text -> seek_json -> json -> done
+        self._carry = ""  # 文本阶段保留的尾巴，用于识别跨片段的标记
+        self._json_parts = []
+        self._depth = 0
+        self._in_string = False
+        self._escape = False
+
+    @property
+    def text(self) -> str:
+        """已接收的有效响应文本（不含Action之后被丢弃的内容）"""
+        return "".join(self._parts)
+
+    @property
+    def started(self) -> bool:
+        """是否已收到模型输出"""
+        return bool(self._parts)
+
+    @property
+    def completion_text(self) -> str:
+        """模型生成的全部有效内容，用于估算输出token数"""
+        return self.text
+
+    def feed_choice(self, choice) -> str:
+        """接收流式响应中的一个choice，返回其中可显示的文本"""
+        return self.feed(choice.delta.content or "")
+
+    def finish(self):
+        """流结束时调用；Action在JSON闭合时已经解析完成，这里无需处理"""
+
+    def feed(self, chunk: str) -> str:
+        """接收一个片段，返回其中属于有效响应的部分"""
+        if self.done or not chunk:
+            return ""
+
+        pos = 0
+        while pos < len(chunk) and not self.done:
+            if self._state == "text":
+                pos = self._scan_text(chunk, pos)
+            elif self._state == "seek_json":
+                brace = chunk.find("{", pos)
+                if brace == -1:
+                    pos = len(chunk)
+                else:
+                    self._state = "json"
+                    pos = brace
+            else:
+                pos = self._scan_json(chunk, pos)
+
+        consumed = chunk[:pos]
+        self._parts.append(consumed)
+        return consumed
+
+    def _scan_text(self, chunk: str, pos: int) -> int:
+        window = self._carry + chunk[pos:]
+        offset = len(self._carry)
+        action_at = window.find(self.ACTION_MARKER)
+        stop_at = window.find(self.STOP_MARKER)
+
+        if stop_at != -1 and (action_at == -1 or stop_at < action_at):
+            # 模型开始自行编造Observation，丢弃之后的内容
+            self.done = True
+            self._state = "done"
+            if stop_at < offset:
+                # 标记开头已在之前的片段中输出，从有效文本中去掉这部分
+                text = self.text
+                self._parts = [text[:len(text) - (offset - stop_at)]]
+            return max(pos, pos + stop_at - offset)
+
+        if action_at != -1:
+            self._state = "seek_json"
+            self._carry = ""
+            return pos + action_at - offset + len(self.ACTION_MARKER)
+
+        self._carry = window[-(len(self.STOP_MARKER) - 1):]
+        return len(chunk)
+
+    def _scan_json(self, chunk: str, pos: int) -> int:
+        start = pos
+        if self._escape:
+            # 上一个片段以转义符结尾，跳过本片段第一个字符
+            self._escape = False
+            pos += 1
+
+        while True:
+            match = _JSON_SIGNIFICANT.search(chunk, pos)
+            if match is None:
+                self._json_parts.append(chunk[start:])
+                return len(chunk)
+
+            char = match.group()
+            pos = match.end()
+            if self._in_string:
+                if char == "\\":
+                    if pos < len(chunk):
+                        pos += 1
+                    else:
+                        self._escape = True
+                elif char == '"':
+                    self._in_string = False
+            elif char == '"':
+                self._in_string = True
+            elif char == "{":
+                self._depth += 1
+            elif char == "}":
+                self._depth -= 1
+                if self._depth == 0:
+                    self._json_parts.append(chunk[start:pos])
+                    self._finish_json()
+                    return pos
+
+    def _finish_json(self):
+        raw = "".join(self._json_parts)
+        self._json_parts = []
+        try:
+            # strict=False允许字符串中出现未转义的换行，模型写代码时很常见
+            action = json.loads(raw, strict=False)
+        except ValueError as e:
+            print(f"解析Action失败: {str(e)}")
+            action = None
+
+        if isinstance(action, dict) and "name" in action:
+            self.action = action
+            self.done = True
+            self._state = "done"
+        else:
+            # 不是合法的Action，继续查找下一个
+            self._state = "text"
+
+
+class ToolCallParser:
+    """组装原生函数调用模式下流式返回的tool_calls
+
+    文本内容（Thought）原样输出；工具名和参数按index分段到达，拼接后在流结束时解析。
+    每轮只执行一个工具，出现第二个工具调用时done置为True，调用方即可停止接收。
+    参数不是合法的JSON对象（包括因长度限制被截断）时，action带有error，工具不应执行。
+    """
+
+    def __init__(self):
+        self.action = None
+        self.done = False
+        self._parts = []
+        self._call_id = None
+        self._name_parts = []
+        self._argument_parts = []
+        self._index = None
+        self._started = False
+        self._finish_reason = None
+
+    @property
+    def text(self) -> str:
+        return "".join(self._parts)
+
+    @property
+    def started(self) -> bool:
+        return self._started
+
+    @property
+    def arguments_text(self) -> str:
+        return "".join(self._argument_parts)
+
+    @property
+    def completion_text(self) -> str:
+        return self.text + "".join(self._name_parts) + self.arguments_text
+
+    def feed_choice(self, choice) -> str:
+        """接收流式响应中的一个choice，返回其中可显示的文本"""
+        if self.done:
+            return ""
+        delta = choice.delta
+        content = delta.content or ""
+        if content:
+            self._started = True
+            self._parts.append(content)
+        for call in delta.tool_calls or []:
+            self._started = True
+            if self._index is None:
+                self._index = call.index
+            elif call.index != self._index:
+                # 只执行第一个工具调用，其余的不再接收
+                self.finish()
+                return content
+            if call.id:
+                self._call_id = call.id
+            function = call.function
+            if function is not None:
+                if function.name:
+                    self._name_parts.append(function.name)
+                if function.arguments:
+                    self._argument_parts.append(function.arguments)
+        if choice.finish_reason:
+            self._finish_reason = choice.finish_reason
+            self.finish()
+        return content
+
+    def finish(self):
+        """流结束时解析组装好的工具调用"""
+        if self.done:
+            return
+        self.done = True
+        name = "".join(self._name_parts)
+        if not name:
+            return
+        raw = self.arguments_text.strip()
+        error = None
+        try:
+            arguments = json.loads(raw, strict=False) if raw else {}
+        except ValueError as e:
+            arguments = {}
+            error = f"参数不是合法的JSON（{str(e)}）"
+        if error is None and not isinstance(arguments, dict):
+            arguments = {}
+            error = "参数应为JSON对象"
+        if error and self._finish_reason == "length":
+            error = "输出达到长度上限，参数被截断"
+        self.action = {"id": self._call_id or f"call_{name}", "name": name, "arguments": arguments}
+        if error:
+            print(f"解析工具参数失败: {error}")
+            self.action["error"] = error
+
+
+def extract_action(response: str) -> dict:
+    """从完整响应文本中提取Action"""
+    parser = StreamingActionParser()
+    parser.feed(response)
+    return parser.action
@@ -1,220 +1,589 @@
+import asyncio
+import contextvars
 import json
 import re
+import time
 from typing import List, Dict, Any
-from openai import OpenAI
-from tools import get_tools_description, execute_tool, validate_tools_consistency
+from tools import ToolContext, get_tool_schemas, get_tools_description, execute_tool, validate_tools_consistency
 from config import Config
-from prompt import SYSTEM_PROMPT
+from llm_client import get_llm_client, close_stream, aclose_stream
+from action_parser import StreamingActionParser, ToolCallParser, extract_action
+from cancellation import CancelToken, TaskCancelled
+from checkpoint_store import RESUMABLE_STATUSES, RunRecorder, get_checkpoint_store
+from context_manager import ContextManager, TOOL_RESULT_PREFIX, REMINDER_PREFIX, count_tokens, count_tools_tokens
+from prompt import NATIVE_SYSTEM_PROMPT, SYSTEM_PROMPT
+from scheduler import PRIORITY_CONTINUING, PRIORITY_NEW, get_scheduler
+from tracing import trace_span
+
+# 自身输出已分页的工具，结果不再转存
+_UNSPILLED_TOOLS = {"read_tool_result"}
+
+class ResponseFailed(Exception):
+    """本轮获取模型响应或执行工具失败（重试已用尽、连接错误等）"""
+
 
 class CodeAgent:
     """简化的智能代码助手"""
     
-    def __init__(self):
+    def __init__(self, session_id: str = None):
         # 验证工具定义一致性
         is_valid, message = validate_tools_consistency()
         if not is_valid:
             raise RuntimeError(f"工具定义验证失败: {message}")
         
-        self.client = OpenAI(
-            base_url=Config.API_BASE_URL,
-            api_key=Config.API_KEY
-        )
+        # 所有会话共用一个带连接池和重试的LLM客户端
+        self.llm = get_llm_client()
+        self.session_id = session_id
         self.memory: List[Dict[str, Any]] = []
+        self.context_manager = ContextManager()
+        self.last_context_stats: Dict[str, Any] = {}
+        self._has_stored_results = False
+        # 有会话ID时按轮次保存检查点，进程重启后可以恢复
+        self.checkpoints = get_checkpoint_store() if Config.CHECKPOINT_ENABLED and session_id else None
+        self.run_id = None
+        # 模型调用和工具执行经调度器限流
+        self.scheduler = get_scheduler()
+        self.client_id = None
+        self._priority = PRIORITY_NEW
+        # 客户端断开或主动取消时由外部触发，每次运行可以传入新的标记
+        self.cancel_token = CancelToken()
+        # 原生函数调用模式下工具定义通过tools参数发送，模型直接返回结构化的工具调用
+        self.native_tools = Config.TOOL_CALL_MODE == "native"
+        self.tool_schemas = get_tool_schemas() if self.native_tools else None
         self.system_prompt = self._build_system_prompt()
+        self.prompt_tokens_saved = self._prompt_tokens_saved()
         self.original_task = ""  # 保存原始任务
         self.task_completed = False  # 任务完成标志
+        self.last_status = None  # 最近一次运行的结束状态：completed、incomplete、failed或cancelled
         
         print(f"✓ CodeAgent 初始化完成，工具定义验证通过: {message}")
     
 
-    def run(self, task: str, response_queue=None) -> str:
-        """运行任务"""
+    def run(self, task: str, response_queue=None, resume_run_id: str = None, client_id: str = None,
+            cancel_token: CancelToken = None) -> str:
+        """运行任务；resume_run_id为被中断的运行时，从它最后一个检查点继续
+        
+        client_id用于按客户端限制模型调用和工具执行的并发。
+        cancel_token被取消后，任务在下一个流式片段、工具执行前后或排队等待时停止。
+        """
+        self.client_id = client_id
+        self.cancel_token = cancel_token or CancelToken()
         try:
-            self.original_task = task  # 保存原始任务
-            self.task_completed = False
-            self.memory = [{"role": "user", "content": task}]
+            start, response_queue = self._start_run(task, response_queue, resume_run_id)
             
-            for i in range(Config.MAX_ITERATIONS):
-                print(f"\n=== 第 {i+1} 轮 ===")
-                
-                # 获取模型响应
-                print(f"思考: ", end="", flush=True)
-                
-                # 发送开始思考信号到前端
-                if response_queue:
-                    response_queue.put({
-                        'type': 'thinking_stream',
-                        'content': '🤔 正在思考...\n'
-                    })
-                
-                response, action, tool_result = self._get_response_with_action(response_queue)
-
-                if not action:
-                    # 如果没有解析到action，可能是模型认为任务已完成
-                    final_answer = "任务已完成"
-                    if response_queue:
-                        response_queue.put({'type': 'final_answer', 'content': final_answer})
-                        response_queue.put({'type': 'done'})
-                    return final_answer
-                
-                tool_name = action["name"]
-                arguments = action.get("arguments", {})
-                
-                # 处理final_answer
-                if tool_name == "final_answer":
-                    final_answer = arguments.get("answer", "任务完成")
-                    # 先添加assistant的response到记忆
-                    self.memory.append({"role": "assistant", "content": response})
+            for i in range(start, Config.MAX_ITERATIONS):
+                with trace_span("agent.iteration", iteration=i + 1, session_id=self.session_id):
+                    self._begin_iteration(i, response_queue)
                     
-                    if response_queue:
-                        response_queue.put({'type': 'final_answer', 'content': final_answer})
-                        response_queue.put({'type': 'done'})
-                    return final_answer
-                
-                # 处理其他工具的执行结果
-                if tool_result is not None:
-                    # 添加到记忆：先添加assistant的思考过程，再添加工具执行结果
-                    self.memory.append({"role": "assistant", "content": response})
-                    # 将工具执行结果作为assistant消息添加到记忆中
-                    tool_result_message = f"工具执行结果: {tool_result}"
-                    self.memory.append({"role": "assistant", "content": tool_result_message})
-                    # 添加观察结果和任务提醒，将工具结果拼接到Observation后面
-                    observation_with_reminder = f"提醒：你的原始任务是：{self.original_task}。请检查是否已完成此任务，如果已完成请使用final_answer结束。"
-                    self.memory.append({"role": "user", "content": observation_with_reminder})
+                    response, action, tool_result = self._get_response_with_action(response_queue)
+                    final_answer = self._handle_step(response, action, tool_result)
+                if final_answer is not None:
+                    return self._finish(final_answer, response_queue)
+                self._save_checkpoint(i + 1)
             
             # 达到最大迭代次数时的处理
-            final_message = "达到最大迭代次数，任务可能未完全完成"
-            if response_queue:
-                response_queue.put({'type': 'final_answer', 'content': final_message})
-                response_queue.put({'type': 'done'})
-            return final_message
+            return self._finish("达到最大迭代次数，任务可能未完全完成", response_queue, status="incomplete")
             
+        except TaskCancelled as e:
+            return self._cancelled(str(e), response_queue)
         except Exception as e:
-            error_message = f"任务执行失败: {str(e)}"
             print(f"\n任务执行失败: {str(e)}")
-            if response_queue:
-                response_queue.put({'type': 'final_answer', 'content': error_message})
-                response_queue.put({'type': 'done'})
-            return error_message
+            return self._finish(f"任务执行失败: {str(e)}", response_queue, status="failed")
+
+    async def arun(self, task: str, response_queue=None, resume_run_id: str = None, client_id: str = None,
+                   cancel_token: CancelToken = None) -> str:
+        """异步运行任务，response_queue为asyncio.Queue，工具在线程池中执行"""
+        self.client_id = client_id
+        self.cancel_token = cancel_token or CancelToken()
+        try:
+            start, response_queue = self._start_run(task, response_queue, resume_run_id)
+            
+            for i in range(start, Config.MAX_ITERATIONS):
+                with trace_span("agent.iteration", iteration=i + 1, session_id=self.session_id):
+                    self._begin_iteration(i, response_queue)
+                    
+                    response, action, tool_result = await self._aget_response_with_action(response_queue)
+                    final_answer = self._handle_step(response, action, tool_result)
+                if final_answer is not None:
+                    return self._finish(final_answer, response_queue)
+                self._save_checkpoint(i + 1)
+            
+            return self._finish("达到最大迭代次数，任务可能未完全完成", response_queue, status="incomplete")
+            
+        except TaskCancelled as e:
+            return self._cancelled(str(e), response_queue)
+        except Exception as e:
+            print(f"\n任务执行失败: {str(e)}")
+            return self._finish(f"任务执行失败: {str(e)}", response_queue, status="failed")
+
+    def _start_run(self, task: str, response_queue=None, resume_run_id: str = None) -> tuple:
+        """开始新任务或恢复被中断的运行，返回(起始轮次, 发送事件用的队列)
+        
+        启用检查点时，事件经RunRecorder记录后再转发给前端队列。
+        """
+        self.run_id = None
+        if self.checkpoints is None:
+            if resume_run_id:
+                raise RuntimeError("未启用检查点，无法恢复运行")
+            self._start_task(task)
+            return 0, response_queue
+        
+        start = 0
+        if resume_run_id:
+            run = self.checkpoints.get_run(resume_run_id)
+            if run is None or run["session_id"] != self.session_id:
+                raise RuntimeError(f"运行不存在: {resume_run_id}")
+            self._start_task(run["task"])
+            checkpoint = self.checkpoints.latest_checkpoint(resume_run_id)
+            if checkpoint:
+                # 从最后一个完成的工具步骤继续
+                self.memory = checkpoint["memory"]
+                start = checkpoint["iteration"]
+            self.checkpoints.reopen_run(resume_run_id)
+            self.run_id = resume_run_id
+            # 记忆中可能引用了之前转存的结果，结束会话时一并清理
+            self._has_stored_results = True
+        else:
+            self._start_task(task)
+            self.run_id = self.checkpoints.begin_run(self.session_id, task)
+        
+        response_queue = RunRecorder(self.checkpoints, self.session_id, self.run_id, response_queue)
+        if resume_run_id:
+            print(f"从第 {start} 轮之后恢复运行 {self.run_id}")
+            self._emit(response_queue, {'type': 'resumed', 'run_id': self.run_id, 'iteration': start})
+        return start, response_queue
+
+    def _save_checkpoint(self, iteration: int):
+        """记录已完成的轮次和记忆，进程重启后从这里继续"""
+        if self.run_id is None:
+            return
+        try:
+            self.checkpoints.save_checkpoint(self.run_id, iteration, self.memory)
+        except Exception as e:
+            print(f"保存检查点失败: {str(e)}")
+
+    def _start_task(self, task: str):
+        """重置任务状态"""
+        self.original_task = task  # 保存原始任务
+        self.task_completed = False
+        self.memory = [{"role": "user", "content": task}]
+
+    def _begin_iteration(self, i: int, response_queue=None):
+        """开始新一轮迭代"""
+        self.cancel_token.check()
+        print(f"\n=== 第 {i+1} 轮 ===")
+        # 已经开始的任务排队时优先于新任务
+        self._priority = PRIORITY_CONTINUING if i > 0 else PRIORITY_NEW
+        
+        # 发送开始思考信号到前端
+        self._emit(response_queue, {
+            'type': 'thinking_stream',
+            'content': '🤔 正在思考...\n'
+        })
+
+    def _handle_step(self, response: str, action: dict, tool_result) -> str:
+        """根据本轮结果更新记忆，任务结束时返回最终答案，否则返回None"""
+        if not action:
+            # 如果没有解析到action，可能是模型认为任务已完成；原生函数调用模式下直接回复的文本就是答案
+            if self.native_tools and response.strip():
+                self.memory.append({"role": "assistant", "content": response})
+                return response.strip()
+            return "任务已完成"
+        
+        tool_name = action["name"]
+        arguments = action.get("arguments", {})
+        
+        # 处理final_answer（参数无法解析时按普通工具结果处理，让模型重新调用）
+        if tool_name == "final_answer" and not action.get("error"):
+            # 先添加assistant的response到记忆
+            self.memory.append({"role": "assistant", "content": response})
+            self.task_completed = True
+            return arguments.get("answer", "任务完成")
+        
+        # 处理其他工具的执行结果
+        if tool_result is not None:
+            if self.native_tools:
+                # 原生函数调用：assistant消息带tool_calls，结果作为对应的tool消息
+                self.memory.append(self._tool_call_message(response, action))
+                self.memory.append({"role": "tool", "tool_call_id": action["id"], "content": tool_result})
+            else:
+                # 添加到记忆：先添加assistant的思考过程，再添加工具执行结果
+                self.memory.append({"role": "assistant", "content": response})
+                # 将工具执行结果作为assistant消息添加到记忆中
+                tool_result_message = f"{TOOL_RESULT_PREFIX}{tool_result}"
+                self.memory.append({"role": "assistant", "content": tool_result_message})
+            # 添加观察结果和任务提醒，将工具结果拼接到Observation后面
+            observation_with_reminder = f"{REMINDER_PREFIX}{self.original_task}。请检查是否已完成此任务，如果已完成请使用final_answer结束。"
+            self.memory.append({"role": "user", "content": observation_with_reminder})
+        return None
+
+    @staticmethod
+    def _tool_call_message(response: str, action: dict) -> dict:
+        return {
+            "role": "assistant",
+            "content": response or None,
+            "tool_calls": [{
+                "id": action["id"],
+                "type": "function",
+                "function": {
+                    "name": action["name"],
+                    "arguments": json.dumps(action.get("arguments", {}), ensure_ascii=False)
+                }
+            }]
+        }
+
+    def _finish(self, final_answer: str, response_queue=None, status: str = "completed") -> str:
+        """发送最终答案和结束信号"""
+        self.last_status = status
+        self._emit(response_queue, {'type': 'final_answer', 'content': final_answer})
+        self._emit(response_queue, {'type': 'done'})
+        if self.run_id is not None:
+            try:
+                self.checkpoints.finish_run(self.run_id, status, final_answer)
+            except Exception as e:
+                print(f"记录运行结果失败: {str(e)}")
+        return final_answer
+
+    def _cancelled(self, reason: str, response_queue=None) -> str:
+        """任务被取消：通知前端并把运行记为cancelled，之后仍可从最后一个检查点恢复"""
+        print(f"\n任务已取消: {reason}")
+        self._emit(response_queue, {'type': 'cancelled', 'reason': reason})
+        return self._finish(f"任务已取消: {reason}", response_queue, status="cancelled")
+
+    def close(self):
+        """释放会话占用的资源（会话内核、转存的工具结果）"""
+        if self.session_id and Config.EXECUTE_CODE_STATEFUL:
+            from sandbox import get_kernel_manager
+            get_kernel_manager().shutdown_kernel(self.session_id)
+        # 运行还能从检查点恢复时保留转存的结果，恢复后记忆中引用的结果ID仍然有效
+        resumable = self.run_id is not None and self.last_status in RESUMABLE_STATUSES
+        if self._has_stored_results and not resumable:
+            from blob_store import get_blob_store
+            get_blob_store().drop_session(self.session_id)
+            self._has_stored_results = False
+
+    @staticmethod
+    def _emit(response_queue, event: dict):
+        """向前端队列发送事件，兼容queue.Queue和asyncio.Queue"""
+        if response_queue is not None:
+            response_queue.put_nowait(event)
 
     
     def _build_system_prompt(self) -> str:
         """构建系统提示"""
+        if self.native_tools:
+            return NATIVE_SYSTEM_PROMPT
    
         tools_desc = get_tools_description()
         return SYSTEM_PROMPT.format(tools=tools_desc)
     
+    def _prompt_tokens_saved(self) -> int:
+        """原生函数调用模式下，每轮比文本Action模式少发送的token数（估算，含工具定义）"""
+        if not self.native_tools:
+            return 0
+        text_prompt = SYSTEM_PROMPT.format(tools=get_tools_description())
+        return count_tokens(text_prompt) - count_tokens(self.system_prompt) - count_tools_tokens(self.tool_schemas)
+    
+    def _build_messages(self, response_queue=None) -> List[Dict[str, Any]]:
+        """在token预算内构建发送给模型的消息列表，并报告本轮上下文大小"""
+        messages, stats = self.context_manager.build_messages(self.system_prompt, self.memory, self.tool_schemas)
+        if self.native_tools:
+            stats["prompt_tokens_saved"] = self.prompt_tokens_saved
+        self.last_context_stats = stats
+        print(f"[上下文 ~{stats['prompt_tokens']} tokens, {stats['messages']} 条消息, "
+              f"折叠 {stats['collapsed']}, 丢弃 {stats['dropped']}]")
+        self._emit(response_queue, {'type': 'context_stats', **stats})
+        return messages
+    
     def _get_response_with_action(self, response_queue=None) -> tuple[str, dict, str]:
         """获取模型响应、解析Action并执行工具，返回响应、action和工具结果"""
         try:
-            # 构建消息列表
-            messages = [{"role": "system", "content": self.system_prompt}] + self.memory
-            
-            # 调用OpenAI API
-            response = self.client.chat.completions.create(
-                model=Config.MODEL_NAME,
-                messages=messages,
-                temperature=0.1,
-                stream=True
-            )
-            
-            # 收集流式响应
-            full_response = ""
-            for chunk in response:
-                if chunk.choices[0].delta.content:
-                    content = chunk.choices[0].delta.content
-                    print(content, end="", flush=True)
-                    full_response += content
-                    # 实时发送思考过程到前端
-                    if response_queue:
-                        response_queue.put({
-                            'type': 'thinking_stream',
-                            'content': content
-                        })
-                    # 检查是否遇到Observation，如果是则停止生成
-                    if "Observation:" in full_response:
-                        break
+            messages = self._build_messages(response_queue)
+            
+            # 获取模型响应
+            print(f"思考: ", end="", flush=True)
+            
+            # 调用模型并收集流式响应，连接失败或流中断时由LLM客户端重试；并发已满时先排队
+            emit = lambda event: self._emit(response_queue, event)
+            with self.scheduler.llm.slot(self.client_id, self._priority, self._queue_reporter("llm", emit),
+                                         self.cancel_token), \
+                    trace_span("llm.call", session_id=self.session_id) as span:
+                timing = {}
+                parser = self.llm.stream_chat(
+                    messages,
+                    lambda stream: self._consume_stream(stream, response_queue, timing),
+                    on_retry=lambda attempt, error, delay: self._on_stream_retry(attempt, error, delay, response_queue, span),
+                    cancel_token=self.cancel_token,
+                    **self._tool_request()
+                )
+                self._record_llm_span(span, parser, timing)
             
             print()  # 换行
-            # 解析Action
-            action = self._extract_action(full_response)
+            full_response = parser.text
+            action = parser.action
             
             # 如果解析到了action，执行工具并返回结果
             tool_result = None
             if action:
-                tool_name = action["name"]
-                arguments = action.get("arguments", {})
+                tool_name, arguments = self._announce_action(action, response_queue)
                 
-                # 发送工具调用信息到前端
-                if response_queue:
-                    response_queue.put({
-                        'type': 'tool_call', 
-                        'content': f'🔧 调用工具: {tool_name}\n📝 参数: {arguments}'
-                    })
-                
-                print(f"工具: {tool_name}")
-                print(f"参数: {arguments}")
-                
-                # 执行工具
-                if tool_name != "final_answer":
-                    tool_result = execute_tool(tool_name, arguments)
-                    # 发送工具执行结果到前端
-                    if response_queue:
-                        response_queue.put({'type': 'tool_result', 'content': f'✅ 执行结果:\n{str(tool_result)}'})
-                        response_queue.put({'type': 'tool_end'})
-
-                        response_queue.put({'type': 'thinking_stream', 'content': f':\n{str(tool_result)}\n\n'})
+                # 执行工具；参数无法解析时不执行，把错误作为结果交给模型重新调用
+                if action.get("error"):
+                    tool_result = self._store_tool_result(tool_name, self._argument_error(action), response_queue)
+                elif tool_name != "final_answer":
+                    context = self._tool_context(emit)
+                    with self.scheduler.tool.slot(self.client_id, self._priority, self._queue_reporter("tool", emit),
+                                                  self.cancel_token):
+                        tool_result = execute_tool(tool_name, arguments, context)
+                    # 执行中被取消的结果不写入记忆，恢复时重新执行这一步
+                    self.cancel_token.check()
+                    tool_result = self._store_tool_result(tool_name, tool_result, response_queue)
             
             return full_response, action, tool_result
             
+        except TaskCancelled:
+            raise
         except Exception as e:
-            print(f"\n获取响应失败: {str(e)}")
-            if response_queue:
-                response_queue.put({
-                    'type': 'final_answer',
-                    'content': f"获取响应失败: {str(e)}"
-                })
-                response_queue.put({'type': 'done'})
-            return "", None, None
+            # 交给run统一以failed结束，只发送一次最终答案，之后可以从检查点恢复
+            raise ResponseFailed(f"获取响应失败: {str(e)}") from e
     
-    def _extract_action(self, response: str) -> dict:
-        """从响应中提取Action"""
+    async def _aget_response_with_action(self, response_queue=None) -> tuple[str, dict, str]:
+        """_get_response_with_action的异步版本，阻塞的工具调用放到线程池执行"""
         try:
-            # 查找Action块的开始位置
-            action_start = response.find('Action:')
-            if action_start == -1:
-                return None
-            
-            # 从Action:后开始查找JSON
-            json_start = response.find('{', action_start)
-            if json_start == -1:
-                return None
-            
-            # 使用括号计数来找到完整的JSON
-            brace_count = 0
-            json_end = json_start
-            
-            for i in range(json_start, len(response)):
-                if response[i] == '{':
-                    brace_count += 1
-                elif response[i] == '}':
-                    brace_count -= 1
-                    if brace_count == 0:
-                        json_end = i + 1
-                        break
-            
-            if brace_count != 0:
-                return None
-            
-            # 提取JSON字符串并解析
-            action_str = response[json_start:json_end]
-            action = json.loads(action_str)
-            return action
+            messages = self._build_messages(response_queue)
+            print(f"思考: ", end="", flush=True)
+            
+            loop = asyncio.get_running_loop()
+            # 排队位置可能由其他线程释放资源时通知，需切回事件循环再放入asyncio.Queue
+            emit = lambda event: loop.call_soon_threadsafe(self._emit, response_queue, event)
+            async with self.scheduler.llm.aslot(self.client_id, self._priority, self._queue_reporter("llm", emit),
+                                                self.cancel_token):
+                with trace_span("llm.call", session_id=self.session_id) as span:
+                    timing = {}
+                    parser = await self.llm.astream_chat(
+                        messages,
+                        lambda stream: self._aconsume_stream(stream, response_queue, timing),
+                        on_retry=lambda attempt, error, delay: self._on_stream_retry(attempt, error, delay, response_queue, span),
+                        cancel_token=self.cancel_token,
+                        **self._tool_request()
+                    )
+                    self._record_llm_span(span, parser, timing)
             
+            print()  # 换行
+            full_response = parser.text
+            action = parser.action
+            
+            tool_result = None
+            if action:
+                tool_name, arguments = self._announce_action(action, response_queue)
+                
+                if action.get("error"):
+                    tool_result = self._store_tool_result(tool_name, self._argument_error(action), response_queue)
+                elif tool_name != "final_answer":
+                    # 工具在线程池中运行，输出事件同样切回事件循环
+                    context = self._tool_context(emit)
+                    # 复制当前上下文，使线程池中的工具span仍挂在本轮迭代下
+                    run_in_context = contextvars.copy_context().run
+                    async with self.scheduler.tool.aslot(self.client_id, self._priority, self._queue_reporter("tool", emit),
+                                                         self.cancel_token):
+                        tool_result = await loop.run_in_executor(
+                            None, run_in_context, execute_tool, tool_name, arguments, context
+                        )
+                    self.cancel_token.check()
+                    tool_result = self._store_tool_result(tool_name, tool_result, response_queue)
+            
+            return full_response, action, tool_result
+            
+        except TaskCancelled:
+            raise
         except Exception as e:
-            print(f"解析Action失败: {str(e)}")
-            return None
-
+            # 交给run统一以failed结束，只发送一次最终答案，之后可以从检查点恢复
+            raise ResponseFailed(f"获取响应失败: {str(e)}") from e
+    
+    def _consume_stream(self, stream, response_queue=None, timing=None):
+        """边接收边解析Action，Action已闭合或遇到Observation时关闭上游流
+        
+        每个片段之前检查取消标记，已取消时抛出TaskCancelled，由LLM客户端立即关闭上游流。
+        """
+        timing = self._reset_timing(timing)
+        parser = self._new_parser()
+        for chunk in stream:
+            self.cancel_token.check()
+            if chunk.choices:
+                visible = self._feed_parser(parser, chunk.choices[0], timing)
+                if visible:
+                    self._on_stream_content(visible, response_queue)
+                # 不再为丢弃的token付费
+                if parser.done:
+                    self._close_stream(stream)
+                    break
+        parser.finish()
+        timing["end"] = time.perf_counter()
+        return parser
+    
+    async def _aconsume_stream(self, stream, response_queue=None, timing=None):
+        """_consume_stream的异步版本"""
+        timing = self._reset_timing(timing)
+        parser = self._new_parser()
+        async for chunk in stream:
+            self.cancel_token.check()
+            if chunk.choices:
+                visible = self._feed_parser(parser, chunk.choices[0], timing)
+                if visible:
+                    self._on_stream_content(visible, response_queue)
+                if parser.done:
+                    await self._aclose_stream(stream)
+                    break
+        parser.finish()
+        timing["end"] = time.perf_counter()
+        return parser
+    
+    def _new_parser(self):
+        """文本模式从回复中解析Action，原生函数调用模式组装流式返回的tool_calls"""
+        return ToolCallParser() if self.native_tools else StreamingActionParser()
+    
+    def _tool_request(self) -> dict:
+        """原生函数调用模式下随请求发送的工具参数"""
+        return {"tools": self.tool_schemas} if self.native_tools else {}
+    
+    @staticmethod
+    def _reset_timing(timing: dict = None) -> dict:
+        """每次（重试）请求重新计时"""
+        timing = {} if timing is None else timing
+        timing.update(first_token=None, end=None, parse=0.0)
+        return timing
+    
+    @staticmethod
+    def _feed_parser(parser, choice, timing: dict) -> str:
+        now = time.perf_counter()
+        visible = parser.feed_choice(choice)
+        if timing["first_token"] is None and parser.started:
+            timing["first_token"] = now
+        timing["parse"] += time.perf_counter() - now
+        return visible
+    
+    def _record_llm_span(self, span, parser, timing: dict):
+        """记录本次模型调用的首token时间、生成速度和上下文/输出大小"""
+        completion_tokens = count_tokens(parser.completion_text)
+        span.set(
+            prompt_tokens=self.last_context_stats.get("prompt_tokens", 0),
+            prompt_tokens_saved=self.last_context_stats.get("prompt_tokens_saved", 0),
+            completion_tokens=completion_tokens,
+            parse_seconds=round(timing.get("parse", 0.0), 6),
+            action=(parser.action or {}).get("name")
+        )
+        first_token = timing.get("first_token")
+        if first_token is not None:
+            # 首token时间从本次调用（含重试）开始计算
+            span.set(ttft=round(first_token - span.started, 4))
+            streaming = (timing.get("end") or first_token) - first_token
+            if streaming > 0:
+                span.set(tokens_per_second=round(completion_tokens / streaming, 2))
+    
+    def _on_stream_retry(self, attempt: int, error: Exception, delay: float, response_queue=None, span=None):
+        """模型请求失败将重试：通知前端丢弃本轮已输出的部分内容"""
+        if span is not None:
+            span.set(retries=attempt)
+        print(f"\n模型请求失败，{delay:.1f}秒后第{attempt}次重试: {str(error)}")
+        self._emit(response_queue, {
+            'type': 'stream_retry',
+            'attempt': attempt,
+            'delay': round(delay, 2),
+            'error': str(error)
+        })
+        print(f"思考: ", end="", flush=True)
+    
+    def _on_stream_content(self, content: str, response_queue=None):
+        """处理模型输出的一个流式片段"""
+        print(content, end="", flush=True)
+        # 实时发送思考过程到前端
+        self._emit(response_queue, {
+            'type': 'thinking_stream',
+            'content': content
+        })
+    
+    def _announce_action(self, action: dict, response_queue=None) -> tuple[str, dict]:
+        """发送工具调用信息，返回工具名和参数"""
+        tool_name = action["name"]
+        arguments = action.get("arguments", {})
+        
+        # 发送工具调用信息到前端
+        self._emit(response_queue, {
+            'type': 'tool_call', 
+            'content': f'🔧 调用工具: {tool_name}\n📝 参数: {arguments}'
+        })
+        
+        print(f"工具: {tool_name}")
+        print(f"参数: {arguments}")
+        return tool_name, arguments
+    
+    @staticmethod
+    def _argument_error(action: dict) -> str:
+        return f"工具调用失败: {action['name']}的{action['error']}，工具未执行。请重新调用并提供完整的JSON参数"
+    
+    @staticmethod
+    def _queue_reporter(resource: str, emit):
+        """排队位置变化时通知前端，获得资源时position为0"""
+        def on_position(position: int):
+            if position:
+                print(f"\n等待{resource}资源，排队位置: {position}")
+            emit({'type': 'queue', 'resource': resource, 'position': position})
+        return on_position
+    
+    def _tool_context(self, emit) -> ToolContext:
+        """构建工具执行上下文，执行中的输出以tool_output事件实时推送"""
+        def on_output(stream: str, text: str):
+            print(text, end="", flush=True)
+            emit({'type': 'tool_output', 'stream': stream, 'content': text})
+        return ToolContext(session_id=self.session_id, on_output=on_output, cancel_token=self.cancel_token)
+    
+    def _store_tool_result(self, tool_name: str, tool_result, response_queue=None) -> str:
+        """发送工具结果到前端并返回写入记忆的文本
+        
+        过长的结果转存到磁盘，记忆和事件中只保留预览和结果ID，完整内容由前端按URL获取一次。
+        """
+        result = str(tool_result)
+        if len(result) <= Config.TOOL_RESULT_SPILL_CHARS or tool_name in _UNSPILLED_TOOLS:
+            self._emit_tool_result(result, response_queue)
+            return result
+        from blob_store import DEFAULT_SESSION, get_blob_store
+        try:
+            blob = get_blob_store().put(self.session_id, result, tool_name)
+        except Exception as e:
+            print(f"工具结果转存失败: {str(e)}")
+            self._emit_tool_result(result, response_queue)
+            return result
+        self._has_stored_results = True
+        summary = (f"{result[:Config.TOOL_RESULT_PREVIEW_CHARS]}\n...[完整结果共{blob.chars}字符、{blob.lines}行，"
+                   f"已保存为{blob.blob_id}，可用read_tool_result分段读取]")
+        self._emit_tool_result(summary, response_queue, {
+            **blob.to_dict(),
+            'url': f"/api/sessions/{self.session_id or DEFAULT_SESSION}/results/{blob.blob_id}"
+        })
+        return summary
+    
+    def _emit_tool_result(self, tool_result: str, response_queue=None, stored: dict = None):
+        """发送工具执行结果到前端"""
+        event = {'type': 'tool_result', 'content': f'✅ 执行结果:\n{tool_result}'}
+        if stored:
+            event['stored_result'] = stored
+        self._emit(response_queue, event)
+        self._emit(response_queue, {'type': 'tool_end'})
+        self._emit(response_queue, {'type': 'thinking_stream', 'content': f':\n{tool_result}\n\n'})
+    
+    def _extract_action(self, response: str) -> dict:
+        """从响应中提取Action"""
+        return extract_action(response)
+    
+    @staticmethod
+    def _close_stream(stream):
+        """关闭上游HTTP流"""
+        close_stream(stream)
+    
+    @staticmethod
+    async def _aclose_stream(stream):
+        """关闭上游异步HTTP流"""
+        await aclose_stream(stream)
 
 if __name__ == "__main__":
     agent = CodeAgent()
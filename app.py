@@ -1,17 +1,33 @@
-from flask import Flask, request, jsonify, Response, send_from_directory
+from flask import Flask, request, jsonify, Response, send_file, send_from_directory
 from flask_cors import CORS
 import json
 import threading
 import queue
 import os
-from agent import CodeAgent
+import time
+from cancellation import get_cancel_registry
+from chart_assets import ASSETS_DIR, prefetch_echarts_asset
+from checkpoint_store import RESUMABLE_STATUSES, get_checkpoint_store
 from config import Config
+from llm_client import get_llm_client
+from sandbox import get_sandbox
+from scheduler import SchedulerFullError, get_scheduler
+from session_pool import AgentSessionPool, SessionBusyError, SessionLimitError
+from tracing import register_counter, register_gauge, render_metrics
+from workspace_index import get_workspace_index
 
 app = Flask(__name__, static_folder='frontend', template_folder='frontend')
 CORS(app)
 
-# 全局Agent实例
-agent = CodeAgent()
+# 按会话隔离的Agent池
+agent_pool = AgentSessionPool()
+register_gauge("agent_sessions_active", "当前存活的会话数", lambda: agent_pool.stats()["active"])
+register_gauge("agent_sessions_busy", "正在执行任务的会话数", lambda: agent_pool.stats()["busy"])
+register_gauge("llm_requests_in_flight", "正在进行的模型请求数", lambda: get_llm_client().stats()["in_flight"])
+register_counter("llm_retries_total", "模型请求累计重试次数", lambda: get_llm_client().stats()["retries"])
+register_gauge("scheduler_llm_waiting", "排队等待模型调用的请求数", lambda: get_scheduler().llm.waiting())
+register_gauge("scheduler_tool_waiting", "排队等待执行的工具调用数", lambda: get_scheduler().tool.waiting())
+register_counter("agent_runs_cancelled_total", "客户端断开或主动取消的任务累计数", lambda: get_cancel_registry().stats()["cancelled"])
 
 @app.route('/')
 def index():
@@ -31,31 +47,53 @@ def static_files(filename):
         response.headers['Expires'] = '0'
     return response
 
-@app.route('/api/chat', methods=['POST'])
-def chat():
-    """处理聊天请求"""
-    try:
-        data = request.get_json()
-        if not data or 'message' not in data:
-            return jsonify({'error': '缺少消息内容'}), 400
-        
-        user_message = data['message']
-        response_queue = queue.Queue()
-        
-        def run_agent():
-            """在新线程中运行Agent"""
-            try:
-                agent.run(user_message, response_queue)
-            except Exception as e:
-                response_queue.put({'type': 'error', 'content': str(e)})
-        
-        def generate_sse():
-            """生成SSE格式的流式响应"""
-            # 启动Agent线程
-            agent_thread = threading.Thread(target=run_agent)
-            agent_thread.daemon = True
-            agent_thread.start()
-            
+def sse_event(event: dict) -> str:
+    """SSE格式的一条事件，带seq的事件同时作为事件ID，断线后可从此处回放"""
+    if 'seq' in event:
+        return f"id: {event['seq']}\ndata: {json.dumps(event)}\n\n"
+    return f"data: {json.dumps(event)}\n\n"
+
+def client_id_of(req) -> str:
+    """调度器按客户端限流：优先使用X-Client-Id请求头，否则使用客户端地址"""
+    return req.headers.get('X-Client-Id') or req.remote_addr or 'anonymous'
+
+def busy_response(error: SchedulerFullError):
+    response = jsonify({'error': str(error)})
+    response.status_code = 429
+    response.headers['Retry-After'] = str(error.retry_after)
+    return response
+
+def _stream_agent(session, run_agent_task, release_task):
+    """在后台线程中运行run_agent_task(response_queue, cancel_token)，以SSE流式返回事件
+    
+    客户端断开时取消任务，不再为没人接收的输出消耗模型token和执行资源。
+    """
+    response_queue = queue.Queue()
+    response_queue.put({'type': 'session', 'session_id': session.session_id})
+    cancel_registry = get_cancel_registry()
+    cancel_token = cancel_registry.register(session.session_id)
+    finished = threading.Event()
+    
+    def run_agent():
+        """在新线程中运行Agent"""
+        try:
+            run_agent_task(response_queue, cancel_token)
+        except Exception as e:
+            response_queue.put({'type': 'error', 'content': str(e)})
+        finally:
+            finished.set()
+            cancel_registry.unregister(session.session_id, cancel_token)
+            agent_pool.release(session)
+            release_task()
+    
+    # 会话已被占用，立即启动Agent线程，确保占用一定会被释放
+    agent_thread = threading.Thread(target=run_agent)
+    agent_thread.daemon = True
+    agent_thread.start()
+    
+    def generate_sse():
+        """生成SSE格式的流式响应"""
+        try:
             while True:
                 try:
                     # 获取响应数据
@@ -69,63 +107,297 @@ def chat():
                         break
                     else:
                         # 发送所有类型的消息
-                        yield f"data: {json.dumps(response_data)}\n\n"
+                        yield sse_event(response_data)
                         
                 except queue.Empty:
-                    # 发送心跳
+                    # 发送心跳，客户端已断开时在这里写入失败
                     yield f"data: {json.dumps({'heartbeat': True})}\n\n"
                     continue
+        except GeneratorExit:
+            # 客户端断开时生成器在yield处被关闭
+            if Config.CANCEL_ON_DISCONNECT and not finished.is_set():
+                cancel_registry.cancel_token(cancel_token, "客户端已断开")
+            raise
+    
+    return Response(
+        generate_sse(),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'Connection': 'keep-alive',
+            'Access-Control-Allow-Origin': '*',
+            'X-Session-Id': session.session_id
+        }
+    )
+
+@app.route('/api/chat', methods=['POST'])
+def chat():
+    """处理聊天请求"""
+    try:
+        data = request.get_json()
+        if not data or 'message' not in data:
+            return jsonify({'error': '缺少消息内容'}), 400
+        
+        user_message = data['message']
+        client_id = client_id_of(request)
+        # 队列已满时在占用会话之前快速拒绝
+        try:
+            release_task = get_scheduler().admit(client_id)
+        except SchedulerFullError as e:
+            return busy_response(e)
+        try:
+            session = agent_pool.acquire(data.get('session_id'))
+        except SessionBusyError as e:
+            release_task()
+            return jsonify({'error': str(e)}), 409
+        except SessionLimitError as e:
+            release_task()
+            return jsonify({'error': str(e)}), 503
         
-        return Response(
-            generate_sse(),
-            mimetype='text/event-stream',
-            headers={
-                'Cache-Control': 'no-cache',
-                'Connection': 'keep-alive',
-                'Access-Control-Allow-Origin': '*'
-            }
+        return _stream_agent(
+            session,
+            lambda response_queue, cancel_token: session.agent.run(
+                user_message, response_queue, client_id=client_id, cancel_token=cancel_token
+            ),
+            release_task
         )
         
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/chat/<session_id>/cancel', methods=['POST'])
+def cancel_chat(session_id):
+    """取消会话中进行中的任务，运行记为cancelled，之后可以从最后一个检查点恢复"""
+    if get_cancel_registry().cancel(session_id, "用户取消"):
+        return jsonify({'success': True})
+    return jsonify({'success': False, 'error': '会话没有进行中的任务'}), 404
+
+@app.route('/api/sessions/<session_id>/resume', methods=['POST'])
+def resume_session(session_id):
+    """从最后一个检查点继续会话中被中断的运行"""
+    run = get_checkpoint_store().latest_run(session_id)
+    if run is None or run['status'] not in RESUMABLE_STATUSES:
+        return jsonify({'error': '会话没有可恢复的运行'}), 404
+    client_id = client_id_of(request)
+    try:
+        release_task = get_scheduler().admit(client_id)
+    except SchedulerFullError as e:
+        return busy_response(e)
+    try:
+        session = agent_pool.acquire(session_id)
+    except SessionBusyError as e:
+        release_task()
+        return jsonify({'error': str(e)}), 409
+    except SessionLimitError as e:
+        release_task()
+        return jsonify({'error': str(e)}), 503
+    
+    return _stream_agent(
+        session,
+        lambda response_queue, cancel_token: session.agent.run(
+            None, response_queue, resume_run_id=run['run_id'], client_id=client_id, cancel_token=cancel_token
+        ),
+        release_task
+    )
+
+@app.route('/api/sessions/<session_id>/events', methods=['GET'])
+def replay_session_events(session_id):
+    """回放会话中seq大于cursor的事件；运行仍在进行时继续推送新事件直到结束
+    
+    cursor可通过查询参数或Last-Event-ID请求头指定，缺省时从最近一次运行的开头回放。
+    """
+    store = get_checkpoint_store()
+    cursor = request.args.get('cursor', type=int)
+    if cursor is None and request.headers.get('Last-Event-ID', '').isdigit():
+        cursor = int(request.headers['Last-Event-ID'])
+    if cursor is None:
+        run = store.latest_run(session_id)
+        if run is None:
+            return jsonify({'error': '会话没有事件记录'}), 404
+        cursor = (store.first_seq(run['run_id']) or 1) - 1
+    
+    def generate_sse():
+        position = cursor
+        idle_since = time.monotonic()
+        while True:
+            events = store.events_after(session_id, position)
+            for event in events:
+                position = event['seq']
+                yield sse_event(event)
+            if events:
+                idle_since = time.monotonic()
+                continue
+            run = store.latest_run(session_id)
+            if run is None or run['status'] != 'running':
+                yield "data: [DONE]\n\n"
+                break
+            if time.monotonic() - idle_since >= Config.SSE_HEARTBEAT_INTERVAL:
+                idle_since = time.monotonic()
+                yield f"data: {json.dumps({'heartbeat': True})}\n\n"
+            time.sleep(Config.EVENT_REPLAY_POLL_INTERVAL)
+    
+    return Response(
+        generate_sse(),
+        mimetype='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'Access-Control-Allow-Origin': '*',
+            'X-Session-Id': session_id
+        }
+    )
+
+def resume_interrupted_runs() -> int:
+    """在后台恢复上次进程退出时被中断的运行，返回恢复的数量"""
+    resumed = 0
+    for run in get_checkpoint_store().resumable_runs():
+        try:
+            session = agent_pool.acquire(run['session_id'])
+        except (SessionBusyError, SessionLimitError):
+            continue
+        
+        def run_agent(session=session, run_id=run['run_id']):
+            # 后台恢复的运行同样可以通过取消接口停止
+            cancel_registry = get_cancel_registry()
+            cancel_token = cancel_registry.register(session.session_id)
+            try:
+                session.agent.run(None, resume_run_id=run_id, cancel_token=cancel_token)
+            finally:
+                cancel_registry.unregister(session.session_id, cancel_token)
+                agent_pool.release(session)
+        
+        threading.Thread(target=run_agent, daemon=True).start()
+        resumed += 1
+    return resumed
+
 @app.route('/api/workspace/files', methods=['GET'])
 def get_workspace_files():
-    """获取工作空间文件列表"""
+    """获取工作空间文件列表（来自工作空间索引，支持分页和通配符过滤）"""
     try:
         if not os.path.exists(Config.WORKSPACE_PATH):
             return jsonify({'success': False, 'files': [], 'message': 'Workspace not initialized'})
         
-        files = []
-        for root, dirs, filenames in os.walk(Config.WORKSPACE_PATH):
-            for filename in filenames:
-                rel_path = os.path.relpath(os.path.join(root, filename), Config.WORKSPACE_PATH)
-                files.append(rel_path)
+        offset = request.args.get('offset', 0, type=int)
+        limit = request.args.get('limit', type=int)
+        entries, total = get_workspace_index().list(
+            request.args.get('directory', ''),
+            pattern=request.args.get('pattern') or None,
+            offset=offset,
+            limit=limit
+        )
+        files = [entry['path'] for entry in entries]
         
-        return jsonify({'success': True, 'files': files})
+        return jsonify({
+            'success': True,
+            'files': files,
+            'entries': entries,
+            'total': total,
+            'offset': offset,
+            'limit': limit
+        })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
 @app.route('/api/workspace/file/<path:filename>', methods=['GET'])
 def get_workspace_file(filename):
-    """获取工作空间文件内容"""
+    """获取工作空间文件内容（JSON预览，超过大小上限时截断）"""
     try:
-        full_path = os.path.join(Config.WORKSPACE_PATH, filename)
+        full_path = os.path.abspath(os.path.join(Config.WORKSPACE_PATH, filename))
         
         # 安全检查：防止路径遍历攻击
-        if not os.path.commonpath([full_path, Config.WORKSPACE_PATH]) == Config.WORKSPACE_PATH:
+        if not os.path.commonpath([full_path, os.path.abspath(Config.WORKSPACE_PATH)]) == os.path.abspath(Config.WORKSPACE_PATH):
             return jsonify({'success': False, 'error': 'File path is outside workspace'}), 400
         
-        if not os.path.exists(full_path):
+        if not os.path.isfile(full_path):
             return jsonify({'success': False, 'error': 'File not found'}), 404
         
-        with open(full_path, 'r', encoding='utf-8') as f:
-            content = f.read()
+        max_bytes = request.args.get('max_bytes', Config.WORKSPACE_PREVIEW_MAX_BYTES, type=int)
+        if max_bytes < 1:
+            return jsonify({'success': False, 'error': 'max_bytes must be at least 1'}), 400
+        max_bytes = min(max_bytes, Config.WORKSPACE_PREVIEW_MAX_BYTES)
+        size = os.path.getsize(full_path)
+        with open(full_path, 'rb') as f:
+            data = f.read(max_bytes)
+        truncated = size > len(data)
+        # 截断位置可能落在多字节字符中间，忽略末尾不完整的字符
+        content = data.decode('utf-8', errors='ignore' if truncated else 'replace')
         
-        return jsonify({'success': True, 'content': content, 'filename': filename})
+        return jsonify({
+            'success': True,
+            'content': content,
+            'filename': filename,
+            'size': size,
+            'truncated': truncated,
+            'raw_url': f"/api/workspace/raw/{filename}"
+        })
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)}), 500
 
+@app.route('/api/workspace/raw/<path:filename>', methods=['GET'])
+def get_workspace_raw_file(filename):
+    """流式返回工作空间文件原始内容，支持ETag/Last-Modified条件请求和Range请求"""
+    response = send_from_directory(Config.WORKSPACE_PATH, filename, conditional=True, etag=True)
+    if filename.startswith(ASSETS_DIR + '/'):
+        # 共享资源文件名带版本号，内容不会变化，允许浏览器长期缓存
+        response.cache_control.no_cache = None
+        response.cache_control.public = True
+        response.cache_control.max_age = Config.ECHARTS_ASSET_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        # 每次使用前用ETag重新验证，文件未变化时返回304
+        response.cache_control.no_cache = True
+    if response.mimetype and (response.mimetype.startswith('text/') or response.mimetype in ('application/json', 'application/javascript')):
+        response.headers['Content-Type'] = f"{response.mimetype}; charset=utf-8"
+    return response
+
+@app.route('/api/sessions', methods=['GET'])
+def get_sessions():
+    """获取会话池状态"""
+    return jsonify({'success': True, **agent_pool.stats()})
+
+@app.route('/api/sessions/<session_id>', methods=['DELETE'])
+def delete_session(session_id):
+    """删除空闲会话"""
+    if agent_pool.remove(session_id):
+        return jsonify({'success': True})
+    return jsonify({'success': False, 'error': '会话不存在或正在执行任务'}), 409
+
+@app.route('/api/sessions/<session_id>/kernel/reset', methods=['POST'])
+def reset_session_kernel(session_id):
+    """清空会话内核中的变量"""
+    from sandbox import get_kernel_manager
+    if get_kernel_manager().reset(session_id):
+        return jsonify({'success': True})
+    return jsonify({'success': False, 'error': '会话内核不存在'}), 404
+
+@app.route('/api/sessions/<session_id>/results/<result_id>', methods=['GET'])
+def get_stored_result(session_id, result_id):
+    """获取转存的完整工具结果"""
+    from blob_store import get_blob_store
+    blob = get_blob_store().get(session_id, result_id)
+    if blob is None:
+        return jsonify({'success': False, 'error': '结果不存在或已过期'}), 404
+    response = send_file(blob.path, mimetype='text/plain; charset=utf-8', conditional=True)
+    # 结果写入后不再变化
+    response.cache_control.no_cache = None
+    response.cache_control.private = True
+    response.cache_control.max_age = 3600
+    return response
+
+@app.route('/api/llm/stats', methods=['GET'])
+def get_llm_stats():
+    """LLM客户端的请求、重试和连接池统计"""
+    return jsonify(get_llm_client().stats())
+
+@app.route('/api/scheduler/stats', methods=['GET'])
+def get_scheduler_stats():
+    """调度器的任务数、拒绝次数以及模型调用/工具执行的并发与排队情况"""
+    return jsonify(get_scheduler().stats())
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus指标：迭代、模型调用和工具执行的耗时直方图与计数"""
+    return Response(render_metrics(), mimetype='text/plain; version=0.0.4')
+
 @app.route('/api/health', methods=['GET'])
 def health():
     """健康检查接口"""
@@ -134,4 +406,11 @@ def health():
 if __name__ == '__main__':
     print("🚀 启动 Code Agent 前端服务...")
     print("📍 访问地址: http://localhost:5000")
+    # 调试模式的重载器会再启动一个子进程运行应用，父进程只负责监视文件，
+    # 进程池、资源预取和运行恢复都只在子进程中进行
+    if os.environ.get('WERKZEUG_RUN_MAIN') == 'true':
+        get_sandbox().start()
+        prefetch_echarts_asset()
+        if Config.CHECKPOINT_AUTO_RESUME:
+            print(f"已恢复 {resume_interrupted_runs()} 个被中断的运行")
     app.run(host='0.0.0.0', port=5000, debug=True, threaded=True)
\ No newline at end of file
@@ -0,0 +1,128 @@
+import asyncio
+import json
+from concurrent.futures import ThreadPoolExecutor
+from starlette.applications import Starlette
+from starlette.middleware.wsgi import WSGIMiddleware
+from starlette.requests import Request
+from starlette.responses import JSONResponse, StreamingResponse
+from starlette.routing import Mount, Route
+from app import app as flask_app, agent_pool, resume_interrupted_runs, sse_event
+from cancellation import get_cancel_registry
+from chart_assets import prefetch_echarts_asset
+from config import Config
+from sandbox import get_sandbox
+from scheduler import SchedulerFullError, get_scheduler
+from session_pool import SessionBusyError, SessionLimitError
+
+# 保持对后台Agent任务的引用，防止被垃圾回收
+_running_tasks = set()
+
+
+async def chat(request: Request):
+    """基于asyncio的聊天接口，事件格式与Flask版本的/api/chat一致"""
+    try:
+        data = await request.json()
+    except ValueError:
+        data = None
+    if not data or 'message' not in data:
+        return JSONResponse({'error': '缺少消息内容'}, status_code=400)
+
+    user_message = data['message']
+    client_id = request.headers.get('X-Client-Id') or (request.client.host if request.client else 'anonymous')
+    try:
+        release_task = get_scheduler().admit(client_id)
+    except SchedulerFullError as e:
+        return JSONResponse({'error': str(e)}, status_code=429, headers={'Retry-After': str(e.retry_after)})
+    try:
+        session = agent_pool.acquire(data.get('session_id'))
+    except SessionBusyError as e:
+        release_task()
+        return JSONResponse({'error': str(e)}, status_code=409)
+    except SessionLimitError as e:
+        release_task()
+        return JSONResponse({'error': str(e)}, status_code=503)
+
+    response_queue = asyncio.Queue()
+    response_queue.put_nowait({'type': 'session', 'session_id': session.session_id})
+    cancel_registry = get_cancel_registry()
+    cancel_token = cancel_registry.register(session.session_id)
+
+    async def run_agent():
+        """在事件循环中运行Agent"""
+        try:
+            await session.agent.arun(user_message, response_queue, client_id=client_id, cancel_token=cancel_token)
+        except Exception as e:
+            response_queue.put_nowait({'type': 'error', 'content': str(e)})
+        finally:
+            cancel_registry.unregister(session.session_id, cancel_token)
+            agent_pool.release(session)
+            release_task()
+
+    task = asyncio.create_task(run_agent())
+    _running_tasks.add(task)
+    task.add_done_callback(_running_tasks.discard)
+
+    async def generate_sse():
+        """生成SSE格式的流式响应，事件到达即发送，空闲时才发送心跳"""
+        try:
+            while True:
+                try:
+                    response_data = await asyncio.wait_for(
+                        response_queue.get(), timeout=Config.SSE_HEARTBEAT_INTERVAL
+                    )
+                except asyncio.TimeoutError:
+                    yield f"data: {json.dumps({'heartbeat': True})}\n\n"
+                    continue
+
+                if response_data['type'] == 'done':
+                    yield "data: [DONE]\n\n"
+                    break
+                elif response_data['type'] == 'error':
+                    yield f"data: {json.dumps({'error': response_data['content']})}\n\n"
+                    break
+                else:
+                    yield sse_event(response_data)
+        except (asyncio.CancelledError, GeneratorExit):
+            # 客户端断开时StreamingResponse取消本生成器，同时取消Agent任务
+            if Config.CANCEL_ON_DISCONNECT and not task.done():
+                cancel_registry.cancel_token(cancel_token, "客户端已断开")
+            raise
+
+    return StreamingResponse(
+        generate_sse(),
+        media_type='text/event-stream',
+        headers={
+            'Cache-Control': 'no-cache',
+            'Connection': 'keep-alive',
+            'Access-Control-Allow-Origin': '*',
+            'X-Session-Id': session.session_id
+        }
+    )
+
+
+def configure_executor():
+    """设置执行阻塞工具调用的线程池大小"""
+    loop = asyncio.get_running_loop()
+    loop.set_default_executor(ThreadPoolExecutor(max_workers=Config.TOOL_EXECUTOR_WORKERS))
+
+
+def resume_on_startup():
+    if Config.CHECKPOINT_AUTO_RESUME:
+        print(f"已恢复 {resume_interrupted_runs()} 个被中断的运行")
+
+
+# 聊天接口走原生异步实现，其余接口沿用Flask应用
+app = Starlette(
+    routes=[
+        Route('/api/chat', chat, methods=['POST']),
+        Mount('/', app=WSGIMiddleware(flask_app)),
+    ],
+    on_startup=[configure_executor, get_sandbox().start, prefetch_echarts_asset, resume_on_startup]
+)
+
+
+if __name__ == '__main__':
+    import uvicorn
+    print("🚀 启动 Code Agent 异步服务...")
+    print("📍 访问地址: http://localhost:5000")
+    uvicorn.run(app, host='0.0.0.0', port=5000)
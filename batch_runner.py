@@ -0,0 +1,409 @@
+"""批量运行任务：从JSONL文件读取任务，多个Agent并发执行，结果和每个任务的耗时写入JSONL
+
+任务文件每行一个JSON对象，task字段为任务内容，id字段可选（默认按行号生成）；
+也可以用--template按其余字段生成任务内容：
+
+    {"id": "sales", "dept": "销售部"}
+    {"id": "tech", "dept": "技术部"}
+
+    # 4个Agent并发，每个任务的工作空间从workspace目录复制而来
+    python batch_runner.py depts.jsonl --template "为{dept}的工资分布生成一张柱状图" --seed workspace -c 4
+
+    # 全部任务最多消耗50万token、运行1小时，预算用尽时停止调度并取消进行中的任务
+    python batch_runner.py depts.jsonl --token-budget 500000 --time-budget 3600
+
+每个任务在单独的子进程中运行，工作空间、转存的工具结果和控制台日志都放在运行目录
+（默认batch_runs/<任务文件名>）下以任务ID命名的子目录中。结果文件中已有completed或incomplete
+记录的任务在再次运行同一命令时跳过，被中断、取消或出错的任务会重新运行。
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import re
+import shutil
+import sys
+import threading
+import time
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import redirect_stderr, redirect_stdout
+from typing import Any, Dict, List, Optional, Set
+
+from config import Config
+
+# 已有这些状态的结果时续跑跳过；cancelled和error的任务重新运行
+FINISHED_STATUSES = ("completed", "incomplete")
+BUDGET_EXHAUSTED = "批处理预算已用尽"
+DEFAULT_RUN_ROOT = os.path.join(os.path.dirname(os.path.abspath(__file__)), "batch_runs")
+
+_UNSAFE_NAME = re.compile(r'[^A-Za-z0-9_.\-一-鿿]')
+
+# 子进程中由_init_worker设置：共享的token计数、停止标记和token预算
+_shared: Dict[str, Any] = {}
+
+
+def load_tasks(path: str, template: str = None) -> List[Dict[str, Any]]:
+    """读取任务文件，返回[{id, task}]；格式错误或ID重复时抛出ValueError"""
+    tasks = []
+    seen = set()
+    with open(path, 'r', encoding='utf-8') as f:
+        for line_no, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError as e:
+                raise ValueError(f"第{line_no}行不是合法的JSON: {e}") from None
+            if isinstance(record, str):
+                record = {"task": record}
+            if not isinstance(record, dict):
+                raise ValueError(f"第{line_no}行应为JSON对象或字符串")
+            text = record.get("task")
+            if text is None and template:
+                try:
+                    text = template.format(**record)
+                except (KeyError, IndexError) as e:
+                    raise ValueError(f"第{line_no}行缺少模板字段: {e}") from None
+            if not text:
+                raise ValueError(f"第{line_no}行缺少task字段")
+            task_id = str(record.get("id") or f"task-{line_no:05d}")
+            name = _dir_name(task_id)
+            if name in seen:
+                raise ValueError(f"第{line_no}行的任务ID重复: {task_id}")
+            seen.add(name)
+            tasks.append({"id": task_id, "task": text})
+    return tasks
+
+
+def load_finished(output_path: str) -> Set[str]:
+    """结果文件中已经完成的任务ID；中断时写了一半的行忽略"""
+    finished = set()
+    if not os.path.exists(output_path):
+        return finished
+    with open(output_path, 'r', encoding='utf-8') as f:
+        for line in f:
+            try:
+                record = json.loads(line)
+            except json.JSONDecodeError:
+                continue
+            if isinstance(record, dict) and record.get("status") in FINISHED_STATUSES:
+                finished.add(str(record.get("id")))
+    return finished
+
+
+def _dir_name(task_id: str) -> str:
+    return _UNSAFE_NAME.sub("_", task_id)[:100] or "_"
+
+
+# ------------------------------------------------------------ 子进程
+
+
+class _TaskStats:
+    """span接收方：汇总单个任务的轮次、模型调用、工具执行和token用量
+
+    token同时累加到批处理共享的计数中，超过预算时设置停止标记，所有进行中的任务随之取消。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.iterations = 0
+        self.llm_calls = 0
+        self.llm_errors = 0
+        self.llm_seconds = 0.0
+        self.ttft: List[float] = []
+        self.tool_calls = 0
+        self.tool_seconds = 0.0
+        self.prompt_tokens = 0
+        self.completion_tokens = 0
+
+    def __call__(self, span):
+        attributes = span.attributes
+        with self._lock:
+            if span.name == "agent.iteration":
+                self.iterations += 1
+            elif span.name == "tool.execute":
+                self.tool_calls += 1
+                self.tool_seconds += span.duration
+            elif span.name == "llm.call":
+                self.llm_calls += 1
+                if span.status == "error":
+                    self.llm_errors += 1
+                self.llm_seconds += span.duration
+                if attributes.get("ttft") is not None:
+                    self.ttft.append(attributes["ttft"])
+                prompt_tokens = attributes.get("prompt_tokens", 0)
+                completion_tokens = attributes.get("completion_tokens", 0)
+                self.prompt_tokens += prompt_tokens
+                self.completion_tokens += completion_tokens
+                self._charge(prompt_tokens + completion_tokens)
+
+    @staticmethod
+    def _charge(tokens: int):
+        tokens_used = _shared.get("tokens_used")
+        if tokens_used is None or not tokens:
+            return
+        with tokens_used.get_lock():
+            tokens_used.value += tokens
+            total = tokens_used.value
+        budget = _shared.get("token_budget")
+        if budget and total >= budget:
+            _shared["stop"].set()
+
+    def to_dict(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "iterations": self.iterations,
+                "llm_calls": self.llm_calls,
+                "llm_errors": self.llm_errors,
+                "llm_seconds": round(self.llm_seconds, 3),
+                "ttft_mean": round(sum(self.ttft) / len(self.ttft), 3) if self.ttft else None,
+                "tool_calls": self.tool_calls,
+                "tool_seconds": round(self.tool_seconds, 3),
+                "prompt_tokens": self.prompt_tokens,
+                "completion_tokens": self.completion_tokens
+            }
+
+
+def _init_worker(overrides: Dict[str, Any], tokens_used, stop, token_budget: int):
+    """子进程初始化：应用命令行覆盖的配置，保存共享的计数和停止标记"""
+    for key, value in overrides.items():
+        setattr(Config, key, value)
+    _shared.update(tokens_used=tokens_used, stop=stop, token_budget=token_budget)
+
+
+def _watch_stop(cancel_token, done: threading.Event):
+    """预算用尽（停止标记被设置）时取消本进程中运行的任务"""
+    stop = _shared.get("stop")
+    if stop is None:
+        return
+    while not done.wait(Config.CANCEL_POLL_INTERVAL * 5):
+        if stop.is_set():
+            cancel_token.cancel(BUDGET_EXHAUSTED)
+            return
+
+
+def _task_status(last_status: Optional[str], stats: _TaskStats) -> str:
+    """结果记录的状态；模型调用失败过的运行一律记为error，续跑时重新执行"""
+    if last_status == "cancelled":
+        return "cancelled"
+    if last_status not in FINISHED_STATUSES or stats.llm_errors:
+        return "error"
+    return last_status
+
+
+def _run_task(task: Dict[str, Any], run_dir: str, seed: Optional[str]) -> Dict[str, Any]:
+    """在子进程中运行一个任务，返回结果记录
+
+    工作空间每次运行都从seed重新复制，之前未完成的运行留下的文件不会带入。
+    """
+    name = _dir_name(task["id"])
+    workspace = os.path.join(run_dir, "workspaces", name)
+    shutil.rmtree(workspace, ignore_errors=True)
+    if seed:
+        shutil.copytree(seed, workspace)
+    else:
+        os.makedirs(workspace)
+    # 工具、沙箱和工作空间索引都在首次使用时读取这些配置，必须在导入Agent之前设置
+    Config.WORKSPACE_PATH = workspace
+    Config.BLOB_STORE_PATH = os.path.join(run_dir, "tool_results", name)
+    log_path = os.path.join(run_dir, "logs", f"{name}.log")
+
+    from cancellation import CancelToken
+    from tracing import add_sink, remove_sink
+
+    stats = _TaskStats()
+    cancel_token = CancelToken()
+    done = threading.Event()
+    record: Dict[str, Any] = {"id": task["id"], "task": task["task"], "workspace": workspace, "log": log_path}
+    started_at = time.time()
+    start = time.perf_counter()
+    startup = None
+    add_sink(stats)
+    threading.Thread(target=_watch_stop, args=(cancel_token, done), daemon=True).start()
+    try:
+        with open(log_path, 'w', encoding='utf-8') as log, redirect_stdout(log), redirect_stderr(log):
+            from agent import CodeAgent
+            agent = CodeAgent()
+            startup = time.perf_counter() - start
+            try:
+                answer = agent.run(task["task"], cancel_token=cancel_token)
+            finally:
+                agent.close()
+        record.update(status=_task_status(agent.last_status, stats), answer=answer)
+        if record["status"] == "error":
+            record["error"] = answer
+        elif record["status"] == "cancelled":
+            record["error"] = cancel_token.reason
+    except Exception as e:
+        record.update(status="error", answer=None, error=f"{type(e).__name__}: {str(e)}")
+    finally:
+        done.set()
+        remove_sink(stats)
+    total = time.perf_counter() - start
+    record["started_at"] = started_at
+    record["finished_at"] = time.time()
+    record["timings"] = {"total": round(total, 3), "startup": round(startup, 3) if startup is not None else None,
+                         **stats.to_dict()}
+    return record
+
+
+# ------------------------------------------------------------ 调度
+
+
+def _append_record(out, record: Dict[str, Any]):
+    """追加一条结果并落盘，进程随时被中断也不会丢失已完成任务的结果"""
+    out.write(json.dumps(record, ensure_ascii=False) + "\n")
+    out.flush()
+    os.fsync(out.fileno())
+
+
+def _open_output(path: str):
+    """以追加方式打开结果文件；上次中断时最后一行没写完的，先补上换行"""
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    out = open(path, 'a+', encoding='utf-8')
+    if out.tell() > 0:
+        out.seek(out.tell() - 1)
+        if out.read(1) != "\n":
+            out.write("\n")
+    return out
+
+
+def run_batch(tasks: List[Dict[str, Any]], run_dir: str, output: str, concurrency: int = 4,
+              seed: str = None, token_budget: int = 0, time_budget: float = 0,
+              overrides: Dict[str, Any] = None) -> Dict[str, Any]:
+    """并发运行结果文件中尚未完成的任务，返回汇总
+
+    同时运行的任务数不超过concurrency；token或时间预算用尽后不再启动新任务，
+    进行中的任务被取消并记为cancelled，下次运行时重新执行。
+    """
+    finished = load_finished(output)
+    pending = [task for task in tasks if task["id"] not in finished]
+    for sub in ("workspaces", "logs", "tool_results"):
+        os.makedirs(os.path.join(run_dir, sub), exist_ok=True)
+    if seed:
+        seed = os.path.abspath(seed)
+
+    # 每个任务使用全新的子进程：配置、沙箱进程池和各类进程级单例都不会在任务间共享
+    context = multiprocessing.get_context("spawn")
+    tokens_used = context.Value('q', 0)
+    stop = context.Event()
+    deadline = time.monotonic() + time_budget if time_budget else None
+    statuses: Counter = Counter()
+    submitted = 0
+    aborted = None
+    start = time.perf_counter()
+
+    print(f"共{len(tasks)}个任务，已完成{len(tasks) - len(pending)}个，本次运行{len(pending)}个（并发{concurrency}）")
+    with _open_output(output) as out, ProcessPoolExecutor(
+        max_workers=concurrency, mp_context=context, max_tasks_per_child=1,
+        initializer=_init_worker, initargs=(overrides or {}, tokens_used, stop, token_budget)
+    ) as pool:
+        queue = iter(pending)
+        running = {}
+        try:
+            while True:
+                while not stop.is_set() and aborted is None and len(running) < concurrency:
+                    task = next(queue, None)
+                    if task is None:
+                        break
+                    running[pool.submit(_run_task, task, run_dir, seed)] = task
+                    submitted += 1
+                if not running:
+                    break
+                done, _ = wait(running, timeout=1.0, return_when=FIRST_COMPLETED)
+                if deadline is not None and time.monotonic() >= deadline and not stop.is_set():
+                    print(f"已达到时间预算{time_budget}秒，停止调度并取消进行中的任务")
+                    stop.set()
+                for future in done:
+                    task = running.pop(future)
+                    try:
+                        record = future.result()
+                    except BrokenProcessPool as e:
+                        # 子进程异常退出后进程池不可用，未写入结果的任务留待下次运行
+                        aborted = f"子进程异常退出: {str(e)}"
+                        stop.set()
+                        continue
+                    except Exception as e:
+                        record = {"id": task["id"], "task": task["task"], "status": "error",
+                                  "error": f"{type(e).__name__}: {str(e)}"}
+                    _append_record(out, record)
+                    statuses[record["status"]] += 1
+                    timings = record.get("timings", {})
+                    print(f"[{sum(statuses.values())}/{len(pending)}] {record['id']} {record['status']} "
+                          f"{timings.get('total', 0):.1f}s "
+                          f"{timings.get('prompt_tokens', 0) + timings.get('completion_tokens', 0)} tokens")
+        except KeyboardInterrupt:
+            aborted = "已手动中断"
+            stop.set()
+            pool.shutdown(wait=True, cancel_futures=True)
+
+    elapsed = time.perf_counter() - start
+    exhausted = None
+    if aborted is None and stop.is_set():
+        exhausted = "token" if token_budget and tokens_used.value >= token_budget else "time"
+    return {
+        "tasks": len(tasks),
+        "already_finished": len(tasks) - len(pending),
+        "ran": sum(statuses.values()),
+        "statuses": dict(statuses),
+        "not_started": len(pending) - submitted,
+        "tokens": tokens_used.value,
+        "elapsed": round(elapsed, 3),
+        "tasks_per_minute": round(sum(statuses.values()) / elapsed * 60, 2) if elapsed > 0 else 0.0,
+        "budget_exhausted": exhausted,
+        "aborted": aborted,
+        "output": output
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="从JSONL文件批量运行Agent任务")
+    parser.add_argument("tasks", help="任务文件，每行一个JSON对象（task、可选的id及模板字段）")
+    parser.add_argument("-c", "--concurrency", type=int, default=4, help="同时运行的Agent数")
+    parser.add_argument("--template", help="任务内容模板，如\"为{dept}生成图表\"，用任务行的字段填充")
+    parser.add_argument("--seed", help="复制到每个任务工作空间的初始文件目录")
+    parser.add_argument("--run-dir", help="工作空间、日志和工具结果所在目录，默认batch_runs/<任务文件名>")
+    parser.add_argument("-o", "--output", help="结果文件，默认<run-dir>/results.jsonl")
+    parser.add_argument("--token-budget", type=int, default=0, help="全部任务的token总预算（估算），0为不限")
+    parser.add_argument("--time-budget", type=float, default=0, help="整个批次的运行时间预算（秒），0为不限")
+    parser.add_argument("--max-iterations", type=int, help="每个任务的最大轮次，默认使用Config.MAX_ITERATIONS")
+    parser.add_argument("--tool-call-mode", choices=["text", "native"], help="工具调用方式，默认使用Config.TOOL_CALL_MODE")
+    parser.add_argument("--sandbox-workers", type=int, default=1, help="每个任务进程预先启动的代码执行进程数")
+    parser.add_argument("--llm-url", help="覆盖Config.API_BASE_URL")
+    args = parser.parse_args()
+
+    try:
+        tasks = load_tasks(args.tasks, args.template)
+    except (OSError, ValueError) as e:
+        print(f"读取任务文件失败: {str(e)}", file=sys.stderr)
+        sys.exit(2)
+    if args.seed and not os.path.isdir(args.seed):
+        print(f"初始文件目录不存在: {args.seed}", file=sys.stderr)
+        sys.exit(2)
+
+    stem = os.path.splitext(os.path.basename(args.tasks))[0]
+    run_dir = os.path.abspath(args.run_dir or os.path.join(DEFAULT_RUN_ROOT, stem))
+    output = args.output or os.path.join(run_dir, "results.jsonl")
+    overrides = {"SANDBOX_WORKERS": max(1, args.sandbox_workers)}
+    if args.max_iterations:
+        overrides["MAX_ITERATIONS"] = args.max_iterations
+    if args.tool_call_mode:
+        overrides["TOOL_CALL_MODE"] = args.tool_call_mode
+    if args.llm_url:
+        overrides["API_BASE_URL"] = args.llm_url
+
+    summary = run_batch(tasks, run_dir, output, max(1, args.concurrency), args.seed,
+                        args.token_budget, args.time_budget, overrides)
+    print(json.dumps(summary, ensure_ascii=False, indent=2))
+    unfinished = summary["tasks"] - summary["already_finished"] - sum(
+        count for status, count in summary["statuses"].items() if status in FINISHED_STATUSES)
+    if unfinished:
+        print(f"\n{unfinished}个任务未完成，重新运行同一命令即可继续")
+    sys.exit(130 if summary["aborted"] == "已手动中断" else 1 if unfinished else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,290 @@
+"""端到端压测：在本地模拟LLM服务上并发运行Agent，统计延迟、吞吐和内存并与基线对比
+
+    # 直接驱动CodeAgent.run，4个并发共20个任务
+    python benchmark.py --mode agent --tasks 20 --concurrency 4
+
+    # 通过/api/chat的SSE接口（默认在进程内启动Flask应用，也可用--url指向已启动的服务）
+    python benchmark.py --mode sse --tasks 40 --concurrency 8 --save-baseline
+
+    # 使用原生函数调用模式，对比每轮发送的上下文token数
+    python benchmark.py --mode agent --tool-call-mode native
+
+存在同名基线时会自动对比，指标变差超过--threshold时以非零状态码退出。
+"""
+import argparse
+import json
+import os
+import resource
+import statistics
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from config import Config
+from mock_llm_server import MockLLMServer, load_script
+
+DEFAULT_TASK = "分析员工信息表.csv中各部门的平均工资"
+DEFAULT_BASELINE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "benchmark_baseline.json")
+
+# 参与基线对比的指标：值越小越好的延迟类和值越大越好的吞吐类
+_LOWER_IS_BETTER = ["ttfe_p50", "ttfe_p95", "ttft_p50", "ttft_p95", "turn_p50", "turn_p95",
+                    "tool_p50", "tool_p95", "total_p50", "total_p95", "peak_rss_mb", "prompt_tokens_mean"]
+_HIGHER_IS_BETTER = ["tasks_per_second", "turns_per_second"]
+
+
+class EventRecorder:
+    """记录事件及其到达时间，接口与Agent使用的队列兼容（put_nowait）"""
+
+    def __init__(self):
+        self.start = time.perf_counter()
+        self.events: List[tuple] = []
+
+    def put_nowait(self, event: dict):
+        self.events.append((time.perf_counter() - self.start, event))
+
+    put = put_nowait
+
+
+def analyze(events: List[tuple]) -> Dict[str, object]:
+    """从一次任务的事件时间线计算指标
+
+    - ttfe：第一个事件（不含session）的到达时间
+    - ttft：每次请求模型（context_stats）到收到第一段模型输出的时间
+    - turn：相邻两次请求模型之间的时间，最后一轮到done/final_answer为止
+    - tool：tool_call到tool_end的时间
+    - prompt_tokens：每次请求模型时发送的上下文token数（估算）
+    """
+    ttfe = None
+    ttfts, turns, tools, prompt_tokens = [], [], [], []
+    turn_start = tool_start = None
+    waiting_first_token = False
+    end = events[-1][0] if events else 0.0
+    for at, event in events:
+        kind = event.get("type")
+        if kind == "session" or event.get("heartbeat"):
+            continue
+        if ttfe is None:
+            ttfe = at
+        if kind == "context_stats":
+            if turn_start is not None:
+                turns.append(at - turn_start)
+            turn_start = at
+            waiting_first_token = True
+            prompt_tokens.append(event.get("prompt_tokens", 0))
+        elif kind == "thinking_stream" and waiting_first_token:
+            ttfts.append(at - turn_start)
+            waiting_first_token = False
+        elif kind == "tool_call":
+            tool_start = at
+        elif kind == "tool_end" and tool_start is not None:
+            tools.append(at - tool_start)
+            tool_start = None
+        elif kind in ("final_answer", "done"):
+            end = at
+            break
+    if turn_start is not None:
+        turns.append(end - turn_start)
+    return {"ttfe": ttfe or 0.0, "ttft": ttfts, "turns": turns, "tools": tools, "total": end,
+            "prompt_tokens": prompt_tokens,
+            "completed": any(event.get("type") == "final_answer" for _, event in events)}
+
+
+def run_agent_task(task: str) -> Dict[str, object]:
+    from agent import CodeAgent
+
+    agent = CodeAgent()
+    recorder = EventRecorder()
+    try:
+        agent.run(task, recorder)
+    finally:
+        agent.close()
+    return analyze(recorder.events)
+
+
+def run_sse_task(url: str, task: str) -> Dict[str, object]:
+    import requests
+
+    start = time.perf_counter()
+    events = []
+    # 每个压测线程模拟一个客户端，避免被按客户端限流
+    headers = {"X-Client-Id": f"benchmark-{threading.get_ident()}"}
+    with requests.post(f"{url}/api/chat", json={"message": task}, headers=headers, stream=True, timeout=300) as response:
+        if response.status_code != 200:
+            return {"ttfe": 0.0, "ttft": [], "turns": [], "tools": [], "total": time.perf_counter() - start,
+                    "completed": False, "error": f"HTTP {response.status_code}"}
+        for line in response.iter_lines(decode_unicode=True):
+            if not line or not line.startswith("data: "):
+                continue
+            data = line[6:]
+            at = time.perf_counter() - start
+            if data == "[DONE]":
+                events.append((at, {"type": "done"}))
+                break
+            events.append((at, json.loads(data)))
+    return analyze(events)
+
+
+def start_local_app() -> tuple:
+    """在进程内以多线程WSGI服务启动Flask应用，返回(地址, 服务对象)"""
+    from werkzeug.serving import WSGIRequestHandler, make_server
+    from app import app
+
+    class QuietHandler(WSGIRequestHandler):
+        def log_request(self, *args, **kwargs):
+            pass
+
+    server = make_server("127.0.0.1", 0, app, threaded=True, request_handler=QuietHandler)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return f"http://127.0.0.1:{server.server_port}", server
+
+
+def _percentile(values: List[float], percent: float) -> float:
+    if not values:
+        return 0.0
+    values = sorted(values)
+    index = min(len(values) - 1, max(0, int(round(percent / 100 * (len(values) - 1)))))
+    return values[index]
+
+
+def _peak_rss_mb() -> float:
+    # Linux下ru_maxrss单位为KB，macOS下为字节
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(peak / (1024 * 1024 if sys.platform == "darwin" else 1024), 1)
+
+
+def summarize(results: List[Dict[str, object]], elapsed: float) -> Dict[str, float]:
+    ttfe = [result["ttfe"] for result in results]
+    ttft = [value for result in results for value in result["ttft"]]
+    turns = [value for result in results for value in result["turns"]]
+    tools = [value for result in results for value in result["tools"]]
+    totals = [result["total"] for result in results]
+    prompt_tokens = [value for result in results for value in result.get("prompt_tokens", [])]
+    summary = {
+        "tasks": len(results),
+        "completed": sum(1 for result in results if result["completed"]),
+        "elapsed": round(elapsed, 3),
+        "tasks_per_second": round(len(results) / elapsed, 3) if elapsed else 0.0,
+        "turns_per_second": round(len(turns) / elapsed, 3) if elapsed else 0.0,
+        "peak_rss_mb": _peak_rss_mb(),
+        "prompt_tokens_mean": round(statistics.mean(prompt_tokens), 1) if prompt_tokens else 0.0
+    }
+    for name, values in (("ttfe", ttfe), ("ttft", ttft), ("turn", turns), ("tool", tools), ("total", totals)):
+        summary[f"{name}_p50"] = round(_percentile(values, 50), 4)
+        summary[f"{name}_p95"] = round(_percentile(values, 95), 4)
+        summary[f"{name}_mean"] = round(statistics.mean(values), 4) if values else 0.0
+    return summary
+
+
+def compare(summary: Dict[str, float], baseline: Dict[str, float], threshold: float) -> List[str]:
+    """返回超过阈值的退化项说明"""
+    regressions = []
+    for name in _LOWER_IS_BETTER:
+        old, new = baseline.get(name), summary.get(name)
+        if old and new is not None and new > old * (1 + threshold):
+            regressions.append(f"{name}: {old} -> {new} (+{(new / old - 1) * 100:.1f}%)")
+    for name in _HIGHER_IS_BETTER:
+        old, new = baseline.get(name), summary.get(name)
+        if old and new is not None and new < old * (1 - threshold):
+            regressions.append(f"{name}: {old} -> {new} (-{(1 - new / old) * 100:.1f}%)")
+    return regressions
+
+
+def load_baselines(path: str) -> Dict[str, dict]:
+    if not os.path.exists(path):
+        return {}
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
+
+
+def save_baseline(path: str, name: str, summary: Dict[str, float], settings: Dict[str, object]):
+    baselines = load_baselines(path)
+    baselines[name] = {"summary": summary, "settings": settings, "saved_at": time.strftime("%Y-%m-%d %H:%M:%S")}
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(baselines, f, ensure_ascii=False, indent=2)
+
+
+def run_benchmark(mode: str, tasks: int, concurrency: int, task: str, url: Optional[str] = None) -> Dict[str, float]:
+    local_server = None
+    if mode == "sse" and url is None:
+        url, local_server = start_local_app()
+    runner = (lambda: run_sse_task(url, task)) if mode == "sse" else (lambda: run_agent_task(task))
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as executor:
+        results = list(executor.map(lambda _: runner(), range(tasks)))
+    elapsed = time.perf_counter() - start
+    if local_server is not None:
+        local_server.shutdown()
+    return summarize(results, elapsed)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Agent端到端压测")
+    parser.add_argument("--mode", choices=["agent", "sse"], default="agent",
+                        help="agent直接调用CodeAgent.run，sse通过/api/chat接口")
+    parser.add_argument("--tasks", type=int, default=20)
+    parser.add_argument("--concurrency", type=int, default=4)
+    parser.add_argument("--task", default=DEFAULT_TASK)
+    parser.add_argument("--url", help="sse模式下已启动服务的地址，如http://127.0.0.1:5000（此时模拟LLM服务需单独启动）")
+    parser.add_argument("--llm-url", help="使用已有的LLM服务而不是启动模拟服务")
+    parser.add_argument("--script", help="模拟LLM服务的回复脚本（JSON字符串数组）")
+    parser.add_argument("--tokens-per-second", type=float, default=200.0)
+    parser.add_argument("--first-token-latency", type=float, default=0.1)
+    parser.add_argument("--tool-call-mode", choices=["text", "native"],
+                        help="工具调用方式，默认使用Config.TOOL_CALL_MODE")
+    parser.add_argument("--name", help="基线名称，默认为<mode>-c<concurrency>")
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE, help="基线文件路径")
+    parser.add_argument("--save-baseline", action="store_true", help="把本次结果保存为基线")
+    parser.add_argument("--threshold", type=float, default=0.2, help="判定退化的相对变化阈值")
+    args = parser.parse_args()
+
+    if args.tool_call_mode:
+        Config.TOOL_CALL_MODE = args.tool_call_mode
+    mock = None
+    if args.llm_url:
+        Config.API_BASE_URL = args.llm_url
+    else:
+        mock = MockLLMServer(
+            script=load_script(args.script) if args.script else None,
+            tokens_per_second=args.tokens_per_second,
+            first_token_latency=args.first_token_latency
+        ).start()
+        Config.API_BASE_URL = mock.base_url
+
+    # Agent在控制台打印的流式输出会干扰结果，压测期间丢弃
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        summary = run_benchmark(args.mode, args.tasks, args.concurrency, args.task, args.url)
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        if mock is not None:
+            mock.stop()
+
+    name = args.name or f"{args.mode}-c{args.concurrency}" + ("-native" if Config.TOOL_CALL_MODE == "native" else "")
+    settings = {key: getattr(args, key) for key in ("mode", "tasks", "concurrency", "tokens_per_second", "first_token_latency")}
+    settings["tool_call_mode"] = Config.TOOL_CALL_MODE
+    print(json.dumps({"name": name, **summary}, ensure_ascii=False, indent=2))
+
+    baseline = load_baselines(args.baseline).get(name)
+    exit_code = 0
+    if baseline:
+        regressions = compare(summary, baseline["summary"], args.threshold)
+        if regressions:
+            print(f"\n相对基线 {name}（{baseline.get('saved_at', '')}）的退化:")
+            for line in regressions:
+                print(f"  - {line}")
+            exit_code = 1
+        else:
+            print(f"\n与基线 {name} 相比无明显退化（阈值 {args.threshold:.0%}）")
+    if args.save_baseline:
+        save_baseline(args.baseline, name, summary, settings)
+        print(f"已保存基线 {name} -> {args.baseline}")
+    sys.exit(exit_code)
+
+
+if __name__ == "__main__":
+    main()
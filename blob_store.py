@@ -0,0 +1,225 @@
+import os
+import re
+import shutil
+import threading
+import time
+import uuid
+from array import array
+from collections import OrderedDict
+from typing import Dict, Iterable, Optional
+from config import Config
+from file_edit import atomic_write
+
+DEFAULT_SESSION = "default"
+_SAFE_SESSION = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+_BLOB_FILE = re.compile(r'^(r[0-9a-f]{10})\.txt$')
+# 每隔这么多字符记录一次字节偏移，按字符读取时从最近的记录点seek
+_CHAR_INDEX_STEP = 64 * 1024
+
+
+class Blob:
+    """一条转存到磁盘的工具结果"""
+
+    def __init__(self, blob_id: str, session_id: str, tool: str, path: str, content: str, data: bytes = None):
+        self.blob_id = blob_id
+        self.session_id = session_id
+        self.tool = tool
+        self.path = path
+        self.chars = len(content)
+        self.created_at = time.time()
+        # 每行起始位置的字节偏移，按行读取时直接seek
+        data = content.encode('utf-8') if data is None else data
+        self.size = len(data)
+        self.line_offsets = array('q', [0])
+        position = data.find(b"\n")
+        while position != -1:
+            self.line_offsets.append(position + 1)
+            position = data.find(b"\n", position + 1)
+        if self.line_offsets[-1] == self.size and len(self.line_offsets) > 1:
+            self.line_offsets.pop()
+        # 第i*_CHAR_INDEX_STEP个字符起始位置的字节偏移；纯ASCII时字符与字节一一对应，无需记录
+        self.char_offsets = array('q')
+        if self.size != self.chars:
+            position = 0
+            for start in range(0, self.chars, _CHAR_INDEX_STEP):
+                self.char_offsets.append(position)
+                position += len(content[start:start + _CHAR_INDEX_STEP].encode('utf-8'))
+
+    @property
+    def lines(self) -> int:
+        return len(self.line_offsets) if self.size else 0
+
+    def to_dict(self) -> dict:
+        return {
+            "id": self.blob_id,
+            "tool": self.tool,
+            "chars": self.chars,
+            "bytes": self.size,
+            "lines": self.lines,
+            "created_at": self.created_at
+        }
+
+
+class BlobStore:
+    """按会话存放大块工具结果：内容写入磁盘，内存中只保留句柄和行索引
+
+    每个会话占用的磁盘空间超过上限时，最早的结果先被删除。
+    keep_sessions中的会话（有可以从检查点恢复的运行）在启动时按磁盘上的文件重建索引，
+    恢复后的记忆里引用的结果ID仍然有效；上次进程留下的其他文件全部删除。
+    """
+
+    def __init__(self, root: str = None, max_session_bytes: int = None, keep_sessions: Iterable[str] = ()):
+        self.root = root or Config.BLOB_STORE_PATH
+        self.max_session_bytes = max_session_bytes or Config.BLOB_MAX_SESSION_BYTES
+        self._sessions: Dict[str, "OrderedDict[str, Blob]"] = {}
+        self._lock = threading.Lock()
+        self._restore(set(keep_sessions))
+
+    def put(self, session_id: Optional[str], content: str, tool: str = "") -> Blob:
+        session_id = session_id or DEFAULT_SESSION
+        if not _SAFE_SESSION.match(session_id):
+            raise ValueError(f"无效的会话ID: {session_id}")
+        blob_id = f"r{uuid.uuid4().hex[:10]}"
+        path = os.path.join(self.root, session_id, f"{blob_id}.txt")
+        atomic_write(path, content)
+        blob = Blob(blob_id, session_id, tool, path, content)
+        with self._lock:
+            blobs = self._sessions.setdefault(session_id, OrderedDict())
+            blobs[blob_id] = blob
+            evicted = self._evict_locked(blobs)
+        for old in evicted:
+            self._remove_file(old.path)
+        return blob
+
+    def get(self, session_id: Optional[str], blob_id: str) -> Optional[Blob]:
+        with self._lock:
+            return self._sessions.get(session_id or DEFAULT_SESSION, {}).get(blob_id)
+
+    def read_lines(self, blob: Blob, offset: int = 0, limit: int = None) -> tuple[str, int]:
+        """读取[offset, offset+limit)行，返回(文本, 实际结束行)"""
+        total = blob.lines
+        start = min(max(0, offset), total)
+        end = total if limit is None else min(total, start + max(0, limit))
+        if start >= end:
+            return "", start
+        begin = blob.line_offsets[start]
+        stop = blob.line_offsets[end] if end < total else blob.size
+        with open(blob.path, 'rb') as f:
+            f.seek(begin)
+            return f.read(stop - begin).decode('utf-8', errors='replace'), end
+
+    def read_chars(self, blob: Blob, offset: int = 0, limit: int = None) -> str:
+        """读取[offset, offset+limit)字符，只读取所需位置附近的字节"""
+        start = min(max(0, offset), blob.chars)
+        if blob.char_offsets:
+            index = start // _CHAR_INDEX_STEP
+            begin, skip = blob.char_offsets[index], start - index * _CHAR_INDEX_STEP
+        else:
+            begin, skip = start, 0
+        with open(blob.path, 'rb') as f:
+            f.seek(begin)
+            if limit is None:
+                data = f.read()
+            else:
+                # UTF-8每个字符最多4字节
+                data = f.read((skip + max(0, limit)) * (4 if blob.char_offsets else 1))
+        text = data.decode('utf-8', errors='replace')[skip:]
+        return text if limit is None else text[:max(0, limit)]
+
+    def list(self, session_id: Optional[str]) -> list:
+        with self._lock:
+            return [blob.to_dict() for blob in self._sessions.get(session_id or DEFAULT_SESSION, {}).values()]
+
+    def drop_session(self, session_id: Optional[str]):
+        """删除会话的全部结果"""
+        session_id = session_id or DEFAULT_SESSION
+        with self._lock:
+            self._sessions.pop(session_id, None)
+        if not _SAFE_SESSION.match(session_id):
+            return
+        shutil.rmtree(os.path.join(self.root, session_id), ignore_errors=True)
+
+    def stats(self) -> dict:
+        with self._lock:
+            blobs = [blob for session in self._sessions.values() for blob in session.values()]
+            session_count = len(self._sessions)
+        return {
+            "sessions": session_count,
+            "blobs": len(blobs),
+            "bytes": sum(blob.size for blob in blobs),
+            "max_session_bytes": self.max_session_bytes
+        }
+
+    def _restore(self, keep_sessions: set):
+        if not os.path.isdir(self.root):
+            return
+        for name in os.listdir(self.root):
+            path = os.path.join(self.root, name)
+            if name not in keep_sessions or not _SAFE_SESSION.match(name) or not os.path.isdir(path):
+                if os.path.isdir(path):
+                    shutil.rmtree(path, ignore_errors=True)
+                else:
+                    self._remove_file(path)
+                continue
+            entries = []
+            for filename in os.listdir(path):
+                file_path = os.path.join(path, filename)
+                match = _BLOB_FILE.match(filename)
+                if match is None:
+                    # 写了一半的临时文件等
+                    self._remove_file(file_path)
+                    continue
+                entries.append((os.path.getmtime(file_path), match.group(1), file_path))
+            blobs = OrderedDict()
+            for mtime, blob_id, file_path in sorted(entries):
+                with open(file_path, 'rb') as f:
+                    data = f.read()
+                blob = Blob(blob_id, name, "", file_path, data.decode('utf-8', errors='replace'), data)
+                blob.created_at = mtime
+                blobs[blob_id] = blob
+            for old in self._evict_locked(blobs):
+                self._remove_file(old.path)
+            if blobs:
+                self._sessions[name] = blobs
+
+    def _evict_locked(self, blobs: "OrderedDict[str, Blob]") -> list:
+        evicted = []
+        total = sum(blob.size for blob in blobs.values())
+        # 至少保留刚写入的一条
+        while total > self.max_session_bytes and len(blobs) > 1:
+            _, old = blobs.popitem(last=False)
+            total -= old.size
+            evicted.append(old)
+        return evicted
+
+    @staticmethod
+    def _remove_file(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+
+_default_store: Optional[BlobStore] = None
+_default_store_lock = threading.Lock()
+
+
+def get_blob_store() -> BlobStore:
+    """获取进程级共享的工具结果存储"""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = BlobStore(keep_sessions=_resumable_sessions())
+        return _default_store
+
+
+def _resumable_sessions() -> set:
+    """最近一次运行可以从检查点恢复的会话，它们转存的结果在进程重启后保留"""
+    if not Config.CHECKPOINT_ENABLED or not os.path.isdir(Config.BLOB_STORE_PATH):
+        return set()
+    try:
+        from checkpoint_store import get_checkpoint_store
+        return get_checkpoint_store().resumable_sessions()
+    except Exception as e:
+        print(f"读取可恢复的会话失败，已转存的工具结果将被清空: {str(e)}")
+        return set()
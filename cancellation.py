@@ -0,0 +1,123 @@
+import asyncio
+import threading
+from typing import Callable, Dict, List, Optional
+
+
+class TaskCancelled(Exception):
+    """任务已被取消（客户端断开或主动取消）"""
+
+
+class CancelToken:
+    """协作式取消标记：运行中的任务在流式片段之间、工具执行前后和排队等待时检查
+
+    cancel可以从任意线程调用；on_cancel注册的回调在取消时立即执行，用于唤醒正在等待的一方。
+    """
+
+    def __init__(self):
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+        self.reason = ""
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self, reason: str = "任务已取消") -> bool:
+        """取消任务，已经取消过时返回False"""
+        with self._lock:
+            if self._event.is_set():
+                return False
+            self.reason = reason
+            self._event.set()
+            callbacks, self._callbacks = self._callbacks, []
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception as e:
+                print(f"取消回调执行失败: {str(e)}")
+        return True
+
+    def check(self):
+        """已取消时抛出TaskCancelled"""
+        if self._event.is_set():
+            raise TaskCancelled(self.reason)
+
+    def on_cancel(self, callback: Callable[[], None]) -> Callable[[], None]:
+        """注册取消回调，返回注销函数；已经取消时立即执行"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return lambda: self._remove(callback)
+        callback()
+        return lambda: None
+
+    def wait(self, timeout: float) -> bool:
+        """最多等待timeout秒，期间被取消时提前返回True"""
+        return self._event.wait(timeout)
+
+    async def await_cancel(self, timeout: float) -> bool:
+        """wait的异步版本，等待期间不阻塞事件循环"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        remove = self.on_cancel(lambda: loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None)))
+        try:
+            await asyncio.wait([future], timeout=timeout)
+        finally:
+            remove()
+        return self.cancelled
+
+    def _remove(self, callback):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+
+class CancelRegistry:
+    """按会话ID登记进行中任务的取消标记，供取消接口和断开连接时使用"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._tokens: Dict[str, CancelToken] = {}
+        self._cancelled = 0
+
+    def register(self, session_id: str) -> CancelToken:
+        token = CancelToken()
+        with self._lock:
+            self._tokens[session_id] = token
+        return token
+
+    def unregister(self, session_id: str, token: CancelToken):
+        with self._lock:
+            if self._tokens.get(session_id) is token:
+                del self._tokens[session_id]
+
+    def cancel(self, session_id: str, reason: str = "任务已取消") -> bool:
+        """取消会话中进行中的任务，没有进行中的任务时返回False"""
+        with self._lock:
+            token = self._tokens.get(session_id)
+        return token is not None and self.cancel_token(token, reason)
+
+    def cancel_token(self, token: CancelToken, reason: str = "任务已取消") -> bool:
+        if not token.cancel(reason):
+            return False
+        with self._lock:
+            self._cancelled += 1
+        return True
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"active": len(self._tokens), "cancelled": self._cancelled}
+
+
+_default_registry: Optional[CancelRegistry] = None
+_default_registry_lock = threading.Lock()
+
+
+def get_cancel_registry() -> CancelRegistry:
+    """获取进程级共享的取消标记登记表"""
+    global _default_registry
+    with _default_registry_lock:
+        if _default_registry is None:
+            _default_registry = CancelRegistry()
+        return _default_registry
@@ -0,0 +1,100 @@
+import os
+import threading
+import time
+import urllib.request
+from typing import Optional
+from config import Config
+from file_edit import atomic_write
+
+# 工作区内存放共享静态资源的目录，文件名带版本号，可长期缓存
+ASSETS_DIR = ".assets"
+# 随项目分发的离线资源目录（可用 python chart_assets.py 预先下载）
+VENDOR_DIR = os.path.join(os.path.dirname(__file__), "frontend", "vendor")
+
+_lock = threading.Lock()
+_last_failure = 0.0
+_download_thread: Optional[threading.Thread] = None
+
+
+def echarts_asset_name() -> str:
+    return f"echarts-{Config.ECHARTS_VERSION}.min.js"
+
+
+def echarts_cdn_url() -> str:
+    return Config.ECHARTS_CDN_URL.format(version=Config.ECHARTS_VERSION)
+
+
+def _download_to_vendor():
+    global _last_failure
+    path = os.path.join(VENDOR_DIR, echarts_asset_name())
+    try:
+        with urllib.request.urlopen(echarts_cdn_url(), timeout=Config.ECHARTS_DOWNLOAD_TIMEOUT) as response:
+            content = response.read().decode('utf-8')
+        os.makedirs(VENDOR_DIR, exist_ok=True)
+        atomic_write(path, content)
+    except Exception as e:
+        _last_failure = time.time()
+        print(f"ECharts本地资源下载失败，图表将使用CDN: {str(e)}")
+
+
+def prefetch_echarts_asset():
+    """在后台线程中把ECharts下载到frontend/vendor，已有副本、正在下载或仍在失败重试间隔内时不做任何事
+
+    服务启动时调用；生成图表时只复制已有副本，不会等待网络。
+    """
+    global _download_thread
+    if not Config.ECHARTS_LOCAL_ASSET:
+        return
+    with _lock:
+        if os.path.exists(os.path.join(VENDOR_DIR, echarts_asset_name())):
+            return
+        if _download_thread is not None and _download_thread.is_alive():
+            return
+        if time.time() - _last_failure < Config.ECHARTS_DOWNLOAD_RETRY_INTERVAL:
+            return
+        _download_thread = threading.Thread(target=_download_to_vendor, name="echarts-download", daemon=True)
+        _download_thread.start()
+
+
+def ensure_echarts_asset() -> Optional[str]:
+    """确保工作区中有本地ECharts文件，返回其绝对路径；还没有离线副本时返回None
+
+    只从frontend/vendor复制随项目分发或已在后台下载好的副本；副本不存在时触发后台
+    下载并立即返回，本次图表先使用CDN。
+    """
+    if not Config.ECHARTS_LOCAL_ASSET:
+        return None
+    target = os.path.join(Config.WORKSPACE_PATH, ASSETS_DIR, echarts_asset_name())
+    if os.path.exists(target):
+        return target
+
+    vendored = os.path.join(VENDOR_DIR, echarts_asset_name())
+    if not os.path.exists(vendored):
+        prefetch_echarts_asset()
+        return None
+    with _lock:
+        if not os.path.exists(target):
+            with open(vendored, 'r', encoding='utf-8') as f:
+                atomic_write(target, f.read())
+    return target
+
+
+def echarts_script_tags(html_abs_path: str) -> str:
+    """生成引用ECharts的script标签：有本地资源时用相对路径引用，加载失败再退回CDN"""
+    cdn_tag = f'<script src="{echarts_cdn_url()}"></script>'
+    asset = ensure_echarts_asset()
+    if asset is None:
+        return cdn_tag
+    src = os.path.relpath(asset, os.path.dirname(os.path.abspath(html_abs_path))).replace(os.sep, '/')
+    fallback = cdn_tag.replace('</script>', '<\\/script>')
+    return f"""<script src="{src}"></script>
+    <script>window.echarts || document.write('{fallback}');</script>"""
+
+
+if __name__ == "__main__":
+    # 预先下载离线副本，部署到无网络环境时随项目一起分发
+    os.makedirs(VENDOR_DIR, exist_ok=True)
+    path = os.path.join(VENDOR_DIR, echarts_asset_name())
+    with urllib.request.urlopen(echarts_cdn_url(), timeout=Config.ECHARTS_DOWNLOAD_TIMEOUT) as response:
+        atomic_write(path, response.read().decode('utf-8'))
+    print(f"已保存: {path}")
@@ -0,0 +1,161 @@
+import heapq
+import math
+from typing import List, Sequence
+
+try:
+    import numpy as np
+except ImportError:  # 未安装numpy时使用纯Python实现，结果一致只是更慢
+    np = None
+
+
+def _to_float(value) -> float:
+    try:
+        return float(value)
+    except (TypeError, ValueError):
+        return math.nan
+
+
+def _point(point) -> tuple:
+    if isinstance(point, (list, tuple)) and len(point) >= 2:
+        return _to_float(point[0]), _to_float(point[1])
+    return math.nan, math.nan
+
+
+def _as_array(values):
+    """整体转换为float数组，含非数字值时再逐个转换（无法转换的记为NaN）"""
+    try:
+        return np.asarray(values, dtype=float)
+    except (TypeError, ValueError):
+        return np.asarray([
+            [_to_float(v) for v in item] if isinstance(item, (list, tuple)) else _to_float(item)
+            for item in values
+        ], dtype=float)
+
+
+def lttb_indices(values: Sequence, threshold: int) -> List[int]:
+    """Largest-Triangle-Three-Buckets降采样，返回保留点的下标（x取下标，保留首尾和峰谷形状）"""
+    n = len(values)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+    if np is not None:
+        return _lttb_numpy(_as_array(values), threshold)
+    return _lttb_python([_to_float(v) for v in values], threshold)
+
+
+def top_n_indices(values: Sequence, n: int) -> List[int]:
+    """返回数值最大的n个元素的下标，按原顺序排列（非数字值排在最后）"""
+    if n >= len(values):
+        return list(range(len(values)))
+    if n <= 0:
+        return []
+    if np is not None:
+        data = np.nan_to_num(_as_array(values), nan=-np.inf)
+        return sorted(np.argpartition(-data, n - 1)[:n].tolist())
+    data = [_to_float(v) for v in values]
+    return sorted(heapq.nlargest(n, range(len(data)), key=lambda i: -math.inf if math.isnan(data[i]) else data[i]))
+
+
+def _lttb_numpy(y, threshold: int) -> List[int]:
+    n = len(y)
+    y = np.nan_to_num(y)
+    bucket_size = (n - 2) / (threshold - 2)
+    selected = [0]
+    a = 0
+    for i in range(threshold - 2):
+        start = int(math.floor(i * bucket_size)) + 1
+        end = int(math.floor((i + 1) * bucket_size)) + 1
+        next_start = end
+        next_end = min(int(math.floor((i + 2) * bucket_size)) + 1, n)
+        if next_start >= next_end:
+            avg_x, avg_y = n - 1, y[n - 1]
+        else:
+            avg_x = (next_start + next_end - 1) / 2
+            avg_y = y[next_start:next_end].mean()
+        xs = np.arange(start, end)
+        areas = np.abs((a - avg_x) * (y[start:end] - y[a]) - (a - xs) * (avg_y - y[a]))
+        a = start + int(areas.argmax())
+        selected.append(a)
+    selected.append(n - 1)
+    return selected
+
+
+def _lttb_python(y: List[float], threshold: int) -> List[int]:
+    n = len(y)
+    y = [0.0 if math.isnan(v) else v for v in y]
+    bucket_size = (n - 2) / (threshold - 2)
+    selected = [0]
+    a = 0
+    for i in range(threshold - 2):
+        start = int(math.floor(i * bucket_size)) + 1
+        end = int(math.floor((i + 1) * bucket_size)) + 1
+        next_start = end
+        next_end = min(int(math.floor((i + 2) * bucket_size)) + 1, n)
+        if next_start >= next_end:
+            avg_x, avg_y = n - 1, y[n - 1]
+        else:
+            avg_x = (next_start + next_end - 1) / 2
+            avg_y = sum(y[next_start:next_end]) / (next_end - next_start)
+        best, best_area = start, -1.0
+        for j in range(start, end):
+            area = abs((a - avg_x) * (y[j] - y[a]) - (a - j) * (avg_y - y[a]))
+            if area > best_area:
+                best, best_area = j, area
+        a = best
+        selected.append(a)
+    selected.append(n - 1)
+    return selected
+
+
+def bin_scatter(points: Sequence, bins: int) -> List[list]:
+    """把散点按bins x bins网格分箱，每个非空格子输出[x均值, y均值, 点数]"""
+    if np is not None:
+        try:
+            data = _as_array(points)
+        except ValueError:  # 各点维度不一致
+            data = np.asarray([_point(p) for p in points], dtype=float)
+        data = data[:, :2]
+        data = data[~np.isnan(data).any(axis=1)]
+        if len(data) == 0:
+            return []
+        ix = _bin_index_numpy(data[:, 0], bins)
+        iy = _bin_index_numpy(data[:, 1], bins)
+        cells, inverse, counts = np.unique(ix * bins + iy, return_inverse=True, return_counts=True)
+        sum_x = np.bincount(inverse, weights=data[:, 0], minlength=len(cells))
+        sum_y = np.bincount(inverse, weights=data[:, 1], minlength=len(cells))
+        return [
+            [_round(sx / c), _round(sy / c), int(c)]
+            for sx, sy, c in zip(sum_x.tolist(), sum_y.tolist(), counts.tolist())
+        ]
+
+    data = [(x, y) for x, y in (_point(p) for p in points)
+            if not (math.isnan(x) or math.isnan(y))]
+    if not data:
+        return []
+    min_x, max_x = min(x for x, _ in data), max(x for x, _ in data)
+    min_y, max_y = min(y for _, y in data), max(y for _, y in data)
+    cells = {}
+    for x, y in data:
+        key = (_bin_index(x, min_x, max_x, bins), _bin_index(y, min_y, max_y, bins))
+        cell = cells.setdefault(key, [0.0, 0.0, 0])
+        cell[0] += x
+        cell[1] += y
+        cell[2] += 1
+    return [[_round(sx / c), _round(sy / c), c] for sx, sy, c in cells.values()]
+
+
+def _bin_index_numpy(values, bins: int):
+    low, high = values.min(), values.max()
+    if high == low:
+        return np.zeros(len(values), dtype=np.int64)
+    return np.minimum(((values - low) / (high - low) * bins).astype(np.int64), bins - 1)
+
+
+def _bin_index(value: float, low: float, high: float, bins: int) -> int:
+    if high == low:
+        return 0
+    return min(int((value - low) / (high - low) * bins), bins - 1)
+
+
+def _round(value: float):
+    value = round(value, 6)
+    return int(value) if value.is_integer() else value
@@ -0,0 +1,502 @@
+"""图表工具：create_echarts_visualization和create_echarts_dashboard
+
+由工具注册表在首次调用时导入，不使用图表的会话不会加载这部分代码。
+"""
+import json
+import os
+from config import Config
+from file_edit import atomic_write
+from tools import ToolContext, _notify_workspace_change, _to_int, get_workspace_path
+
+
+def create_echarts_visualization(data, chart_type: str, output_filename: str, title: str = "", x_axis_name: str = "", y_axis_name: str = "", theme: str = "light",
+                                 source_file: str = None, x_column: str = None, y_column: str = None, aggregation: str = None,
+                                 filters=None, limit: int = None) -> str:
+    """根据输入数据和图表类型快速创建ECharts可视化HTML文件"""
+    try:
+        chart_type = chart_type.lower()
+        if not source_file and data is None:
+            return "图表创建失败: 需要提供data或source_file"
+        
+        # 确保文件名以.html结尾
+        if not output_filename.endswith('.html'):
+            output_filename += '.html'
+        
+        # 获取输出文件的绝对路径
+        abs_path = get_workspace_path(output_filename)
+        os.makedirs(os.path.dirname(abs_path), exist_ok=True)
+        
+        chart_option, summary = _build_chart_option(
+            data, chart_type, title, x_axis_name, y_axis_name,
+            source_file, x_column, y_column, aggregation, filters, limit
+        )
+        
+        # 生成HTML
+        html_content = _generate_html_template(chart_option, title, chart_type, theme,
+                                               compact=bool(summary), script_tags=_echarts_script_tags(abs_path))
+        
+        # 写入文件
+        atomic_write(abs_path, html_content)
+        _notify_workspace_change(abs_path)
+        
+        result = f"成功创建{chart_type}图表: {output_filename}"
+        if title:
+            result += f"\n标题: {title}"
+        if summary:
+            result += f"\n{summary}"
+        result += f"\n文件路径: {abs_path}"
+        return result
+        
+    except json.JSONDecodeError:
+        return "数据格式错误：无法解析JSON字符串"
+    except Exception as e:
+        return f"图表创建失败: {str(e)}"
+
+
+def create_echarts_dashboard(charts, output_filename: str, title: str = "", theme: str = "light", columns: int = 2) -> str:
+    """把多个图表渲染到同一个HTML页面，屏幕外的图表滚动到可见时才初始化"""
+    try:
+        if isinstance(charts, str):
+            charts = json.loads(charts)
+        if not isinstance(charts, list) or not charts:
+            return "仪表盘创建失败: charts需要是非空的图表配置列表"
+        
+        if not output_filename.endswith('.html'):
+            output_filename += '.html'
+        abs_path = get_workspace_path(output_filename)
+        os.makedirs(os.path.dirname(abs_path), exist_ok=True)
+        
+        options = []
+        notes = []
+        for index, spec in enumerate(charts, start=1):
+            if not isinstance(spec, dict):
+                return f"仪表盘创建失败: 第{index}个图表配置不是对象"
+            if not spec.get("source_file") and spec.get("data") is None:
+                return f"仪表盘创建失败: 第{index}个图表需要提供data或source_file"
+            chart_type = str(spec.get("chart_type", "bar")).lower()
+            chart_option, summary = _build_chart_option(
+                spec.get("data"), chart_type, spec.get("title", ""),
+                spec.get("x_axis_name", ""), spec.get("y_axis_name", ""),
+                spec.get("source_file"), spec.get("x_column"), spec.get("y_column"),
+                spec.get("aggregation"), spec.get("filters"), _to_int(spec.get("limit"))
+            )
+            options.append(chart_option)
+            notes.append(f"{index}. {chart_type} {spec.get('title', '')}".rstrip() + (f"（{summary}）" if summary else ""))
+        
+        html_content = _generate_dashboard_template(options, title, theme, max(1, _to_int(columns) or 2),
+                                                    _echarts_script_tags(abs_path))
+        atomic_write(abs_path, html_content)
+        _notify_workspace_change(abs_path)
+        
+        return f"成功创建包含{len(options)}个图表的仪表盘: {output_filename}\n" + "\n".join(notes) + f"\n文件路径: {abs_path}"
+    except Exception as e:
+        return f"仪表盘创建失败: {str(e)}"
+
+
+def _build_chart_option(data, chart_type, title, x_axis_name, y_axis_name,
+                        source_file=None, x_column=None, y_column=None, aggregation=None, filters=None, limit=None):
+    """读取/整理数据并生成单个图表的ECharts配置，返回(配置, 大数据模式说明)"""
+    if source_file:
+        data = _load_chart_data(source_file, chart_type, x_column, y_column, aggregation, filters, limit)
+        x_axis_name = x_axis_name or x_column or ""
+        y_axis_name = y_axis_name or (f"{y_column}({aggregation})" if y_column and aggregation else y_column or aggregation or "")
+    
+    # 数据预处理
+    if isinstance(data, str):
+        data = json.loads(data)
+    
+    # 数据格式化
+    processed_data = _process_chart_data(data, chart_type)
+    processed_data, original_points = _reduce_large_data(chart_type, processed_data)
+    large = original_points is not None
+    
+    # 生成图表配置
+    chart_option = _generate_chart_config(chart_type, processed_data, title, x_axis_name, y_axis_name, large)
+    summary = ""
+    if large:
+        kept = len(processed_data[1]) if chart_type in ('bar', 'line') else len(processed_data)
+        summary = f"数据点: {original_points}，已启用大数据模式（绘制{kept}个点）"
+    return chart_option, summary
+
+
+def _echarts_script_tags(html_abs_path: str) -> str:
+    from chart_assets import echarts_script_tags
+    return echarts_script_tags(html_abs_path)
+
+
+def _load_chart_data(source_file, chart_type, x_column, y_column, aggregation, filters, limit):
+    """从工作区文件读取并在服务端聚合，返回_process_chart_data可接受的数据"""
+    from table_store import get_table_store
+    
+    if not x_column:
+        raise ValueError("使用source_file时需要提供x_column")
+    if isinstance(filters, str) and filters.strip():
+        filters = json.loads(filters)
+    abs_path = get_workspace_path(source_file)
+    store = get_table_store()
+    
+    if aggregation:
+        aggregation = aggregation.lower()
+        if aggregation != "count" and not y_column:
+            raise ValueError(f"聚合{aggregation}需要提供y_column")
+        value_column = f"{y_column or '*'}_{aggregation}"
+        spec = [{"column": y_column or "*", "func": aggregation, "as": value_column}]
+        if limit:
+            # 取数值最大的前N个类别
+            result = store.query(abs_path, filters=filters, group_by=[x_column], aggregations=spec,
+                                 sort_by=value_column, descending=True, limit=limit)
+        else:
+            result = store.query(abs_path, filters=filters, group_by=[x_column], aggregations=spec,
+                                 sort_by=x_column if chart_type == 'line' else None)
+    else:
+        if not y_column:
+            raise ValueError("不聚合时需要提供y_column")
+        # 由查询只物化前limit行，而不是构建全部结果后再截断
+        result = store.query(abs_path, filters=filters, columns=[x_column, y_column], limit=limit or None)
+    
+    rows = result["rows"]
+    if chart_type == 'scatter':
+        return rows
+    # 按列返回(类别, 数值)，省去逐行构建字典再拆开
+    names, values = (list(column) for column in zip(*rows)) if rows else ([], [])
+    return ["" if x is None else x for x in names], values
+
+
+def _process_chart_data(data, chart_type):
+    """处理不同图表类型的数据格式"""
+    if chart_type in ['bar', 'line']:
+        return _process_bar_line_data(data)
+    elif chart_type == 'pie':
+        return _process_pie_data(data)
+    elif chart_type == 'scatter':
+        return _process_scatter_data(data)
+    else:
+        return _process_bar_line_data(data)  # 默认处理为柱状图
+
+
+def _process_bar_line_data(data):
+    """处理柱状图和折线图数据"""
+    if isinstance(data, dict):
+        return list(data.keys()), list(data.values())
+    elif isinstance(data, tuple):  # _load_chart_data已按列整理好
+        return data
+    elif isinstance(data, list) and len(data) > 0:
+        if isinstance(data[0], dict) and 'name' in data[0] and 'value' in data[0]:
+            return [item['name'] for item in data], [item['value'] for item in data]
+        else:
+            return [f'项目{i+1}' for i in range(len(data))], data
+    else:
+        return ['A', 'B', 'C', 'D', 'E'], [20, 30, 40, 50, 60]
+
+
+def _process_pie_data(data):
+    """处理饼图数据"""
+    if isinstance(data, dict):
+        return [{'name': k, 'value': v} for k, v in data.items()]
+    elif isinstance(data, list) and len(data) > 0:
+        if isinstance(data[0], dict) and 'name' in data[0] and 'value' in data[0]:
+            return data
+        else:
+            return [{'name': f'类别{i+1}', 'value': data[i]} for i in range(len(data))]
+    else:
+        return [{'name': 'A', 'value': 20}, {'name': 'B', 'value': 30}, {'name': 'C', 'value': 40}, {'name': 'D', 'value': 50}]
+
+
+def _process_scatter_data(data):
+    """处理散点图数据"""
+    if isinstance(data, list) and len(data) > 0:
+        if isinstance(data[0], (list, tuple)) and len(data[0]) >= 2:
+            return data
+        elif isinstance(data[0], dict) and 'x' in data[0] and 'y' in data[0]:
+            return [[item['x'], item['y']] for item in data]
+        else:
+            return [[i, data[i]] for i in range(len(data))]
+    else:
+        return [[10, 20], [15, 25], [20, 30], [25, 35], [30, 40]]
+
+
+def _reduce_large_data(chart_type, processed_data):
+    """数据点超过阈值时降采样：折线图用LTTB保留形状，散点图按网格分箱，柱状图保留数值最大的类别
+    
+    返回(处理后的数据, 原始点数)，未进入大数据模式时原始点数为None
+    """
+    from chart_data import bin_scatter, lttb_indices, top_n_indices
+    
+    if chart_type in ('bar', 'line'):
+        x_data, y_data = processed_data
+        count = len(y_data)
+    elif chart_type == 'scatter':
+        count = len(processed_data)
+    else:
+        return processed_data, None
+    if count <= Config.ECHARTS_LARGE_THRESHOLD:
+        return processed_data, None
+    
+    if chart_type == 'line':
+        indices = lttb_indices(y_data, Config.ECHARTS_LINE_MAX_POINTS)
+        return ([x_data[i] for i in indices], [y_data[i] for i in indices]), count
+    if chart_type == 'scatter':
+        return bin_scatter(processed_data, Config.ECHARTS_SCATTER_BINS), count
+    # 柱状图不能按形状取点：保留数值最大的类别（保持原顺序），其余合并为“其他”
+    indices = top_n_indices(y_data, Config.ECHARTS_BAR_MAX_CATEGORIES - 1)
+    kept = set(indices)
+    other = sum(v for i, v in enumerate(y_data)
+                if i not in kept and isinstance(v, (int, float)) and not isinstance(v, bool) and v == v)
+    return ([x_data[i] for i in indices] + ['其他'], [y_data[i] for i in indices] + [other]), count
+
+
+def _apply_large_options(option, chart_type, processed_data):
+    """大数据模式的渲染配置：关闭动画，开启large/progressive，折线和柱状图加数据缩放"""
+    option['animation'] = False
+    for series in option.get('series', []):
+        series['progressive'] = Config.ECHARTS_PROGRESSIVE
+        series['progressiveThreshold'] = Config.ECHARTS_LARGE_THRESHOLD
+        if chart_type in ('bar', 'scatter'):
+            series['large'] = True
+            series['largeThreshold'] = Config.ECHARTS_LARGE_THRESHOLD
+        if chart_type == 'line':
+            series['showSymbol'] = False
+            series['sampling'] = 'lttb'
+    if chart_type in ('bar', 'line'):
+        option['dataZoom'] = [{'type': 'inside'}, {'type': 'slider'}]
+    if chart_type == 'scatter' and processed_data:
+        # 分箱后第三维是格子内的点数，用点的大小表示密度
+        option['visualMap'] = {
+            'type': 'continuous',
+            'dimension': 2,
+            'min': 1,
+            'max': max(point[2] for point in processed_data),
+            'text': ['点数多', '点数少'],
+            'calculable': True,
+            'right': 0,
+            'inRange': {'symbolSize': [4, 20]}
+        }
+        option['tooltip'] = {'trigger': 'item'}
+
+
+def _generate_chart_config(chart_type, processed_data, title, x_axis_name, y_axis_name, large=False):
+    """生成ECharts配置"""
+    # 基础配置
+    option = {
+        'title': {
+            'text': title or f'{chart_type.capitalize()}图表',
+            'left': 'center'
+        },
+        'tooltip': {'trigger': 'item' if chart_type == 'pie' else 'axis'}
+    }
+    
+    if chart_type == 'bar':
+        x_data, y_data = processed_data
+        option.update({
+            'xAxis': {'type': 'category', 'data': x_data, 'name': x_axis_name},
+            'yAxis': {'type': 'value', 'name': y_axis_name},
+            'series': [{'name': y_axis_name or '数值', 'type': 'bar', 'data': y_data}]
+        })
+    elif chart_type == 'line':
+        x_data, y_data = processed_data
+        option.update({
+            'xAxis': {'type': 'category', 'data': x_data, 'name': x_axis_name},
+            'yAxis': {'type': 'value', 'name': y_axis_name},
+            'series': [{'name': y_axis_name or '数值', 'type': 'line', 'data': y_data}]
+        })
+    elif chart_type == 'pie':
+        option.update({
+            'legend': {'top': '10%'},
+            'series': [{
+                'name': '数据',
+                'type': 'pie',
+                'radius': '50%',
+                'data': processed_data,
+                'emphasis': {
+                    'itemStyle': {
+                        'shadowBlur': 10,
+                        'shadowOffsetX': 0,
+                        'shadowColor': 'rgba(0, 0, 0, 0.5)'
+                    }
+                }
+            }]
+        })
+    elif chart_type == 'scatter':
+        option.update({
+            'xAxis': {'type': 'value', 'name': x_axis_name},
+            'yAxis': {'type': 'value', 'name': y_axis_name},
+            'series': [{'name': y_axis_name or '数值', 'type': 'scatter', 'data': processed_data}]
+        })
+    else:
+        # 默认柱状图
+        option.update({
+            'xAxis': {'type': 'category', 'data': ['A', 'B', 'C', 'D', 'E']},
+            'yAxis': {'type': 'value'},
+            'series': [{'name': '数值', 'type': 'bar', 'data': [20, 30, 40, 50, 60]}]
+        })
+    
+    if large:
+        _apply_large_options(option, chart_type, processed_data)
+    
+    return option
+
+
+# 主题样式
+_THEME_STYLES = {
+    'light': 'background-color: #fff; color: #333;',
+    'dark': 'background-color: #2c3e50; color: #ecf0f1;',
+    'vintage': 'background-color: #fef8e8; color: #8b4513;',
+    'roma': 'background-color: #f5f5dc; color: #8b0000;',
+    'shine': 'background-color: #f0f8ff; color: #4682b4;',
+    'infographic': 'background-color: #f8f9fa; color: #495057;'
+}
+
+
+def _generate_html_template(chart_option, title, chart_type, theme, compact=False, script_tags=None):
+    """生成HTML模板，compact时以紧凑JSON嵌入配置以减小文件体积"""
+    body_style = _THEME_STYLES.get(theme, _THEME_STYLES['light'])
+    if script_tags is None:
+        from chart_assets import echarts_cdn_url
+        script_tags = f'<script src="{echarts_cdn_url()}"></script>'
+    if compact:
+        option_json = json.dumps(chart_option, ensure_ascii=False, separators=(',', ':'))
+    else:
+        option_json = json.dumps(chart_option, ensure_ascii=False, indent=2)
+    
+    return f"""<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>{title or f'{chart_type.capitalize()}图表'}</title>
+    {script_tags}
+    <style>
+        body {{
+            margin: 0;
+            padding: 20px;
+            font-family: 'Microsoft YaHei', Arial, sans-serif;
+            {body_style}
+        }}
+        #chart {{
+            width: 100%;
+            height: 600px;
+        }}
+    </style>
+</head>
+<body>
+    <div id="chart"></div>
+    <script>
+        var chartDom = document.getElementById('chart');
+        var myChart = echarts.init(chartDom);
+        var option = {option_json};
+        myChart.setOption(option);
+        window.addEventListener('resize', function() {{
+            myChart.resize();
+        }});
+    </script>
+</body>
+</html>"""
+
+
+
+
+def _generate_dashboard_template(chart_options, title, theme, columns, script_tags):
+    """生成多图表仪表盘页面：每个图表一个容器，进入视口时才初始化"""
+    body_style = _THEME_STYLES.get(theme, _THEME_STYLES['light'])
+    page_title = title or '数据仪表盘'
+    containers = "\n".join(
+        f'        <div class="chart" data-index="{index}"></div>' for index in range(len(chart_options))
+    )
+    options_json = json.dumps(chart_options, ensure_ascii=False, separators=(',', ':'))
+    
+    return f"""<!DOCTYPE html>
+<html lang="zh-CN">
+<head>
+    <meta charset="UTF-8">
+    <meta name="viewport" content="width=device-width, initial-scale=1.0">
+    <title>{page_title}</title>
+    {script_tags}
+    <style>
+        body {{
+            margin: 0;
+            padding: 20px;
+            font-family: 'Microsoft YaHei', Arial, sans-serif;
+            {body_style}
+        }}
+        h1 {{
+            text-align: center;
+            font-size: 22px;
+        }}
+        .grid {{
+            display: grid;
+            grid-template-columns: repeat({columns}, minmax(0, 1fr));
+            gap: 20px;
+        }}
+        .chart {{
+            height: 420px;
+        }}
+        @media (max-width: 900px) {{
+            .grid {{
+                grid-template-columns: 1fr;
+            }}
+        }}
+    </style>
+</head>
+<body>
+    <h1>{page_title}</h1>
+    <div class="grid">
+{containers}
+    </div>
+    <script>
+        var options = {options_json};
+        var charts = [];
+        function initChart(dom) {{
+            if (dom.dataset.ready) return;
+            dom.dataset.ready = '1';
+            var chart = echarts.init(dom);
+            chart.setOption(options[Number(dom.dataset.index)]);
+            charts.push(chart);
+        }}
+        var doms = document.querySelectorAll('.chart');
+        if ('IntersectionObserver' in window) {{
+            var observer = new IntersectionObserver(function(entries) {{
+                entries.forEach(function(entry) {{
+                    if (entry.isIntersecting) {{
+                        initChart(entry.target);
+                        observer.unobserve(entry.target);
+                    }}
+                }});
+            }}, {{rootMargin: '200px'}});
+            doms.forEach(function(dom) {{ observer.observe(dom); }});
+        }} else {{
+            doms.forEach(initChart);
+        }}
+        window.addEventListener('resize', function() {{
+            charts.forEach(function(chart) {{ chart.resize(); }});
+        }});
+    </script>
+</body>
+</html>"""
+
+
+def run_visualization_tool(arguments: dict, context: ToolContext) -> str:
+    return create_echarts_visualization(
+        arguments.get("data"),
+        arguments.get("chart_type", "bar"),
+        arguments.get("output_filename", ""),
+        arguments.get("title", ""),
+        arguments.get("x_axis_name", ""),
+        arguments.get("y_axis_name", ""),
+        arguments.get("theme", "light"),
+        arguments.get("source_file"),
+        arguments.get("x_column"),
+        arguments.get("y_column"),
+        arguments.get("aggregation"),
+        arguments.get("filters"),
+        _to_int(arguments.get("limit"))
+    )
+
+
+def run_dashboard_tool(arguments: dict, context: ToolContext) -> str:
+    return create_echarts_dashboard(
+        arguments.get("charts"),
+        arguments.get("output_filename", ""),
+        arguments.get("title", ""),
+        arguments.get("theme", "light"),
+        arguments.get("columns", 2)
+    )
@@ -0,0 +1,342 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Dict, List, Optional
+from config import Config
+
+# 可以从检查点继续的运行状态
+RESUMABLE_STATUSES = ("interrupted", "failed", "cancelled")
+
+# 收到这些事件时立即落盘，其余事件按时间间隔批量写入
+_FLUSH_EVENT_TYPES = {"context_stats", "tool_call", "tool_result", "tool_end", "stream_retry", "final_answer", "done"}
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS runs (
+    run_id TEXT PRIMARY KEY,
+    session_id TEXT NOT NULL,
+    task TEXT NOT NULL,
+    status TEXT NOT NULL,
+    pid INTEGER,
+    boot_id TEXT,
+    pid_start INTEGER,
+    final_answer TEXT,
+    started_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS runs_by_session ON runs(session_id, started_at);
+CREATE TABLE IF NOT EXISTS checkpoints (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    run_id TEXT NOT NULL,
+    iteration INTEGER NOT NULL,
+    memory TEXT NOT NULL,
+    created_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS checkpoints_by_run ON checkpoints(run_id, id);
+CREATE TABLE IF NOT EXISTS events (
+    session_id TEXT NOT NULL,
+    seq INTEGER NOT NULL,
+    run_id TEXT NOT NULL,
+    event TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    PRIMARY KEY (session_id, seq)
+) WITHOUT ROWID;
+"""
+
+
+# 本进程的标识：容器重启后PID往往相同（如PID 1），只比较PID无法区分上一次运行的进程
+BOOT_ID = uuid.uuid4().hex
+
+
+def _process_start(pid: Optional[int]) -> Optional[int]:
+    """进程的启动时间（Linux下/proc/<pid>/stat的starttime），用于识别PID被其他进程复用；无法读取时返回None"""
+    try:
+        with open(f"/proc/{pid}/stat", 'r') as f:
+            stat = f.read()
+        # 进程名可能包含空格和括号，从最后一个')'之后开始按字段切分，starttime是第22个字段
+        return int(stat[stat.rindex(")") + 2:].split()[19])
+    except (OSError, ValueError, IndexError):
+        return None
+
+
+_PID_START = _process_start(os.getpid())
+
+
+def _owner_alive(pid: Optional[int], boot_id: Optional[str], pid_start: Optional[int]) -> bool:
+    """写入running记录的进程是否仍在运行"""
+    if boot_id == BOOT_ID:
+        return True
+    if not pid or pid == os.getpid():
+        # 同一PID但不是本进程写入的：上一次运行的进程已经退出
+        return False
+    if not _pid_alive(pid):
+        return False
+    if pid_start is not None:
+        current = _process_start(pid)
+        if current is not None and current != pid_start:
+            return False
+    return True
+
+
+def _pid_alive(pid: Optional[int]) -> bool:
+    if not pid:
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class CheckpointStore:
+    """基于SQLite（WAL）的只追加存储：运行记录、每轮检查点（记忆和轮次）以及发出的事件
+
+    进程重启后，上次未结束的运行标记为interrupted，可以从最后一个检查点继续；
+    事件按会话内递增的seq保存，断线或后来的客户端可以从任意游标回放。
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path or Config.CHECKPOINT_DB_PATH
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(self.path, check_same_thread=False, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("PRAGMA busy_timeout=5000")
+        self._conn.executescript(_SCHEMA)
+        self._migrate()
+        self._recover_interrupted()
+        self._prune()
+
+    # ------------------------------------------------------------ 运行记录
+
+    def begin_run(self, session_id: str, task: str) -> str:
+        run_id = uuid.uuid4().hex
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO runs (run_id, session_id, task, status, pid, boot_id, pid_start, started_at, updated_at) "
+                "VALUES (?, ?, ?, 'running', ?, ?, ?, ?, ?)",
+                (run_id, session_id, task, os.getpid(), BOOT_ID, _PID_START, now, now)
+            )
+        return run_id
+
+    def reopen_run(self, run_id: str):
+        """恢复运行前重新标记为running"""
+        with self._lock:
+            self._conn.execute(
+                "UPDATE runs SET status = 'running', pid = ?, boot_id = ?, pid_start = ?, updated_at = ? WHERE run_id = ?",
+                (os.getpid(), BOOT_ID, _PID_START, time.time(), run_id)
+            )
+
+    def finish_run(self, run_id: str, status: str, final_answer: str = None):
+        """结束运行，只保留最后一个检查点"""
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute(
+                    "UPDATE runs SET status = ?, final_answer = ?, updated_at = ? WHERE run_id = ?",
+                    (status, final_answer, time.time(), run_id)
+                )
+                self._conn.execute(
+                    "DELETE FROM checkpoints WHERE run_id = ? AND id < "
+                    "(SELECT MAX(id) FROM checkpoints WHERE run_id = ?)",
+                    (run_id, run_id)
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def get_run(self, run_id: str) -> Optional[Dict[str, Any]]:
+        return self._fetch_run("SELECT * FROM runs WHERE run_id = ?", (run_id,))
+
+    def latest_run(self, session_id: str) -> Optional[Dict[str, Any]]:
+        return self._fetch_run(
+            "SELECT * FROM runs WHERE session_id = ? ORDER BY started_at DESC LIMIT 1", (session_id,)
+        )
+
+    def resumable_runs(self) -> List[Dict[str, Any]]:
+        """每个会话最近一次被中断的运行"""
+        with self._lock:
+            cursor = self._conn.execute(
+                "SELECT * FROM runs r WHERE status = 'interrupted' AND started_at = "
+                "(SELECT MAX(started_at) FROM runs WHERE session_id = r.session_id)"
+            )
+            return [self._row_to_dict(cursor, row) for row in cursor.fetchall()]
+
+    def resumable_sessions(self) -> set:
+        """最近一次运行处于可恢复状态（RESUMABLE_STATUSES）的会话"""
+        placeholders = ", ".join("?" for _ in RESUMABLE_STATUSES)
+        with self._lock:
+            rows = self._conn.execute(
+                f"SELECT session_id FROM runs r WHERE status IN ({placeholders}) AND started_at = "
+                "(SELECT MAX(started_at) FROM runs WHERE session_id = r.session_id)",
+                RESUMABLE_STATUSES
+            ).fetchall()
+        return {row[0] for row in rows}
+
+    # ------------------------------------------------------------ 检查点
+
+    def save_checkpoint(self, run_id: str, iteration: int, memory: List[Dict[str, Any]]):
+        with self._lock:
+            self._conn.execute(
+                "INSERT INTO checkpoints (run_id, iteration, memory, created_at) VALUES (?, ?, ?, ?)",
+                (run_id, iteration, json.dumps(memory, ensure_ascii=False), time.time())
+            )
+            self._conn.execute("UPDATE runs SET updated_at = ? WHERE run_id = ?", (time.time(), run_id))
+
+    def latest_checkpoint(self, run_id: str) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT iteration, memory, created_at FROM checkpoints WHERE run_id = ? ORDER BY id DESC LIMIT 1",
+                (run_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        return {"iteration": row[0], "memory": json.loads(row[1]), "created_at": row[2]}
+
+    # ------------------------------------------------------------ 事件
+
+    def next_seq(self, session_id: str) -> int:
+        with self._lock:
+            row = self._conn.execute("SELECT MAX(seq) FROM events WHERE session_id = ?", (session_id,)).fetchone()
+        return (row[0] or 0) + 1
+
+    def first_seq(self, run_id: str) -> Optional[int]:
+        with self._lock:
+            row = self._conn.execute("SELECT MIN(seq) FROM events WHERE run_id = ?", (run_id,)).fetchone()
+        return row[0]
+
+    def append_events(self, rows: List[tuple]):
+        """rows为(session_id, seq, run_id, 事件JSON, 时间)"""
+        if not rows:
+            return
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.executemany(
+                    "INSERT OR REPLACE INTO events (session_id, seq, run_id, event, created_at) VALUES (?, ?, ?, ?, ?)",
+                    rows
+                )
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def events_after(self, session_id: str, cursor: int, limit: int = 500) -> List[Dict[str, Any]]:
+        with self._lock:
+            rows = self._conn.execute(
+                "SELECT event FROM events WHERE session_id = ? AND seq > ? ORDER BY seq LIMIT ?",
+                (session_id, cursor, limit)
+            ).fetchall()
+        return [json.loads(row[0]) for row in rows]
+
+    # ------------------------------------------------------------ 维护
+
+    def _migrate(self):
+        """为旧版本创建的数据库补充进程标识列"""
+        with self._lock:
+            columns = {row[1] for row in self._conn.execute("PRAGMA table_info(runs)").fetchall()}
+            for column, column_type in (("boot_id", "TEXT"), ("pid_start", "INTEGER")):
+                if column not in columns:
+                    self._conn.execute(f"ALTER TABLE runs ADD COLUMN {column} {column_type}")
+
+    def _recover_interrupted(self):
+        """把所属进程已经退出的running运行标记为interrupted
+
+        按BOOT_ID和进程启动时间判断，PID相同（容器重启、PID被复用）但不是同一个进程时同样视为已退出。
+        """
+        with self._lock:
+            rows = self._conn.execute("SELECT run_id, pid, boot_id, pid_start FROM runs WHERE status = 'running'").fetchall()
+            stale = [(time.time(), run_id) for run_id, pid, boot_id, pid_start in rows
+                     if not _owner_alive(pid, boot_id, pid_start)]
+            if stale:
+                self._conn.executemany("UPDATE runs SET status = 'interrupted', updated_at = ? WHERE run_id = ?", stale)
+
+    def _prune(self):
+        """删除超过保留期的运行、检查点和事件"""
+        deadline = time.time() - Config.CHECKPOINT_RETENTION
+        with self._lock:
+            self._conn.execute("BEGIN")
+            try:
+                self._conn.execute(
+                    "DELETE FROM checkpoints WHERE run_id IN "
+                    "(SELECT run_id FROM runs WHERE updated_at < ? AND status != 'running')", (deadline,)
+                )
+                self._conn.execute("DELETE FROM events WHERE created_at < ?", (deadline,))
+                self._conn.execute("DELETE FROM runs WHERE updated_at < ? AND status != 'running'", (deadline,))
+                self._conn.execute("COMMIT")
+            except BaseException:
+                self._conn.execute("ROLLBACK")
+                raise
+
+    def _fetch_run(self, sql: str, params: tuple) -> Optional[Dict[str, Any]]:
+        with self._lock:
+            cursor = self._conn.execute(sql, params)
+            row = cursor.fetchone()
+            return self._row_to_dict(cursor, row) if row else None
+
+    @staticmethod
+    def _row_to_dict(cursor, row) -> Dict[str, Any]:
+        return {column[0]: value for column, value in zip(cursor.description, row)}
+
+
+class RunRecorder:
+    """记录一次运行发出的事件并转发给前端队列，接口与队列兼容（put_nowait）
+
+    每个事件附带会话内递增的seq；事件先缓存在内存中，按间隔或遇到关键事件时批量写入。
+    """
+
+    def __init__(self, store: CheckpointStore, session_id: str, run_id: str, downstream=None):
+        self.store = store
+        self.session_id = session_id
+        self.run_id = run_id
+        self.downstream = downstream
+        self._lock = threading.Lock()
+        self._seq = store.next_seq(session_id)
+        self._pending: List[tuple] = []
+        self._last_flush = time.monotonic()
+
+    def put_nowait(self, event: dict):
+        with self._lock:
+            record = {**event, "seq": self._seq}
+            self._seq += 1
+            self._pending.append((self.session_id, record["seq"], self.run_id,
+                                  json.dumps(record, ensure_ascii=False), time.time()))
+            due = (event.get("type") in _FLUSH_EVENT_TYPES
+                   or time.monotonic() - self._last_flush >= Config.CHECKPOINT_EVENT_FLUSH_INTERVAL)
+            if due:
+                self._flush_locked()
+        if self.downstream is not None:
+            self.downstream.put_nowait(record)
+
+    put = put_nowait
+
+    def flush(self):
+        with self._lock:
+            self._flush_locked()
+
+    def _flush_locked(self):
+        pending, self._pending = self._pending, []
+        self._last_flush = time.monotonic()
+        try:
+            self.store.append_events(pending)
+        except Exception as e:
+            print(f"事件写入检查点失败: {str(e)}")
+
+
+_default_store: Optional[CheckpointStore] = None
+_default_store_lock = threading.Lock()
+
+
+def get_checkpoint_store() -> CheckpointStore:
+    """获取进程级共享的检查点存储"""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = CheckpointStore()
+        return _default_store
@@ -8,8 +8,108 @@ class Config:
     API_KEY = "****"
     MODEL_NAME = "glm-4.5"
     
+    # LLM连接池与重试配置（进程内所有会话共用一个客户端）
+    LLM_MAX_CONNECTIONS = 100  # 到模型服务的最大并发连接数
+    LLM_MAX_KEEPALIVE_CONNECTIONS = 20  # 空闲时保留的keep-alive连接数
+    LLM_KEEPALIVE_EXPIRY = 30  # 空闲连接保留时间（秒）
+    LLM_CONNECT_TIMEOUT = 10  # 建立连接超时（秒）
+    LLM_READ_TIMEOUT = 120  # 两次收到数据之间的最长等待（秒）
+    LLM_WRITE_TIMEOUT = 30  # 发送请求超时（秒）
+    LLM_POOL_TIMEOUT = 30  # 等待连接池空闲连接的超时（秒）
+    LLM_MAX_RETRIES = 3  # 429/5xx/连接错误/流中断的最大重试次数
+    LLM_RETRY_BASE_DELAY = 0.5  # 指数退避的基数（秒），实际等待在[0, 基数*2^n]内随机
+    LLM_RETRY_MAX_DELAY = 8  # 单次重试等待上限（秒）
+    
     # 基本配置
     MAX_ITERATIONS = 10
+    # 工具调用方式："text"由模型在回复中写Action JSON再解析；
+    # "native"通过chat接口的tools参数发送工具定义，使用模型原生的函数调用，系统提示大幅缩短
+    TOOL_CALL_MODE = "text"
+    
+    # 上下文配置
+    CONTEXT_TOKEN_BUDGET = 24000  # 每轮发送给模型的上下文token上限（含系统提示）
+    CONTEXT_KEEP_RECENT_TOOL_RESULTS = 2  # 完整保留最近几次工具结果，更早的折叠为摘要
+    CONTEXT_TOOL_STUB_CHARS = 200  # 折叠后保留的工具结果字符数
+    
+    # 会话配置
+    MAX_SESSIONS = 50  # 同时存活的会话上限
+    SESSION_IDLE_TIMEOUT = 30 * 60  # 会话空闲回收时间（秒）
+    
+    # 检查点配置：按轮次持久化记忆和事件，重启后可恢复运行、断线后可回放事件
+    CHECKPOINT_ENABLED = True
+    CHECKPOINT_DB_PATH = os.path.join(os.path.dirname(__file__), "checkpoints.db")
+    CHECKPOINT_EVENT_FLUSH_INTERVAL = 0.2  # 普通事件批量写入的间隔（秒）
+    CHECKPOINT_RETENTION = 7 * 24 * 3600  # 运行记录和事件的保留时间（秒）
+    CHECKPOINT_AUTO_RESUME = False  # 启动时自动恢复上次被中断的运行
+    EVENT_REPLAY_POLL_INTERVAL = 0.25  # 回放进行中的运行时查询新事件的间隔（秒）
+    
+    # 任务调度配置：限制并发的模型调用和工具执行，超出时排队
+    SCHEDULER_LLM_CONCURRENCY = 32  # 全局同时进行的模型调用数
+    SCHEDULER_LLM_PER_CLIENT = 4  # 单个客户端同时进行的模型调用数
+    SCHEDULER_TOOL_CONCURRENCY = 8  # 全局同时执行的工具数
+    SCHEDULER_TOOL_PER_CLIENT = 2  # 单个客户端同时执行的工具数
+    SCHEDULER_MAX_QUEUE = 100  # 已接收的任务超过模型并发数加此数量（或等待模型调用的请求达到此数量）时，新任务直接返回429
+    SCHEDULER_MAX_TASKS_PER_CLIENT = 8  # 单个客户端进行中的任务上限，超出时返回429
+    
+    # 异步服务配置（asgi_app.py）
+    SSE_HEARTBEAT_INTERVAL = 15  # 无事件时发送心跳的间隔（秒）
+    CANCEL_ON_DISCONNECT = True  # SSE客户端断开时取消任务；关闭后任务继续运行，可通过事件回放接口重新接收
+    TOOL_EXECUTOR_WORKERS = 16  # 执行阻塞工具的线程池大小
+    
+    # 代码执行沙箱配置
+    SANDBOX_WORKERS = 4  # 预先启动的执行进程数
+    SANDBOX_TIMEOUT = 30  # 单次执行的墙钟超时（秒）
+    SANDBOX_CPU_LIMIT = 20  # 单次执行的CPU时间上限（秒）
+    SANDBOX_MEMORY_LIMIT_MB = 2048  # 执行进程的内存上限（MB）
+    SANDBOX_MAX_TASKS_PER_WORKER = 100  # 执行次数达到后回收进程，防止内存泄漏累积
+    SANDBOX_START_METHOD = "forkserver"  # 不支持时退回spawn
+    TOOL_OUTPUT_FLUSH_INTERVAL = 0.2  # 执行中输出推送到前端的最小间隔（秒）
+    CANCEL_POLL_INTERVAL = 0.1  # 代码执行期间检查任务是否被取消的间隔（秒）
+    SANDBOX_PREWARM_MODULES = ["json", "csv", "math", "statistics", "datetime", "collections", "pandas", "numpy"]
+    
+    # 会话内核配置：启用后每个会话独占一个常驻执行进程，变量在多次execute_code之间保留
+    EXECUTE_CODE_STATEFUL = False
+    KERNEL_IDLE_TIMEOUT = 10 * 60  # 内核空闲回收时间（秒）
+    MAX_KERNELS = 20  # 同时存活的会话内核上限
+    
+    # read_file配置
+    READ_FILE_MAX_BYTES = 64 * 1024  # 不超过此大小的文件直接返回全文，也是单页的字节上限
+    READ_FILE_DEFAULT_LINES = 200  # 分页读取时默认的行数
+    READ_FILE_DEFAULT_BYTES = 16 * 1024  # 按字节分页时默认的字节数
+    
+    # 大块工具结果转存配置
+    TOOL_RESULT_SPILL_CHARS = 4000  # 超过此长度的工具结果转存到磁盘，记忆中只保留句柄和预览
+    TOOL_RESULT_PREVIEW_CHARS = 1500  # 转存后记忆和前端中保留的预览长度
+    TOOL_RESULT_PAGE_LINES = 200  # read_tool_result默认读取的行数
+    BLOB_STORE_PATH = os.path.join(os.path.dirname(__file__), ".tool_results")  # 启动时只保留可恢复运行所在会话的结果
+    BLOB_MAX_SESSION_BYTES = 64 * 1024 * 1024  # 单个会话转存结果的磁盘上限，超出时删除最早的结果
+    
+    # query_table配置
+    TABLE_CACHE_MAX_TABLES = 8  # 内存中缓存的已解析表数量上限（LRU淘汰）
+    QUERY_TABLE_MAX_ROWS = 50  # 单次查询返回的最大行数，避免大结果进入上下文
+    
+    # 图表配置
+    ECHARTS_LARGE_THRESHOLD = 5000  # 数据点超过此数量时启用大数据模式（降采样、large/progressive、紧凑JSON）
+    ECHARTS_LINE_MAX_POINTS = 2000  # 大数据折线图LTTB降采样后保留的点数
+    ECHARTS_BAR_MAX_CATEGORIES = 1000  # 大数据柱状图保留的类别数（含合并其余类别的“其他”）
+    ECHARTS_SCATTER_BINS = 100  # 大数据散点图每个坐标轴的分箱数
+    ECHARTS_PROGRESSIVE = 5000  # 渐进渲染时每帧绘制的图形数量
+    ECHARTS_VERSION = "5.4.3"
+    ECHARTS_CDN_URL = "https://cdn.jsdelivr.net/npm/echarts@{version}/dist/echarts.min.js"
+    ECHARTS_LOCAL_ASSET = True  # 图表引用工作区内的本地ECharts文件，不可用时退回CDN
+    ECHARTS_DOWNLOAD_TIMEOUT = 10  # 后台下载本地ECharts文件的超时（秒）
+    ECHARTS_DOWNLOAD_RETRY_INTERVAL = 10 * 60  # 下载失败后的重试间隔（秒）
+    ECHARTS_ASSET_MAX_AGE = 365 * 24 * 3600  # 带版本号的静态资源的浏览器缓存时间（秒）
+    
+    # 工具插件配置：第三方包通过该entry point分组注册工具
+    TOOL_PLUGINS_ENABLED = True
+    TOOL_PLUGIN_GROUP = "code_agent.tools"
+    
+    # 追踪与指标配置
+    TRACE_SINKS = ["metrics"]  # span接收方：metrics（汇总到/metrics）、console（打印）、jsonl（写入文件）
+    TRACE_JSONL_PATH = os.path.join(os.path.dirname(__file__), "traces.jsonl")
     
     # 工作空间配置
     WORKSPACE_PATH = os.path.join(os.path.dirname(__file__), "workspace")
+    WORKSPACE_INDEX_SCAN_INTERVAL = 5  # 无文件系统通知时，索引重新扫描的最小间隔（秒）
+    WORKSPACE_PREVIEW_MAX_BYTES = 256 * 1024  # /api/workspace/file 返回内容的大小上限
@@ -0,0 +1,137 @@
+import json
+from functools import lru_cache
+from typing import List, Dict, Any
+from config import Config
+
+# 记忆中特殊消息的前缀，由CodeAgent写入
+TOOL_RESULT_PREFIX = "工具执行结果: "
+REMINDER_PREFIX = "提醒：你的原始任务是："
+
+# 过期的任务提醒替换为简短提示，保持user/assistant交替
+STALE_REMINDER = "请根据以上工具执行结果继续。"
+
+# 每条消息的格式开销（role、分隔符等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+
+# 只缓存短文本（工具名、任务提醒、折叠摘要等反复出现的内容）；系统提示和工具结果等长文本
+# 估算本身只是一次编码，每次直接计算，避免缓存在进程生命周期内持有大量大字符串
+_CACHED_TEXT_MAX_CHARS = 512
+
+
+def count_tokens(text: str) -> int:
+    """估算文本token数：非ASCII字符（中文等）约1字符1个token，ASCII约4字符1个token"""
+    if not text:
+        return 0
+    if len(text) <= _CACHED_TEXT_MAX_CHARS:
+        return _count_short_tokens(text)
+    return _estimate_tokens(text)
+
+
+@lru_cache(maxsize=4096)
+def _count_short_tokens(text: str) -> int:
+    return _estimate_tokens(text)
+
+
+def _estimate_tokens(text: str) -> int:
+    char_count = len(text)
+    # UTF-8下非ASCII字符占2~4字节，用字节差估算其数量，避免逐字符遍历
+    non_ascii = min(char_count, (len(text.encode('utf-8')) - char_count) // 2)
+    ascii_count = char_count - non_ascii
+    return non_ascii + (ascii_count + 3) // 4
+
+
+def count_message_tokens(message: Dict[str, Any]) -> int:
+    """估算单条消息的token数（含原生函数调用模式下的工具名和参数）"""
+    tokens = count_tokens(message.get("content") or "") + MESSAGE_OVERHEAD_TOKENS
+    for call in message.get("tool_calls") or []:
+        function = call.get("function", {})
+        tokens += count_tokens(function.get("name", "")) + count_tokens(function.get("arguments", ""))
+    return tokens
+
+
+def count_tools_tokens(tools: List[Dict[str, Any]]) -> int:
+    """估算随请求发送的工具定义占用的token数"""
+    return count_tokens(json.dumps(tools, ensure_ascii=False)) if tools else 0
+
+
+class ContextManager:
+    """在token预算内构建发送给模型的上下文，不修改原始记忆"""
+
+    def __init__(self, token_budget: int = None, keep_recent_tool_results: int = None, stub_chars: int = None):
+        self.token_budget = token_budget or Config.CONTEXT_TOKEN_BUDGET
+        self.keep_recent_tool_results = (
+            Config.CONTEXT_KEEP_RECENT_TOOL_RESULTS if keep_recent_tool_results is None else keep_recent_tool_results
+        )
+        self.stub_chars = Config.CONTEXT_TOOL_STUB_CHARS if stub_chars is None else stub_chars
+
+    def build_messages(self, system_prompt: str, memory: List[Dict[str, Any]], tools: List[Dict[str, Any]] = None) -> tuple[list, dict]:
+        """返回裁剪后的消息列表和本轮上下文统计，tools为随请求发送的工具定义，计入预算"""
+        messages = [dict(message) for message in memory]
+        stats = {"collapsed": 0, "deduped": 0, "dropped": 0}
+
+        self._dedupe_reminders(messages, stats)
+
+        tool_indexes = [i for i, message in enumerate(messages) if self._is_tool_result(message)]
+        # 1. 较早的工具结果一律折叠为摘要
+        stale_count = max(0, len(tool_indexes) - self.keep_recent_tool_results)
+        for i in tool_indexes[:stale_count]:
+            self._collapse(messages, i, stats)
+
+        system_tokens = count_tokens(system_prompt) + MESSAGE_OVERHEAD_TOKENS
+        tool_tokens = count_tools_tokens(tools)
+        total = system_tokens + tool_tokens + sum(count_message_tokens(message) for message in messages)
+
+        # 2. 仍超出预算时，从旧到新继续折叠最近的工具结果
+        for i in tool_indexes[stale_count:]:
+            if total <= self.token_budget:
+                break
+            before = count_message_tokens(messages[i])
+            self._collapse(messages, i, stats)
+            total -= before - count_message_tokens(messages[i])
+
+        # 3. 仍超出预算时，保留原始任务，从最早的历史消息开始丢弃
+        while total > self.token_budget and len(messages) > 2:
+            total -= count_message_tokens(messages.pop(1))
+            stats["dropped"] += 1
+            # 工具消息必须紧跟发起调用的assistant消息，失去对应调用的一并丢弃
+            while len(messages) > 1 and messages[1].get("role") == "tool":
+                total -= count_message_tokens(messages.pop(1))
+                stats["dropped"] += 1
+
+        stats.update({
+            "prompt_tokens": total,
+            "system_tokens": system_tokens,
+            "tool_tokens": tool_tokens,
+            "messages": len(messages) + 1,
+            "budget": self.token_budget
+        })
+        return [{"role": "system", "content": system_prompt}] + messages, stats
+
+    @staticmethod
+    def _is_tool_result(message: Dict[str, Any]) -> bool:
+        if message.get("role") == "tool":
+            return True
+        return message.get("role") == "assistant" and (message.get("content") or "").startswith(TOOL_RESULT_PREFIX)
+
+    @staticmethod
+    def _dedupe_reminders(messages: List[Dict[str, Any]], stats: dict):
+        """只保留最后一条完整的任务提醒"""
+        reminder_indexes = [
+            i for i, message in enumerate(messages)
+            if message.get("role") == "user" and (message.get("content") or "").startswith(REMINDER_PREFIX)
+        ]
+        for i in reminder_indexes[:-1]:
+            messages[i]["content"] = STALE_REMINDER
+            stats["deduped"] += 1
+
+    def _collapse(self, messages: List[Dict[str, Any]], index: int, stats: dict):
+        """将工具结果折叠为简短摘要"""
+        # 原生函数调用模式下工具结果是role为tool的消息，没有前缀
+        prefix = "" if messages[index].get("role") == "tool" else TOOL_RESULT_PREFIX
+        result = (messages[index].get("content") or "")[len(prefix):]
+        if len(result) <= self.stub_chars:
+            return
+        preview = result[:self.stub_chars]
+        messages[index]["content"] = f"{prefix}{preview}...[已省略，原结果共{len(result)}字符]"
+        stats["collapsed"] += 1
@@ -0,0 +1,127 @@
+import os
+import re
+import tempfile
+from typing import List
+
+
+def _read_umask() -> int:
+    # umask只能通过设置来读取，导入时读取一次后立即恢复
+    mask = os.umask(0)
+    os.umask(mask)
+    return mask
+
+
+# 新建文件的权限与open()创建时一致（0666去掉umask），而不是mkstemp的0600
+_NEW_FILE_MODE = 0o666 & ~_read_umask()
+
+_HUNK_HEADER = re.compile(r'^@@\s*-(\d+)(?:,(\d+))?\s+\+(\d+)(?:,(\d+))?\s*@@')
+
+
+class PatchError(ValueError):
+    """补丁或替换内容无法应用到文件"""
+
+
+def atomic_write(abs_path: str, content: str):
+    """先写入同目录下的临时文件再重命名，读者不会看到写了一半的文件"""
+    directory = os.path.dirname(abs_path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=".", suffix=".tmp")
+    try:
+        with os.fdopen(fd, 'w', encoding='utf-8', newline='') as f:
+            f.write(content)
+        if os.path.exists(abs_path):
+            os.chmod(temp_path, os.stat(abs_path).st_mode & 0o7777)
+        else:
+            os.chmod(temp_path, _NEW_FILE_MODE)
+        os.replace(temp_path, abs_path)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        raise
+
+
+def apply_search_replace(content: str, search: str, replace: str, replace_all: bool = False) -> tuple[str, int]:
+    """精确查找并替换，返回(新内容, 替换次数)"""
+    if not search:
+        raise PatchError("search不能为空")
+    count = content.count(search)
+    if count == 0:
+        raise PatchError(f"未找到要替换的内容: {search[:80]!r}")
+    if count > 1 and not replace_all:
+        raise PatchError(f"要替换的内容匹配到{count}处，请提供更多上下文使其唯一，或设置replace_all=true")
+    return content.replace(search, replace, -1 if replace_all else 1), count if replace_all else 1
+
+
+def _parse_unified_diff(patch: str) -> List[tuple]:
+    """解析unified diff，返回[(起始行提示, 原行列表, 新行列表)]"""
+    hunks = []
+    current = None
+    for line in patch.split('\n'):
+        if line.startswith('---') or line.startswith('+++') or line.startswith('diff ') or line.startswith('index '):
+            if current is None:
+                continue
+        if line.startswith('@@'):
+            match = _HUNK_HEADER.match(line)
+            hint = None
+            if match:
+                # 原范围为空（-N,0）表示在第N行之后插入，否则N是第一条原行的行号
+                start = int(match.group(1))
+                hint = start if match.group(2) == "0" else start - 1
+            current = (hint, [], [])
+            hunks.append(current)
+            continue
+        if current is None or line.startswith('\\'):
+            continue
+        if line.startswith('-'):
+            current[1].append(line[1:])
+        elif line.startswith('+'):
+            current[2].append(line[1:])
+        else:
+            # 上下文行；模型有时会丢掉行首空格，空行按空上下文处理
+            text = line[1:] if line.startswith(' ') else line
+            current[1].append(text)
+            current[2].append(text)
+
+    # 去掉split在末尾产生的空上下文行
+    for _, old_lines, new_lines in hunks:
+        while old_lines and new_lines and old_lines[-1] == "" and new_lines[-1] == "":
+            old_lines.pop()
+            new_lines.pop()
+    if not hunks:
+        raise PatchError("补丁中没有找到@@开头的hunk")
+    return hunks
+
+
+def _find_block(lines: List[str], block: List[str], hint: int, normalize) -> int:
+    """查找block在lines中的位置，有多处匹配时取离hint最近的一处，找不到返回-1"""
+    if not block:
+        return max(0, min(hint if hint is not None else len(lines), len(lines)))
+    first = normalize(block[0])
+    best = -1
+    for i in range(len(lines) - len(block) + 1):
+        if normalize(lines[i]) != first:
+            continue
+        if all(normalize(lines[i + j]) == normalize(block[j]) for j in range(1, len(block))):
+            if hint is None:
+                return i
+            if best == -1 or abs(i - hint) < abs(best - hint):
+                best = i
+    return best
+
+
+def apply_unified_diff(content: str, patch: str) -> tuple[str, int]:
+    """应用unified diff，返回(新内容, 应用的hunk数)；行号仅作定位提示，以上下文内容为准"""
+    lines = content.split('\n')
+    delta = 0
+    hunks = _parse_unified_diff(patch)
+    for number, (hint, old_lines, new_lines) in enumerate(hunks, start=1):
+        expected = None if hint is None else hint + delta
+        position = _find_block(lines, old_lines, expected, lambda text: text)
+        if position == -1:
+            # 再尝试忽略行尾空白
+            position = _find_block(lines, old_lines, expected, lambda text: text.rstrip())
+        if position == -1:
+            raise PatchError(f"第{number}个hunk的上下文与文件内容不匹配")
+        lines[position:position + len(old_lines)] = new_lines
+        delta += len(new_lines) - len(old_lines)
+    return '\n'.join(lines), len(hunks)
@@ -3,6 +3,10 @@ class CodeAgentApp {
         this.eventSource = null;
         this.isConnected = false;
         this.currentFileContent = null;
+        this.sessionId = null;
+        this.lastEventSeq = undefined;
+        this.replayAttempts = 0;
+        this.currentToolOutput = null;
         
         this.initializeElements();
         this.bindEvents();
@@ -19,6 +23,7 @@ class CodeAgentApp {
         this.chatMessages = document.getElementById('chatMessages');
         this.chatInput = document.getElementById('chatInput');
         this.sendBtn = document.getElementById('sendBtn');
+        this.stopBtn = document.getElementById('stopBtn');
         this.fileModal = document.getElementById('fileModal');
         this.modalTitle = document.getElementById('modalTitle');
         this.modalBody = document.getElementById('modalBody');
@@ -29,6 +34,9 @@ class CodeAgentApp {
         // 发送按钮点击事件
         this.sendBtn.addEventListener('click', () => this.sendMessage());
         
+        // 停止按钮点击事件
+        this.stopBtn.addEventListener('click', () => this.cancelTask());
+        
         // 输入框事件
         this.chatInput.addEventListener('input', () => this.handleInputChange());
         this.chatInput.addEventListener('keydown', (e) => this.handleKeyDown(e));
@@ -162,26 +170,50 @@ class CodeAgentApp {
     }
 
     async openFile(filePath) {
+        const fileExtension = filePath.toLowerCase().split('.').pop();
+        const isHtmlFile = fileExtension === 'html' || fileExtension === 'htm';
+        const rawUrl = this.getRawFileUrl(filePath);
+
+        if (isHtmlFile) {
+            // HTML文件直接由iframe加载原始文件，浏览器可以利用ETag缓存
+            this.showFileModal(filePath, null, true, rawUrl);
+            return;
+        }
+
         try {
-            const response = await fetch(`/api/workspace/file/${encodeURIComponent(filePath)}`);
-            const data = await response.json();
-            
-            if (data.success) {
-                // 检查文件扩展名
-                const fileExtension = data.filename.toLowerCase().split('.').pop();
-                const isHtmlFile = fileExtension === 'html' || fileExtension === 'htm';
-                
-                this.showFileModal(data.filename, data.content, isHtmlFile);
-            } else {
-                alert(`打开文件失败: ${data.error}`);
-            }
+            const data = await this.fetchFilePreview(filePath);
+            this.showFileModal(data.filename, data.content, false, rawUrl, data);
         } catch (error) {
             console.error('打开文件失败:', error);
-            alert('打开文件失败');
+            alert(`打开文件失败: ${error.message}`);
         }
     }
 
-    showFileModal(filename, content, isHtmlFile = false) {
+    getRawFileUrl(filePath) {
+        return `/api/workspace/raw/${filePath.split('/').map(encodeURIComponent).join('/')}`;
+    }
+
+    async fetchFilePreview(filePath) {
+        const response = await fetch(`/api/workspace/file/${encodeURIComponent(filePath)}`);
+        const data = await response.json();
+        if (!data.success) {
+            throw new Error(data.error);
+        }
+        return data;
+    }
+
+    renderSourceView(container, content, preview, rawUrl) {
+        container.innerHTML = `<pre><code>${this.escapeHtml(content)}</code></pre>`;
+        if (preview && preview.truncated) {
+            // 大文件只预览开头部分，完整内容通过原始文件链接获取
+            const notice = document.createElement('div');
+            notice.className = 'truncated-notice';
+            notice.innerHTML = `文件较大（${preview.size} 字节），仅显示前 ${preview.content.length} 个字符。<a href="${rawUrl}" target="_blank">查看完整文件</a>`;
+            container.prepend(notice);
+        }
+    }
+
+    showFileModal(filename, content, isHtmlFile = false, rawUrl = null, preview = null) {
         this.modalTitle.textContent = filename;
         this.modalBody.innerHTML = '';
 
@@ -193,15 +225,15 @@ class CodeAgentApp {
             iframeContainer.className = 'iframe-container';
             
             const iframe = document.createElement('iframe');
-            iframe.srcdoc = content;
+            iframe.src = rawUrl;
             
             iframeContainer.appendChild(iframe);
 
-            // 创建源代码视图
+            // 创建源代码视图，首次切换时才加载
             const sourceContainer = document.createElement('div');
             sourceContainer.className = 'source-container';
             sourceContainer.style.display = 'none'; // 默认隐藏
-            sourceContainer.innerHTML = `<pre><code>${this.escapeHtml(content)}</code></pre>`;
+            let sourceLoaded = false;
 
             this.modalBody.appendChild(iframeContainer);
             this.modalBody.appendChild(sourceContainer);
@@ -215,9 +247,20 @@ class CodeAgentApp {
             toggleBtn.className = 'toggle-view-btn';
             
             let showingSource = false;
-            toggleBtn.addEventListener('click', () => {
+            toggleBtn.addEventListener('click', async () => {
                 showingSource = !showingSource;
                 if (showingSource) {
+                    if (!sourceLoaded) {
+                        sourceLoaded = true;
+                        sourceContainer.innerHTML = '<div class="loading">加载中...</div>';
+                        try {
+                            const data = await this.fetchFilePreview(filename);
+                            this.renderSourceView(sourceContainer, data.content, data, rawUrl);
+                        } catch (error) {
+                            sourceLoaded = false;
+                            sourceContainer.innerHTML = `<div class="loading">加载失败: ${this.escapeHtml(error.message)}</div>`;
+                        }
+                    }
                     iframeContainer.style.display = 'none';
                     sourceContainer.style.display = 'block';
                     toggleBtn.textContent = '查看渲染效果';
@@ -233,7 +276,7 @@ class CodeAgentApp {
             
         } else {
             // 非HTML文件，显示源代码
-            this.modalBody.innerHTML = `<pre><code>${this.escapeHtml(content)}</code></pre>`;
+            this.renderSourceView(this.modalBody, content, preview, rawUrl);
         }
         
         this.fileModal.classList.add('show');
@@ -289,6 +332,7 @@ class CodeAgentApp {
 
         // 添加用户消息
         this.addMessage('user', message);
+        this.stopBtn.hidden = false;
 
         try {
             // 发送消息到后端
@@ -297,9 +341,20 @@ class CodeAgentApp {
                 headers: {
                     'Content-Type': 'application/json',
                 },
-                body: JSON.stringify({ message })
+                body: JSON.stringify({ message, session_id: this.sessionId })
             });
 
+            if (response.status === 429) {
+                // 服务端排队已满，提示稍后重试
+                const body = await response.json().catch(() => ({}));
+                const retryAfter = response.headers.get('Retry-After');
+                this.addMessage('assistant', `${body.error || '服务繁忙'}，请${retryAfter ? ` ${retryAfter} 秒后` : '稍后'}重试。`);
+                this.chatInput.disabled = false;
+                this.sendBtn.disabled = false;
+                this.sendBtn.textContent = '发送';
+                return;
+            }
+
             if (!response.ok) {
                 throw new Error(`HTTP error! status: ${response.status}`);
             }
@@ -315,6 +370,21 @@ class CodeAgentApp {
             this.chatInput.disabled = false;
             this.sendBtn.disabled = false;
             this.sendBtn.textContent = '发送';
+        } finally {
+            this.stopBtn.hidden = true;
+        }
+    }
+
+    async cancelTask() {
+        // 停止服务端正在执行的任务，随后会收到cancelled和final_answer事件
+        if (!this.sessionId) return;
+        this.stopBtn.disabled = true;
+        try {
+            await fetch(`/api/chat/${this.sessionId}/cancel`, { method: 'POST' });
+        } catch (error) {
+            console.error('取消任务失败:', error);
+        } finally {
+            this.stopBtn.disabled = false;
         }
     }
 
@@ -323,6 +393,7 @@ class CodeAgentApp {
         const decoder = new TextDecoder();
         let assistantMessageId = null;
         let currentContent = '';
+        let streamCheckpoint = 0;
 
         try {
             while (true) {
@@ -347,13 +418,33 @@ class CodeAgentApp {
                                 continue;
                             }
 
+                            if (parsed.seq !== undefined) {
+                                // 记录回放游标，连接中断后从这里继续
+                                this.lastEventSeq = parsed.seq;
+                            }
+
                             if (parsed.error) {
                                 this.addMessage('assistant', `错误: ${parsed.error}`);
                                 return;
                             }
 
                             // 处理不同类型的消息
-                            if (parsed.type === 'thinking_start') {
+                            if (parsed.type === 'session') {
+                                // 记录会话ID，后续消息复用同一会话
+                                this.sessionId = parsed.session_id;
+                            } else if (parsed.type === 'queue') {
+                                // 模型调用或工具执行在服务端排队
+                                this.showQueueStatus(parsed.resource, parsed.position);
+                            } else if (parsed.type === 'context_stats') {
+                                // 每次请求模型前都会收到，记下此时的内容位置，重试时回退到这里
+                                streamCheckpoint = currentContent.length;
+                            } else if (parsed.type === 'stream_retry') {
+                                // 模型流中断后重试，丢弃这次请求已经显示的部分内容
+                                if (assistantMessageId) {
+                                    currentContent = currentContent.slice(0, streamCheckpoint);
+                                    this.updateMessage(assistantMessageId, currentContent, false);
+                                }
+                            } else if (parsed.type === 'thinking_start') {
                                 // 开始思考，创建思考消息
                                 if (!assistantMessageId) {
                                     assistantMessageId = this.addMessage('assistant', '', true); // 标记为思考消息
@@ -388,9 +479,16 @@ class CodeAgentApp {
                             } else if (parsed.type === 'tool_call') {
                                 // 显示工具调用信息
                                 this.addToolMessage('tool_call', parsed.content || '🔧 调用工具...');
+                            } else if (parsed.type === 'tool_output') {
+                                // 实时显示代码执行过程中的输出
+                                this.appendToolOutput(parsed.content || '', parsed.stream);
                             } else if (parsed.type === 'tool_result') {
                                 // 显示工具执行结果
-                                this.addToolMessage('tool_result', parsed.content || '✅ 工具执行完成');
+                                this.currentToolOutput = null;
+                                const resultStepId = this.addToolMessage('tool_result', parsed.content || '✅ 工具执行完成');
+                                if (parsed.stored_result) {
+                                    this.attachStoredResult(resultStepId, parsed.stored_result);
+                                }
                             } else if (parsed.type === 'final_answer') {
                                 // 显示最终答案并结束对话
                                 this.addMessage('assistant', parsed.content || '任务完成');
@@ -421,12 +519,36 @@ class CodeAgentApp {
             }
         } catch (error) {
             console.error('读取流式响应失败:', error);
+            if (await this.replayEvents()) {
+                return;
+            }
             if (!assistantMessageId) {
                 this.addMessage('assistant', '抱歉，接收响应时出现错误。');
             }
         }
     }
 
+    async replayEvents() {
+        // 连接中断时任务仍在服务端继续运行，从最后收到的事件之后回放
+        if (!this.sessionId || this.lastEventSeq === undefined || this.replayAttempts >= 3) {
+            return false;
+        }
+        this.replayAttempts += 1;
+        try {
+            const response = await fetch(`/api/sessions/${this.sessionId}/events?cursor=${this.lastEventSeq}`);
+            if (!response.ok) {
+                return false;
+            }
+            await this.handleStreamResponse(response);
+            return true;
+        } catch (error) {
+            console.error('回放事件失败:', error);
+            return false;
+        } finally {
+            this.replayAttempts -= 1;
+        }
+    }
+
     // 处理换行符转换为HTML
     formatContentWithLineBreaks(content) {
         // 将\n\n转换为<br><br>，\n转换为<br>
@@ -516,6 +638,8 @@ class CodeAgentApp {
         stepIcon.className = 'tool-step-icon';
         if (type === 'tool_call') {
             stepIcon.innerHTML = '<i class="fas fa-play"></i>';
+        } else if (type === 'tool_output') {
+            stepIcon.innerHTML = '<i class="fas fa-terminal"></i>';
         } else {
             stepIcon.innerHTML = '<i class="fas fa-check"></i>';
         }
@@ -537,6 +661,75 @@ class CodeAgentApp {
         return messageId;
      }
 
+    showQueueStatus(resource, position) {
+        let status = document.getElementById('queue-status');
+        if (!position) {
+            if (status) status.remove();
+            return;
+        }
+        if (!status) {
+            status = document.createElement('div');
+            status.id = 'queue-status';
+            status.className = 'queue-status';
+            this.chatMessages.appendChild(status);
+        }
+        const label = resource === 'tool' ? '工具执行' : '模型调用';
+        status.textContent = `⏳ ${label}排队中，前面还有 ${position - 1} 个请求`;
+        this.scrollToBottom();
+    }
+
+    attachStoredResult(stepId, stored) {
+        // 过长的工具结果只推送预览，完整内容点击后按URL获取
+        const stepContent = document.querySelector(`#${stepId} .tool-step-content`);
+        if (!stepContent) return;
+        const button = document.createElement('button');
+        button.className = 'stored-result-toggle';
+        button.textContent = `查看完整结果（${stored.lines}行，${stored.chars}字符）`;
+        let fullResult = null;
+        button.addEventListener('click', async () => {
+            if (fullResult) {
+                fullResult.hidden = !fullResult.hidden;
+                return;
+            }
+            button.disabled = true;
+            try {
+                const response = await fetch(stored.url);
+                if (!response.ok) throw new Error(`HTTP ${response.status}`);
+                fullResult = document.createElement('pre');
+                fullResult.className = 'stored-result';
+                fullResult.textContent = await response.text();
+                stepContent.appendChild(fullResult);
+                button.textContent = '收起/展开完整结果';
+            } catch (error) {
+                button.textContent = `完整结果获取失败: ${error.message}`;
+            } finally {
+                button.disabled = false;
+            }
+        });
+        stepContent.appendChild(button);
+    }
+
+    appendToolOutput(content, stream = 'stdout') {
+        // 同一次工具执行的输出追加到同一个步骤中
+        if (!this.currentToolOutput || !document.body.contains(this.currentToolOutput)) {
+            const stepId = this.addToolMessage('tool_output', '');
+            const stepContent = document.querySelector(`#${stepId} .tool-step-content`);
+            this.currentToolOutput = document.createElement('pre');
+            stepContent.appendChild(this.currentToolOutput);
+        }
+
+        const span = document.createElement('span');
+        span.className = `tool-output-${stream}`;
+        span.textContent = content;
+        this.currentToolOutput.appendChild(span);
+
+        const scrollContainer = this.currentToolOutput.closest('.tool-scroll-container');
+        if (scrollContainer) {
+            scrollContainer.scrollTop = scrollContainer.scrollHeight;
+        }
+        this.scrollToBottom();
+    }
+
     markToolContainerCompleted() {
         const lastToolContainer = document.querySelector('.tool-execution-container:last-child');
         if (lastToolContainer && !lastToolContainer.classList.contains('completed')) {
@@ -0,0 +1,263 @@
+import asyncio
+import random
+import threading
+import time
+import weakref
+from typing import Any, Callable, Dict, List, Optional
+
+import httpx
+import openai
+from openai import OpenAI, AsyncOpenAI
+from cancellation import CancelToken, TaskCancelled
+from config import Config
+
+# 可重试的HTTP状态码：请求超时、冲突、限流和服务端错误
+_RETRYABLE_STATUS = {408, 409, 429, 500, 502, 503, 504}
+
+
+def close_stream(stream):
+    """关闭上游HTTP流，连接归还连接池"""
+    close = getattr(stream, "close", None) or getattr(getattr(stream, "response", None), "close", None)
+    if close:
+        close()
+
+
+async def aclose_stream(stream):
+    """关闭上游异步HTTP流"""
+    close = getattr(stream, "close", None) or getattr(getattr(stream, "response", None), "aclose", None)
+    if close:
+        await close()
+
+
+class LLMClient:
+    """进程内共享的LLM客户端：复用keep-alive连接池，对可重试错误做带抖动的指数退避重试
+
+    同步客户端全进程共用一个；httpx的异步连接绑定事件循环，所以异步客户端按事件循环各建一个。
+    重试由这里统一负责，底层openai客户端的max_retries设为0。
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._client: Optional[OpenAI] = None
+        self._async_clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, AsyncOpenAI]" = weakref.WeakKeyDictionary()
+        self._stats = {
+            "requests": 0,
+            "retries": 0,
+            "failures": 0,
+            "stream_resumes": 0,
+            "cancelled": 0,
+            "in_flight": 0
+        }
+
+    @staticmethod
+    def _limits() -> httpx.Limits:
+        return httpx.Limits(
+            max_connections=Config.LLM_MAX_CONNECTIONS,
+            max_keepalive_connections=Config.LLM_MAX_KEEPALIVE_CONNECTIONS,
+            keepalive_expiry=Config.LLM_KEEPALIVE_EXPIRY
+        )
+
+    @staticmethod
+    def _timeout() -> httpx.Timeout:
+        # read是两次收到数据之间的最长等待，流式响应不受总时长限制
+        return httpx.Timeout(
+            connect=Config.LLM_CONNECT_TIMEOUT,
+            read=Config.LLM_READ_TIMEOUT,
+            write=Config.LLM_WRITE_TIMEOUT,
+            pool=Config.LLM_POOL_TIMEOUT
+        )
+
+    @property
+    def client(self) -> OpenAI:
+        with self._lock:
+            if self._client is None:
+                self._client = OpenAI(
+                    base_url=Config.API_BASE_URL,
+                    api_key=Config.API_KEY,
+                    max_retries=0,
+                    timeout=self._timeout(),
+                    http_client=httpx.Client(limits=self._limits(), timeout=self._timeout())
+                )
+            return self._client
+
+    @property
+    def async_client(self) -> AsyncOpenAI:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            client = self._async_clients.get(loop)
+            if client is None:
+                client = AsyncOpenAI(
+                    base_url=Config.API_BASE_URL,
+                    api_key=Config.API_KEY,
+                    max_retries=0,
+                    timeout=self._timeout(),
+                    http_client=httpx.AsyncClient(limits=self._limits(), timeout=self._timeout())
+                )
+                self._async_clients[loop] = client
+            return client
+
+    def stream_chat(self, messages: List[Dict[str, Any]], consume: Callable, on_retry: Callable = None,
+                    cancel_token: CancelToken = None, **kwargs):
+        """发起流式对话并交给consume(stream)处理，返回consume的结果
+
+        连接失败、可重试的状态码以及流在中途断开都会重试；consume每次重试都会拿到一个新的流，
+        on_retry(attempt, error, delay)用于通知调用方丢弃上一次已经输出的部分内容。
+        consume抛出TaskCancelled时立即关闭上游流且不再重试；cancel_token被取消时重试等待提前结束。
+        """
+        attempt = 0
+        while True:
+            if cancel_token is not None:
+                cancel_token.check()
+            self._count("requests")
+            self._count("in_flight")
+            stream = None
+            try:
+                stream = self.client.chat.completions.create(**self._request(messages, kwargs))
+                return consume(stream)
+            except Exception as e:
+                if stream is not None:
+                    self._safe_close(stream)
+                if isinstance(e, TaskCancelled):
+                    self._count("cancelled")
+                    raise
+                delay = self._retry_delay(e, attempt, stream is not None)
+                if delay is None:
+                    self._count("failures")
+                    raise
+                attempt += 1
+                if on_retry:
+                    on_retry(attempt, e, delay)
+            finally:
+                self._count("in_flight", -1)
+            if cancel_token is not None:
+                cancel_token.wait(delay)
+            else:
+                time.sleep(delay)
+
+    async def astream_chat(self, messages: List[Dict[str, Any]], consume: Callable, on_retry: Callable = None,
+                           cancel_token: CancelToken = None, **kwargs):
+        """stream_chat的异步版本，consume为协程函数"""
+        attempt = 0
+        while True:
+            if cancel_token is not None:
+                cancel_token.check()
+            self._count("requests")
+            self._count("in_flight")
+            stream = None
+            try:
+                stream = await self.async_client.chat.completions.create(**self._request(messages, kwargs))
+                return await consume(stream)
+            except Exception as e:
+                if stream is not None:
+                    try:
+                        await aclose_stream(stream)
+                    except Exception:
+                        pass
+                if isinstance(e, TaskCancelled):
+                    self._count("cancelled")
+                    raise
+                delay = self._retry_delay(e, attempt, stream is not None)
+                if delay is None:
+                    self._count("failures")
+                    raise
+                attempt += 1
+                if on_retry:
+                    on_retry(attempt, e, delay)
+            finally:
+                self._count("in_flight", -1)
+            if cancel_token is not None:
+                await cancel_token.await_cancel(delay)
+            else:
+                await asyncio.sleep(delay)
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            stats = dict(self._stats)
+            clients = ([self._client] if self._client is not None else []) + list(self._async_clients.values())
+        stats["pool"] = {
+            "max_connections": Config.LLM_MAX_CONNECTIONS,
+            "max_keepalive_connections": Config.LLM_MAX_KEEPALIVE_CONNECTIONS,
+            "keepalive_expiry": Config.LLM_KEEPALIVE_EXPIRY,
+            **self._pool_usage(clients)
+        }
+        stats["retry_policy"] = {
+            "max_retries": Config.LLM_MAX_RETRIES,
+            "base_delay": Config.LLM_RETRY_BASE_DELAY,
+            "max_delay": Config.LLM_RETRY_MAX_DELAY
+        }
+        return stats
+
+    def _request(self, messages, kwargs) -> Dict[str, Any]:
+        request = {"model": Config.MODEL_NAME, "messages": messages, "temperature": 0.1, "stream": True}
+        request.update(kwargs)
+        return request
+
+    def _retry_delay(self, error: Exception, attempt: int, stream_started: bool) -> Optional[float]:
+        """判断是否重试，返回等待秒数；不重试时返回None"""
+        if attempt >= Config.LLM_MAX_RETRIES or not self._is_retryable(error):
+            return None
+        if stream_started:
+            self._count("stream_resumes")
+        self._count("retries")
+        # full jitter：在[0, min(上限, 基数*2^n)]内随机，避免大量会话同时重试
+        delay = random.uniform(0, min(Config.LLM_RETRY_MAX_DELAY, Config.LLM_RETRY_BASE_DELAY * (2 ** attempt)))
+        retry_after = self._retry_after(error)
+        if retry_after is not None:
+            delay = max(delay, min(retry_after, Config.LLM_RETRY_MAX_DELAY))
+        return delay
+
+    @staticmethod
+    def _is_retryable(error: Exception) -> bool:
+        if isinstance(error, (openai.APIConnectionError, httpx.TransportError)):
+            return True
+        if isinstance(error, openai.APIStatusError):
+            return error.status_code in _RETRYABLE_STATUS
+        # 流中途返回的错误事件没有状态码，也按可重试处理
+        return type(error) is openai.APIError
+
+    @staticmethod
+    def _retry_after(error: Exception) -> Optional[float]:
+        response = getattr(error, "response", None)
+        value = response.headers.get("retry-after") if response is not None else None
+        try:
+            return float(value) if value is not None else None
+        except ValueError:
+            return None
+
+    @staticmethod
+    def _safe_close(stream):
+        try:
+            close_stream(stream)
+        except Exception:
+            pass
+
+    @staticmethod
+    def _pool_usage(clients) -> Dict[str, int]:
+        """从httpcore连接池读取当前连接数（内部属性，取不到时忽略）"""
+        connections = idle = 0
+        for client in clients:
+            pool = getattr(getattr(getattr(client, "_client", None), "_transport", None), "_pool", None)
+            for connection in getattr(pool, "connections", []) or []:
+                connections += 1
+                try:
+                    idle += 1 if connection.is_idle() else 0
+                except Exception:
+                    pass
+        return {"connections": connections, "idle_connections": idle}
+
+    def _count(self, name: str, value: int = 1):
+        with self._lock:
+            self._stats[name] += value
+
+
+_default_client: Optional[LLMClient] = None
+_default_client_lock = threading.Lock()
+
+
+def get_llm_client() -> LLMClient:
+    """获取进程级共享的LLM客户端"""
+    global _default_client
+    with _default_client_lock:
+        if _default_client is None:
+            _default_client = LLMClient()
+        return _default_client
@@ -0,0 +1,230 @@
+"""本地模拟LLM服务：兼容OpenAI流式chat接口，按脚本回放Thought/Action对话
+
+用于在不访问真实模型的情况下压测和调试Agent：
+
+    python mock_llm_server.py --port 8900 --tokens-per-second 50 --first-token-latency 0.5
+
+然后把 Config.API_BASE_URL 指向 http://127.0.0.1:8900/v1 。
+"""
+import argparse
+import json
+import re
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Optional
+
+# 默认脚本：查看文件、查询表格，然后给出最终答案。每一项是一轮模型输出
+DEFAULT_SCRIPT = [
+    'Thought: 用户需要分析工作区中的数据，我先用list_files查看有哪些文件，以便确定要分析的数据文件。\n'
+    'Action: {"name": "list_files", "arguments": {"directory": ""}}',
+    'Thought: 工作区中有员工信息表，我用query_table按部门统计平均工资，只取统计结果而不读取全表。\n'
+    'Action: {"name": "query_table", "arguments": {"file_path": "员工信息表.csv", "group_by": "部门", '
+    '"aggregations": {"工资": "mean"}, "sort_by": "工资_mean", "descending": true}}',
+    'Thought: 已经得到各部门的平均工资，可以给出结论了。\n'
+    'Action: {"name": "final_answer", "arguments": {"answer": "各部门平均工资已统计完成。"}}'
+]
+
+_TOKEN_PATTERN = re.compile(r'[\u4e00-\u9fff]|[A-Za-z0-9_]+|\s+|[^\sA-Za-z0-9_\u4e00-\u9fff]')
+_ACTION_PATTERN = re.compile(r'\s*Action:\s*')
+
+
+def tokenize(text: str) -> List[str]:
+    """粗略切分token：每个汉字、每个英文单词、空白和标点各算一个"""
+    return _TOKEN_PATTERN.findall(text)
+
+
+def split_action(reply: str) -> tuple:
+    """把脚本中的一轮回复拆成(Thought文本, Action字典)，没有Action时后者为None"""
+    parts = _ACTION_PATTERN.split(reply, maxsplit=1)
+    if len(parts) < 2:
+        return reply, None
+    try:
+        return parts[0], json.loads(parts[1], strict=False)
+    except ValueError:
+        return reply, None
+
+
+class MockLLMServer:
+    """模拟的OpenAI兼容服务，按请求中已有的Action轮数选择脚本中的下一轮回复"""
+
+    def __init__(self, host: str = "127.0.0.1", port: int = 0, script: Optional[List[str]] = None,
+                 tokens_per_second: float = 100.0, first_token_latency: float = 0.2, tokens_per_chunk: int = 1):
+        self.script = script or DEFAULT_SCRIPT
+        self.tokens_per_second = tokens_per_second
+        self.first_token_latency = first_token_latency
+        self.tokens_per_chunk = max(1, tokens_per_chunk)
+        self.requests = 0
+        self._lock = threading.Lock()
+        self._server = ThreadingHTTPServer((host, port), self._handler_class())
+        self._server.daemon_threads = True
+        self._thread = None
+
+    @property
+    def base_url(self) -> str:
+        host, port = self._server.server_address[:2]
+        return f"http://{host}:{port}/v1"
+
+    def start(self) -> "MockLLMServer":
+        self._thread = threading.Thread(target=self._server.serve_forever, daemon=True)
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._server.shutdown()
+        self._server.server_close()
+
+    def reply_for(self, messages: List[dict]) -> str:
+        """已经完成的轮数 = 之前assistant消息中出现Action或工具调用的次数"""
+        turn = sum(
+            1 for message in messages
+            if message.get("role") == "assistant"
+            and ("Action:" in (message.get("content") or "") or message.get("tool_calls"))
+        )
+        return self.script[min(turn, len(self.script) - 1)]
+
+    def _handler_class(self):
+        server = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = "HTTP/1.1"
+
+            def log_message(self, format, *args):
+                pass
+
+            def handle(self):
+                try:
+                    super().handle()
+                except (BrokenPipeError, ConnectionResetError):
+                    # 客户端解析到Action后会提前关闭连接
+                    pass
+
+            def do_GET(self):
+                if self.path.rstrip("/").endswith("/models"):
+                    self._send_json(200, {"object": "list", "data": [{"id": "mock", "object": "model"}]})
+                else:
+                    self._send_json(404, {"error": {"message": "not found"}})
+
+            def do_POST(self):
+                if not self.path.rstrip("/").endswith("/chat/completions"):
+                    self._send_json(404, {"error": {"message": "not found"}})
+                    return
+                body = json.loads(self.rfile.read(int(self.headers.get("Content-Length", 0))) or b"{}")
+                with server._lock:
+                    server.requests += 1
+                reply = server.reply_for(body.get("messages", []))
+                model = body.get("model", "mock")
+                if body.get("stream"):
+                    # 请求带tools时按原生函数调用格式返回tool_calls
+                    self._stream(reply, model, bool(body.get("tools")))
+                else:
+                    time.sleep(server.first_token_latency)
+                    self._send_json(200, {
+                        "id": f"chatcmpl-{uuid.uuid4().hex}",
+                        "object": "chat.completion",
+                        "created": int(time.time()),
+                        "model": model,
+                        "choices": [{"index": 0, "message": {"role": "assistant", "content": reply}, "finish_reason": "stop"}]
+                    })
+
+            def _stream(self, reply: str, model: str, native_tools: bool = False):
+                self.send_response(200)
+                self.send_header("Content-Type", "text/event-stream")
+                self.send_header("Cache-Control", "no-cache")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+                completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+                action = None
+                if native_tools:
+                    reply, action = split_action(reply)
+                tokens = tokenize(reply)
+                interval = server.tokens_per_chunk / server.tokens_per_second if server.tokens_per_second > 0 else 0
+                try:
+                    time.sleep(server.first_token_latency)
+                    for start in range(0, len(tokens), server.tokens_per_chunk):
+                        content = "".join(tokens[start:start + server.tokens_per_chunk])
+                        self._write_event(self._chunk(completion_id, model, {"content": content}, None))
+                        if interval:
+                            time.sleep(interval)
+                    if action is not None:
+                        self._stream_tool_call(completion_id, model, action, interval)
+                    self._write_event(self._chunk(completion_id, model, {}, "tool_calls" if action else "stop"))
+                    self._write_chunk(b"data: [DONE]\n\n")
+                    self._write_chunk(b"")
+                except (BrokenPipeError, ConnectionResetError):
+                    self.close_connection = True
+
+            def _stream_tool_call(self, completion_id, model, action: dict, interval: float):
+                """先发送工具名和调用ID，参数JSON按token分段发送"""
+                call = {"index": 0, "id": f"call_{uuid.uuid4().hex[:12]}", "type": "function",
+                        "function": {"name": action.get("name", ""), "arguments": ""}}
+                self._write_event(self._chunk(completion_id, model, {"tool_calls": [call]}, None))
+                tokens = tokenize(json.dumps(action.get("arguments", {}), ensure_ascii=False))
+                for start in range(0, len(tokens), server.tokens_per_chunk):
+                    fragment = "".join(tokens[start:start + server.tokens_per_chunk])
+                    delta = {"tool_calls": [{"index": 0, "function": {"arguments": fragment}}]}
+                    self._write_event(self._chunk(completion_id, model, delta, None))
+                    if interval:
+                        time.sleep(interval)
+
+            @staticmethod
+            def _chunk(completion_id, model, delta, finish_reason):
+                return {
+                    "id": completion_id,
+                    "object": "chat.completion.chunk",
+                    "created": int(time.time()),
+                    "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]
+                }
+
+            def _write_event(self, payload: dict):
+                self._write_chunk(f"data: {json.dumps(payload, ensure_ascii=False)}\n\n".encode("utf-8"))
+
+            def _write_chunk(self, data: bytes):
+                self.wfile.write(b"%x\r\n%s\r\n" % (len(data), data))
+                self.wfile.flush()
+
+            def _send_json(self, status: int, payload: dict):
+                data = json.dumps(payload, ensure_ascii=False).encode("utf-8")
+                self.send_response(status)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        return Handler
+
+
+def load_script(path: str) -> List[str]:
+    """脚本文件为JSON字符串数组，每一项是一轮完整的模型输出"""
+    with open(path, 'r', encoding='utf-8') as f:
+        script = json.load(f)
+    if not isinstance(script, list) or not all(isinstance(turn, str) for turn in script):
+        raise ValueError("脚本文件应为字符串数组")
+    return script
+
+
+def main():
+    parser = argparse.ArgumentParser(description="OpenAI兼容的模拟流式LLM服务")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--script", help="JSON脚本文件，字符串数组，每项为一轮回复")
+    parser.add_argument("--tokens-per-second", type=float, default=100.0)
+    parser.add_argument("--first-token-latency", type=float, default=0.2, help="首个token前的延迟（秒）")
+    parser.add_argument("--tokens-per-chunk", type=int, default=1)
+    args = parser.parse_args()
+
+    server = MockLLMServer(
+        args.host, args.port, load_script(args.script) if args.script else None,
+        args.tokens_per_second, args.first_token_latency, args.tokens_per_chunk
+    )
+    print(f"模拟LLM服务已启动: {server.base_url}")
+    try:
+        server._server.serve_forever()
+    except KeyboardInterrupt:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
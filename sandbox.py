@@ -0,0 +1,472 @@
+import importlib
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from typing import Dict
+from config import Config
+
+try:
+    import resource
+    import signal
+except ImportError:  # Windows下没有resource模块，跳过资源限制
+    resource = None
+
+
+class CpuLimitExceeded(BaseException):
+    """代码执行超出CPU时间限制
+
+    继承BaseException，用户代码里的except Exception和_run_code都不会拦截，由工作进程循环统一报告。
+    """
+
+
+def _prewarm(modules):
+    """预先导入常用模块，执行代码时无需再付出导入开销"""
+    for module_name in modules:
+        try:
+            importlib.import_module(module_name)
+        except Exception:
+            pass
+
+
+def _set_memory_limit(memory_limit_mb):
+    if resource is None or not memory_limit_mb:
+        return
+    limit = memory_limit_mb * 1024 * 1024
+    resource.setrlimit(resource.RLIMIT_AS, (limit, limit))
+
+
+def _set_cpu_limit(cpu_limit):
+    """RLIMIT_CPU按进程累计计算，每次执行前在已用时间基础上设置软限制"""
+    if resource is None or not cpu_limit:
+        return
+    usage = resource.getrusage(resource.RUSAGE_SELF)
+    used = int(usage.ru_utime + usage.ru_stime)
+    resource.setrlimit(resource.RLIMIT_CPU, (used + cpu_limit, resource.RLIM_INFINITY))
+
+
+def _clear_cpu_limit():
+    if resource is None:
+        return
+    resource.setrlimit(resource.RLIMIT_CPU, (resource.RLIM_INFINITY, resource.RLIM_INFINITY))
+
+
+def _raise_cpu_limit(signum, frame):
+    raise CpuLimitExceeded("超出CPU时间限制")
+
+
+def _new_namespace(workspace_path: str) -> dict:
+    """创建执行环境，包含工作区相关的辅助函数"""
+    import json
+    return {
+        '__builtins__': __builtins__,
+        'WORKSPACE_PATH': workspace_path,
+        'get_workspace_file_path': lambda filename: os.path.join(workspace_path, filename),
+        'os': os,
+        'json': json
+    }
+
+
+class _OutputStream:
+    """执行期间替代stdout/stderr：完整记录输出，同时按行批量发送给父进程
+
+    最早一段未发送的输出超过flush_interval后，遇到换行立即发送；执行期间另有后台线程按同样的间隔
+    发送已完整的行，打印后进入长时间计算或sleep时输出也不会滞留。stdout和stderr共用send_lock，
+    避免两个线程同时写管道。
+    """
+
+    def __init__(self, conn, name: str, flush_interval: float, send_lock=None):
+        self.conn = conn
+        self.name = name
+        self.flush_interval = flush_interval
+        self.parts = []
+        self._pending = []
+        self._oldest = None  # 最早一段未发送输出的写入时间
+        self._lock = send_lock or threading.RLock()
+
+    def write(self, text: str) -> int:
+        if not text:
+            return 0
+        with self._lock:
+            self.parts.append(text)
+            self._pending.append(text)
+            now = time.monotonic()
+            if self._oldest is None:
+                self._oldest = now
+            if "\n" in text and now - self._oldest >= self.flush_interval:
+                self.flush_lines()
+        return len(text)
+
+    def flush_lines(self):
+        """发送已完整的行，最后一个换行之后的部分留到之后"""
+        with self._lock:
+            if not self._pending:
+                return
+            text = "".join(self._pending)
+            cut = text.rfind("\n") + 1
+            if cut == 0:
+                self._pending = [text]
+                return
+            self.conn.send(("output", self.name, text[:cut]))
+            self._pending = [text[cut:]] if cut < len(text) else []
+            self._oldest = time.monotonic() if self._pending else None
+
+    def flush(self):
+        with self._lock:
+            if self._pending:
+                self.conn.send(("output", self.name, "".join(self._pending)))
+                self._pending = []
+            self._oldest = None
+
+    def getvalue(self) -> str:
+        return "".join(self.parts)
+
+
+def _flush_periodically(streams, interval: float, stop: threading.Event):
+    """执行期间定时发送各输出流中已完整的行"""
+    while not stop.wait(interval):
+        for stream in streams:
+            try:
+                stream.flush_lines()
+            except (OSError, ValueError):
+                return
+
+
+def _run_code(code: str, exec_globals: dict, conn, flush_interval: float) -> str:
+    """在当前进程中执行代码，返回与原execute_code一致的结果文本（仅包含stdout）"""
+    from contextlib import redirect_stderr, redirect_stdout
+
+    send_lock = threading.RLock()
+    stdout = _OutputStream(conn, "stdout", flush_interval, send_lock)
+    stderr = _OutputStream(conn, "stderr", flush_interval, send_lock)
+    stop = threading.Event()
+    flusher = threading.Thread(target=_flush_periodically, args=((stdout, stderr), max(flush_interval, 0.05), stop),
+                               daemon=True)
+    flusher.start()
+    try:
+        with redirect_stdout(stdout), redirect_stderr(stderr):
+            exec(code, exec_globals)
+
+        output = stdout.getvalue()
+        return output if output else "代码执行成功，无输出"
+    except MemoryError:
+        return f"代码执行错误: 超出内存限制({Config.SANDBOX_MEMORY_LIMIT_MB}MB)"
+    except Exception as e:
+        return f"代码执行错误: {str(e)}"
+    finally:
+        stop.set()
+        flusher.join()
+        stdout.flush()
+        stderr.flush()
+
+
+def _worker_main(conn, workspace_path, memory_limit_mb, cpu_limit, prewarm_modules, stateful=False,
+                 flush_interval=0.2):
+    """沙箱工作进程：循环接收命令并执行
+
+    stateful为True时作为会话内核运行，变量在多次执行之间保留。
+    执行期间的输出以("output", stream, text)消息发送，最后发送("result", text)。
+    """
+    _prewarm(prewarm_modules)
+    os.makedirs(workspace_path, exist_ok=True)
+    os.chdir(workspace_path)
+    _set_memory_limit(memory_limit_mb)
+    if resource is not None:
+        signal.signal(signal.SIGXCPU, _raise_cpu_limit)
+
+    namespace = _new_namespace(workspace_path)
+    while True:
+        try:
+            message = conn.recv()
+        except EOFError:
+            break
+        if message is None:
+            break
+
+        command, code = message
+        if command == "reset":
+            namespace = _new_namespace(workspace_path)
+            conn.send(("result", "内核已重置，之前定义的变量已清空"))
+            continue
+
+        exec_globals = namespace if stateful else _new_namespace(workspace_path)
+        _set_cpu_limit(cpu_limit)
+        try:
+            result = _run_code(code, exec_globals, conn, flush_interval)
+        except CpuLimitExceeded:
+            result = f"代码执行错误: 超出CPU时间限制({cpu_limit}秒)"
+        finally:
+            _clear_cpu_limit()
+        # 代码可能修改了工作目录，下次执行前恢复
+        os.chdir(workspace_path)
+        conn.send(("result", result))
+
+
+def _create_context():
+    methods = multiprocessing.get_all_start_methods()
+    method = Config.SANDBOX_START_METHOD if Config.SANDBOX_START_METHOD in methods else "spawn"
+    context = multiprocessing.get_context(method)
+    if method == "forkserver":
+        # forkserver预先导入常用模块，之后fork出的工作进程直接继承
+        context.set_forkserver_preload(["sandbox"] + list(Config.SANDBOX_PREWARM_MODULES))
+    return context
+
+
+class _SandboxWorker:
+    """父进程中对单个工作进程的引用"""
+
+    def __init__(self, context, stateful: bool = False):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(
+                child_conn,
+                Config.WORKSPACE_PATH,
+                Config.SANDBOX_MEMORY_LIMIT_MB,
+                Config.SANDBOX_CPU_LIMIT,
+                Config.SANDBOX_PREWARM_MODULES,
+                stateful,
+                Config.TOOL_OUTPUT_FLUSH_INTERVAL
+            ),
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.tasks = 0
+        self.lock = threading.Lock()
+        self.last_used = time.time()
+
+    def request(self, message, timeout: float, on_output=None, cancelled=None):
+        """发送命令并等待结果，期间把输出转交给on_output(stream, text)
+
+        超时或cancelled()返回True时返回None，进程异常退出时抛出EOFError或OSError。
+        """
+        self.conn.send(message)
+        deadline = time.monotonic() + timeout
+        while True:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0 or (cancelled is not None and cancelled()):
+                return None
+            # 需要响应取消时分段等待
+            wait = min(remaining, Config.CANCEL_POLL_INTERVAL) if cancelled is not None else remaining
+            if not self.conn.poll(wait):
+                continue
+            kind, *payload = self.conn.recv()
+            if kind == "result":
+                return payload[0]
+            if on_output is not None:
+                on_output(*payload)
+
+    def kill(self):
+        try:
+            self.process.kill()
+            self.process.join(timeout=5)
+        finally:
+            self.conn.close()
+
+    def stop(self):
+        try:
+            self.conn.send(None)
+            self.process.join(timeout=1)
+        except (OSError, ValueError):
+            pass
+        if self.process.is_alive():
+            self.kill()
+        else:
+            self.conn.close()
+
+
+class SandboxPool:
+    """预先启动的代码执行进程池，每次执行带超时、内存和CPU限制"""
+
+    def __init__(self, size: int = None, timeout: float = None):
+        self.size = size or Config.SANDBOX_WORKERS
+        self.timeout = timeout or Config.SANDBOX_TIMEOUT
+        self._context = _create_context()
+        self._idle = queue.Queue()
+        self._started = False
+        self._lock = threading.Lock()
+
+    def start(self):
+        """启动并预热全部工作进程"""
+        with self._lock:
+            if self._started:
+                return
+            for _ in range(self.size):
+                self._idle.put(_SandboxWorker(self._context))
+            self._started = True
+
+    def shutdown(self):
+        with self._lock:
+            while True:
+                try:
+                    self._idle.get_nowait().stop()
+                except queue.Empty:
+                    break
+            self._started = False
+
+    def execute(self, code: str, on_output=None, cancelled=None) -> str:
+        """在空闲工作进程中执行代码，返回结果文本；cancelled()返回True时终止执行"""
+        self.start()
+        worker = self._acquire(cancelled)
+        if worker is None:
+            return "代码执行已取消"
+        try:
+            result = worker.request(("exec", code), self.timeout, on_output, cancelled)
+            if result is None:
+                worker.kill()
+                worker = _SandboxWorker(self._context)
+                if cancelled is not None and cancelled():
+                    return "代码执行已取消"
+                return f"代码执行错误: 执行超时(超过{self.timeout}秒)"
+            worker.tasks += 1
+            if worker.tasks >= Config.SANDBOX_MAX_TASKS_PER_WORKER:
+                worker.stop()
+                worker = _SandboxWorker(self._context)
+            return result
+        except (EOFError, OSError):
+            # 工作进程异常退出（如超出内存被系统杀死），替换为新进程
+            worker.kill()
+            worker = _SandboxWorker(self._context)
+            return "代码执行错误: 执行进程异常退出，可能超出了内存或CPU限制"
+        finally:
+            self._idle.put(worker)
+
+    def _acquire(self, cancelled=None):
+        """等待空闲工作进程；等待期间cancelled()返回True时放弃并返回None"""
+        if cancelled is None:
+            return self._idle.get()
+        while True:
+            try:
+                return self._idle.get(timeout=Config.CANCEL_POLL_INTERVAL)
+            except queue.Empty:
+                if cancelled():
+                    return None
+
+
+class KernelManager:
+    """每个会话独占一个常驻执行进程，变量和已加载的数据在多次执行之间保留"""
+
+    def __init__(self, idle_timeout: float = None, max_kernels: int = None, timeout: float = None):
+        self.idle_timeout = idle_timeout or Config.KERNEL_IDLE_TIMEOUT
+        self.max_kernels = max_kernels or Config.MAX_KERNELS
+        self.timeout = timeout or Config.SANDBOX_TIMEOUT
+        self._context = _create_context()
+        self._kernels: Dict[str, _SandboxWorker] = {}
+        self._lock = threading.Lock()
+        self._reaper = None
+
+    def execute(self, session_id: str, code: str, reset: bool = False, on_output=None, cancelled=None) -> str:
+        """在会话内核中执行代码，reset为True时先清空内核状态；cancelled()返回True时终止执行"""
+        kernel = self._get_or_create(session_id)
+        with kernel.lock:
+            try:
+                results = []
+                if reset:
+                    results.append(self._request(kernel, ("reset", None), session_id))
+                if code.strip():
+                    results.append(self._request(kernel, ("exec", code), session_id, on_output, cancelled))
+                return "\n".join(results) if results else "代码执行成功，无输出"
+            finally:
+                kernel.last_used = time.time()
+
+    def reset(self, session_id: str) -> bool:
+        """重置会话内核，内核不存在时返回False"""
+        with self._lock:
+            kernel = self._kernels.get(session_id)
+        if kernel is None:
+            return False
+        with kernel.lock:
+            self._request(kernel, ("reset", None), session_id)
+        return True
+
+    def shutdown_kernel(self, session_id: str):
+        """关闭会话内核"""
+        with self._lock:
+            kernel = self._kernels.pop(session_id, None)
+        if kernel is not None:
+            kernel.stop()
+
+    def reap_idle(self) -> int:
+        """关闭超过空闲时间的内核，返回关闭数量"""
+        deadline = time.time() - self.idle_timeout
+        with self._lock:
+            expired = [
+                session_id for session_id, kernel in self._kernels.items()
+                if not kernel.lock.locked() and kernel.last_used < deadline
+            ]
+            kernels = [self._kernels.pop(session_id) for session_id in expired]
+        for kernel in kernels:
+            kernel.stop()
+        return len(kernels)
+
+    def _request(self, kernel: _SandboxWorker, message, session_id: str, on_output=None, cancelled=None) -> str:
+        try:
+            result = kernel.request(message, self.timeout, on_output, cancelled)
+            if result is not None:
+                return result
+            if cancelled is not None and cancelled():
+                error = "代码执行已取消，会话内核已重启，之前的变量已丢失"
+            else:
+                error = f"代码执行错误: 执行超时(超过{self.timeout}秒)，会话内核已重启，之前的变量已丢失"
+        except (EOFError, OSError):
+            error = "代码执行错误: 会话内核异常退出，可能超出了内存或CPU限制，之前的变量已丢失"
+        with self._lock:
+            if self._kernels.get(session_id) is kernel:
+                del self._kernels[session_id]
+        kernel.kill()
+        return error
+
+    def _get_or_create(self, session_id: str) -> _SandboxWorker:
+        self.reap_idle()
+        with self._lock:
+            kernel = self._kernels.get(session_id)
+            if kernel is not None:
+                return kernel
+            if len(self._kernels) >= self.max_kernels:
+                idle = [(sid, k) for sid, k in self._kernels.items() if not k.lock.locked()]
+                if not idle:
+                    raise RuntimeError(f"会话内核数量已达上限({self.max_kernels})")
+                oldest_id, oldest = min(idle, key=lambda item: item[1].last_used)
+                del self._kernels[oldest_id]
+                oldest.stop()
+            kernel = _SandboxWorker(self._context, stateful=True)
+            self._kernels[session_id] = kernel
+            self._start_reaper()
+            return kernel
+
+    def _start_reaper(self):
+        if self._reaper is not None:
+            return
+
+        def reap_forever():
+            while True:
+                time.sleep(min(60, self.idle_timeout))
+                self.reap_idle()
+
+        self._reaper = threading.Thread(target=reap_forever, daemon=True)
+        self._reaper.start()
+
+
+_default_pool = None
+_default_kernels = None
+_default_pool_lock = threading.Lock()
+
+
+def get_sandbox() -> SandboxPool:
+    """获取进程级共享的沙箱进程池"""
+    global _default_pool
+    with _default_pool_lock:
+        if _default_pool is None:
+            _default_pool = SandboxPool()
+        return _default_pool
+
+
+def get_kernel_manager() -> KernelManager:
+    """获取进程级共享的会话内核管理器"""
+    global _default_kernels
+    with _default_pool_lock:
+        if _default_kernels is None:
+            _default_kernels = KernelManager()
+        return _default_kernels
@@ -0,0 +1,250 @@
+import asyncio
+import itertools
+import threading
+from collections import Counter
+from contextlib import asynccontextmanager, contextmanager
+from typing import Callable, Dict, List, Optional
+from cancellation import CancelToken
+from config import Config
+
+# 等待队列的优先级：已经开始的任务先于新任务获得资源，尽快完成并释放会话
+PRIORITY_CONTINUING = 0
+PRIORITY_NEW = 1
+
+
+class SchedulerFullError(Exception):
+    """等待队列已满或客户端的任务数已达上限"""
+
+    def __init__(self, message: str, retry_after: int = 1):
+        super().__init__(message)
+        self.retry_after = retry_after
+
+
+class _Waiter:
+    __slots__ = ("client_id", "key", "wake", "on_position", "position", "granted")
+
+    def __init__(self, client_id: str, key: tuple, wake: Callable[[], None], on_position: Optional[Callable[[int], None]]):
+        self.client_id = client_id
+        self.key = key
+        self.wake = wake
+        self.on_position = on_position
+        self.position = 0
+        self.granted = False
+
+
+class ResourceLimiter:
+    """限制某类资源（模型调用、工具执行）的全局和单客户端并发
+
+    获取不到时按(优先级, 到达顺序)排队；某个客户端达到自身上限时，后面其他客户端的请求可以越过它。
+    排队位置变化时通过on_position(position)通知，获得资源时position为0。
+    传入cancel_token时，任务被取消会立即结束等待并抛出TaskCancelled。
+    """
+
+    def __init__(self, name: str, limit: int, per_client_limit: int):
+        self.name = name
+        self.limit = max(1, limit)
+        self.per_client_limit = max(1, per_client_limit)
+        self._lock = threading.Lock()
+        self._active = 0
+        self._active_by_client: Counter = Counter()
+        self._waiting: List[_Waiter] = []
+        self._arrivals = itertools.count()
+
+    @contextmanager
+    def slot(self, client_id: str = None, priority: int = PRIORITY_NEW, on_position: Callable[[int], None] = None,
+             cancel_token: CancelToken = None):
+        """阻塞直到获得资源"""
+        event = threading.Event()
+        waiter = self._enqueue(client_id, priority, event.set, on_position)
+        remove = cancel_token.on_cancel(event.set) if cancel_token else None
+        try:
+            event.wait()
+            if cancel_token is not None:
+                cancel_token.check()
+        except BaseException:
+            self._abandon(waiter)
+            raise
+        finally:
+            if remove:
+                remove()
+        try:
+            yield
+        finally:
+            self._release(client_id)
+
+    @asynccontextmanager
+    async def aslot(self, client_id: str = None, priority: int = PRIORITY_NEW, on_position: Callable[[int], None] = None,
+                    cancel_token: CancelToken = None):
+        """slot的异步版本，等待期间不阻塞事件循环"""
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+
+        def wake():
+            loop.call_soon_threadsafe(lambda: future.done() or future.set_result(None))
+
+        waiter = self._enqueue(client_id, priority, wake, on_position)
+        remove = cancel_token.on_cancel(wake) if cancel_token else None
+        try:
+            await future
+            if cancel_token is not None:
+                cancel_token.check()
+        except BaseException:
+            self._abandon(waiter)
+            raise
+        finally:
+            if remove:
+                remove()
+        try:
+            yield
+        finally:
+            self._release(client_id)
+
+    def waiting(self) -> int:
+        with self._lock:
+            return len(self._waiting)
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            return {
+                "limit": self.limit,
+                "per_client_limit": self.per_client_limit,
+                "active": self._active,
+                "waiting": len(self._waiting),
+                "active_clients": len(self._active_by_client)
+            }
+
+    def _enqueue(self, client_id, priority, wake, on_position) -> _Waiter:
+        waiter = _Waiter(client_id, (priority, next(self._arrivals)), wake, on_position)
+        with self._lock:
+            self._waiting.append(waiter)
+            self._waiting.sort(key=lambda item: item.key)
+            granted = self._grant_locked()
+            moved = self._positions_locked()
+        self._notify(granted, moved)
+        return waiter
+
+    def _release(self, client_id):
+        with self._lock:
+            self._active -= 1
+            self._active_by_client[client_id] -= 1
+            if self._active_by_client[client_id] <= 0:
+                del self._active_by_client[client_id]
+            granted = self._grant_locked()
+            moved = self._positions_locked()
+        self._notify(granted, moved)
+
+    def _abandon(self, waiter: _Waiter):
+        """等待被取消：仍在队列中则移除，已经获得资源则归还"""
+        with self._lock:
+            granted = waiter.granted
+            if not granted:
+                self._waiting.remove(waiter)
+                moved = self._positions_locked()
+        if granted:
+            self._release(waiter.client_id)
+        else:
+            self._notify([], moved)
+
+    def _grant_locked(self) -> List[_Waiter]:
+        granted = []
+        for waiter in list(self._waiting):
+            if self._active >= self.limit:
+                break
+            if self._active_by_client[waiter.client_id] >= self.per_client_limit:
+                continue
+            self._waiting.remove(waiter)
+            self._active += 1
+            self._active_by_client[waiter.client_id] += 1
+            waiter.granted = True
+            granted.append(waiter)
+        return granted
+
+    def _positions_locked(self) -> List[_Waiter]:
+        """更新排队位置（从1开始），返回位置发生变化的等待者"""
+        moved = []
+        for position, waiter in enumerate(self._waiting, 1):
+            if waiter.position != position:
+                waiter.position = position
+                moved.append(waiter)
+        return moved
+
+    @staticmethod
+    def _notify(granted: List[_Waiter], moved: List[_Waiter]):
+        for waiter in moved:
+            if waiter.on_position:
+                waiter.on_position(waiter.position)
+        for waiter in granted:
+            # 只通知排过队的等待者
+            if waiter.position and waiter.on_position:
+                waiter.on_position(0)
+            waiter.wake()
+
+
+class TaskScheduler:
+    """聊天任务的准入控制和资源调度
+
+    admit在任务开始前快速判断是否接收：已接收的任务数达到模型并发加等待队列的容量，
+    或该客户端进行中的任务已达上限时拒绝。已接收但尚未排到模型调用的任务同样计入容量。
+    接收后任务的每次模型调用和工具执行分别通过llm和tool限流器排队。
+    """
+
+    def __init__(self):
+        self.llm = ResourceLimiter("llm", Config.SCHEDULER_LLM_CONCURRENCY, Config.SCHEDULER_LLM_PER_CLIENT)
+        self.tool = ResourceLimiter("tool", Config.SCHEDULER_TOOL_CONCURRENCY, Config.SCHEDULER_TOOL_PER_CLIENT)
+        self.max_queue = Config.SCHEDULER_MAX_QUEUE
+        self.max_tasks_per_client = Config.SCHEDULER_MAX_TASKS_PER_CLIENT
+        self._lock = threading.Lock()
+        self._tasks: Counter = Counter()
+        self._admitted = 0
+        self._rejected = 0
+
+    def admit(self, client_id: str = None):
+        """接收一个任务，返回释放函数；无法接收时抛出SchedulerFullError"""
+        with self._lock:
+            if self._admitted >= self.llm.limit + self.max_queue or self.llm.waiting() >= self.max_queue:
+                self._rejected += 1
+                raise SchedulerFullError(f"服务繁忙，等待队列已满({self.max_queue})", retry_after=5)
+            if self._tasks[client_id] >= self.max_tasks_per_client:
+                self._rejected += 1
+                raise SchedulerFullError(f"进行中的任务数已达上限({self.max_tasks_per_client})", retry_after=2)
+            self._tasks[client_id] += 1
+            self._admitted += 1
+
+        released = threading.Event()
+
+        def release():
+            if released.is_set():
+                return
+            released.set()
+            with self._lock:
+                self._admitted -= 1
+                self._tasks[client_id] -= 1
+                if self._tasks[client_id] <= 0:
+                    del self._tasks[client_id]
+        return release
+
+    def stats(self) -> Dict[str, object]:
+        with self._lock:
+            tasks = self._admitted
+            rejected = self._rejected
+        return {
+            "tasks": tasks,
+            "rejected": rejected,
+            "max_queue": self.max_queue,
+            "max_tasks_per_client": self.max_tasks_per_client,
+            "llm": self.llm.stats(),
+            "tool": self.tool.stats()
+        }
+
+
+_default_scheduler: Optional[TaskScheduler] = None
+_default_scheduler_lock = threading.Lock()
+
+
+def get_scheduler() -> TaskScheduler:
+    """获取进程级共享的任务调度器"""
+    global _default_scheduler
+    with _default_scheduler_lock:
+        if _default_scheduler is None:
+            _default_scheduler = TaskScheduler()
+        return _default_scheduler
@@ -0,0 +1,115 @@
+import threading
+import time
+import uuid
+from typing import Dict, Optional
+from agent import CodeAgent
+from config import Config
+
+
+class SessionBusyError(Exception):
+    """会话中已有任务在运行"""
+
+
+class SessionLimitError(Exception):
+    """活跃会话数已达上限且没有可回收的会话"""
+
+
+class AgentSession:
+    """单个会话：独立的CodeAgent实例及其使用状态"""
+
+    def __init__(self, session_id: str):
+        self.session_id = session_id
+        self.agent = CodeAgent(session_id=session_id)
+        self.created_at = time.time()
+        self.last_used = self.created_at
+        # 同一会话同一时刻只允许运行一个任务，避免memory被并发改写
+        self.run_lock = threading.Lock()
+
+    @property
+    def busy(self) -> bool:
+        return self.run_lock.locked()
+
+    def to_dict(self):
+        return {
+            "session_id": self.session_id,
+            "busy": self.busy,
+            "created_at": self.created_at,
+            "last_used": self.last_used
+        }
+
+
+class AgentSessionPool:
+    """按会话ID管理CodeAgent实例，支持空闲回收和会话数上限"""
+
+    def __init__(self, max_sessions: int = None, idle_timeout: float = None):
+        self.max_sessions = max_sessions or Config.MAX_SESSIONS
+        self.idle_timeout = idle_timeout or Config.SESSION_IDLE_TIMEOUT
+        self._sessions: Dict[str, AgentSession] = {}
+        self._lock = threading.Lock()
+
+    def acquire(self, session_id: Optional[str] = None) -> AgentSession:
+        """获取（必要时创建）会话并占用它，调用方结束后必须release"""
+        session_id = session_id or uuid.uuid4().hex
+        with self._lock:
+            self._evict_idle_locked()
+            session = self._sessions.get(session_id)
+            if session is None:
+                if len(self._sessions) >= self.max_sessions:
+                    self._evict_lru_locked()
+                session = AgentSession(session_id)
+                self._sessions[session_id] = session
+            if not session.run_lock.acquire(blocking=False):
+                raise SessionBusyError(f"会话 {session_id} 正在执行任务")
+            session.last_used = time.time()
+            return session
+
+    def release(self, session: AgentSession):
+        """释放会话占用"""
+        session.last_used = time.time()
+        if session.run_lock.locked():
+            session.run_lock.release()
+
+    def remove(self, session_id: str) -> bool:
+        """删除空闲会话，会话正在运行时返回False"""
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None or session.busy:
+                return False
+            del self._sessions[session_id]
+        session.agent.close()
+        return True
+
+    def evict_idle(self) -> int:
+        """回收超过空闲时间的会话，返回回收数量"""
+        with self._lock:
+            return self._evict_idle_locked()
+
+    def stats(self):
+        with self._lock:
+            self._evict_idle_locked()
+            sessions = [session.to_dict() for session in self._sessions.values()]
+        return {
+            "max_sessions": self.max_sessions,
+            "idle_timeout": self.idle_timeout,
+            "active": len(sessions),
+            "busy": sum(1 for session in sessions if session["busy"]),
+            "sessions": sessions
+        }
+
+    def _evict_idle_locked(self) -> int:
+        deadline = time.time() - self.idle_timeout
+        expired = [
+            session_id for session_id, session in self._sessions.items()
+            if not session.busy and session.last_used < deadline
+        ]
+        for session_id in expired:
+            self._sessions.pop(session_id).agent.close()
+        return len(expired)
+
+    def _evict_lru_locked(self):
+        idle_sessions = [session for session in self._sessions.values() if not session.busy]
+        if not idle_sessions:
+            raise SessionLimitError(f"活跃会话数已达上限({self.max_sessions})")
+        oldest = min(idle_sessions, key=lambda session: session.last_used)
+        del self._sessions[oldest.session_id]
+        oldest.agent.close()
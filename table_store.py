@@ -0,0 +1,425 @@
+import csv
+import heapq
+import json
+import math
+import os
+import statistics
+import sys
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional
+from config import Config
+
+_NUMERIC_TYPECODE = 'd'
+_MISSING = float('nan')
+
+_FILTER_OPS = {
+    "==": lambda value, target: value == target,
+    "!=": lambda value, target: value != target,
+    ">": lambda value, target: value is not None and value > target,
+    ">=": lambda value, target: value is not None and value >= target,
+    "<": lambda value, target: value is not None and value < target,
+    "<=": lambda value, target: value is not None and value <= target,
+    "in": lambda value, target: value in target,
+    "not_in": lambda value, target: value not in target,
+    "contains": lambda value, target: value is not None and str(target) in str(value),
+}
+
+
+def _median(values):
+    return statistics.median(values) if values else None
+
+
+_AGGREGATIONS = {
+    "count": len,
+    "sum": lambda values: sum(values) if values else 0,
+    "mean": lambda values: sum(values) / len(values) if values else None,
+    "avg": lambda values: sum(values) / len(values) if values else None,
+    "min": lambda values: min(values) if values else None,
+    "max": lambda values: max(values) if values else None,
+    "median": _median,
+    "nunique": lambda values: len(set(values)),
+}
+
+
+class ColumnarTable:
+    """CSV/JSON解析后的列式表：数值列存为array('d')（缺失为NaN），文本列存为驻留字符串列表"""
+
+    def __init__(self, columns: Dict[str, object], row_count: int):
+        self.columns = columns
+        self.row_count = row_count
+
+    @property
+    def column_names(self) -> List[str]:
+        return list(self.columns)
+
+    def is_numeric(self, column: str) -> bool:
+        return isinstance(self.columns[column], array)
+
+    def value(self, column: str, row: int):
+        value = self.columns[column][row]
+        if isinstance(value, float) and math.isnan(value):
+            return None
+        return value
+
+    def schema(self) -> list:
+        return [
+            {"name": name, "type": "number" if self.is_numeric(name) else "string"}
+            for name in self.columns
+        ]
+
+    @classmethod
+    def from_csv(cls, abs_path: str, delimiter: str = None) -> "ColumnarTable":
+        with open(abs_path, 'rb') as f:
+            head = f.read(4096)
+        encoding = _detect_encoding(head)
+        if delimiter is None:
+            delimiter = '\t' if abs_path.lower().endswith(('.tsv', '.tab')) else ','
+
+        with open(abs_path, 'r', encoding=encoding, newline='') as f:
+            reader = csv.reader(f, delimiter=delimiter)
+            header = next(reader, None)
+            if not header:
+                return cls({}, 0)
+            header = _unique_header(header)
+            raw = [[] for _ in header]
+            width = len(header)
+            for record in reader:
+                if not record:
+                    continue
+                if len(record) < width:
+                    record = record + [""] * (width - len(record))
+                for index in range(width):
+                    raw[index].append(record[index])
+
+        columns = {}
+        for name, values in zip(header, raw):
+            columns[name] = _to_column(values)
+        return cls(columns, len(raw[0]) if raw else 0)
+
+
+    @classmethod
+    def from_json(cls, abs_path: str) -> "ColumnarTable":
+        """读取JSON记录数组（或{"键": [记录...]}）以及逐行一条记录的JSONL"""
+        with open(abs_path, 'rb') as f:
+            encoding = _detect_encoding(f.read(4096))
+        with open(abs_path, 'r', encoding=encoding) as f:
+            if abs_path.lower().endswith(('.jsonl', '.ndjson')):
+                records = (json.loads(line) for line in f if line.strip())
+            else:
+                records = _json_records(json.load(f))
+            raw: Dict[str, list] = {}
+            row_count = 0
+            for record in records:
+                if not isinstance(record, dict):
+                    record = {"value": record}
+                for name, value in record.items():
+                    column = raw.get(name)
+                    if column is None:
+                        column = raw[name] = [None] * row_count
+                    column.append(value)
+                row_count += 1
+                for column in raw.values():
+                    if len(column) < row_count:
+                        column.append(None)
+
+        columns = {str(name): _values_to_column(values) for name, values in raw.items()}
+        return cls(columns, row_count)
+
+
+def _json_records(data) -> list:
+    if isinstance(data, list):
+        return data
+    if isinstance(data, dict):
+        # 取第一个记录列表，例如{"data": [...]}；否则把{键: 值}当作name/value两列
+        for value in data.values():
+            if isinstance(value, list) and value and isinstance(value[0], dict):
+                return value
+        return [{"name": key, "value": value} for key, value in data.items()]
+    raise ValueError("JSON文件应为记录数组")
+
+
+def _values_to_column(values: list):
+    """JSON值列：全部为数字（允许null）时转成数值数组，否则转成字符串"""
+    if all(value is None or (isinstance(value, (int, float)) and not isinstance(value, bool)) for value in values):
+        if any(value is not None for value in values):
+            return array(_NUMERIC_TYPECODE, (_MISSING if value is None else float(value) for value in values))
+    return [
+        "" if value is None else sys.intern(value) if isinstance(value, str) and len(value) <= 32
+        else value if isinstance(value, str) else json.dumps(value, ensure_ascii=False)
+        for value in values
+    ]
+
+
+def _detect_encoding(head: bytes) -> str:
+    for encoding in ("utf-8-sig", "gb18030"):
+        try:
+            head.decode(encoding)
+            return encoding
+        except UnicodeDecodeError as e:
+            # 截断在多字节字符中间不算解码失败
+            if e.start >= len(head) - 3:
+                return encoding
+    return "latin-1"
+
+
+def _unique_header(header: List[str]) -> List[str]:
+    seen = {}
+    names = []
+    for index, name in enumerate(header):
+        name = name.strip() or f"列{index + 1}"
+        if name in seen:
+            seen[name] += 1
+            name = f"{name}_{seen[name]}"
+        else:
+            seen[name] = 0
+        names.append(name)
+    return names
+
+
+def _to_column(values: List[str]):
+    """能全部解析为数字（允许空值）的列转成数值数组，否则保留为字符串"""
+    numbers = array(_NUMERIC_TYPECODE)
+    has_number = False
+    for value in values:
+        value = value.strip()
+        if not value:
+            numbers.append(_MISSING)
+            continue
+        try:
+            numbers.append(float(value))
+            has_number = True
+        except ValueError:
+            return [sys.intern(item) if len(item) <= 32 else item for item in values]
+    if not has_number and values:
+        return [sys.intern(item) for item in values]
+    return numbers
+
+
+def _normalize_number(value):
+    if isinstance(value, float) and value.is_integer() and abs(value) < 2 ** 53:
+        return int(value)
+    return value
+
+
+class TableStore:
+    """按(路径, mtime, 大小)缓存解析好的列式表，超过上限时按LRU淘汰"""
+
+    def __init__(self, max_tables: int = None):
+        self.max_tables = max_tables or Config.TABLE_CACHE_MAX_TABLES
+        self._tables: "OrderedDict[str, tuple]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, abs_path: str, delimiter: str = None) -> ColumnarTable:
+        stat = os.stat(abs_path)
+        key = (stat.st_mtime_ns, stat.st_size, delimiter)
+        with self._lock:
+            cached = self._tables.get(abs_path)
+            if cached is not None and cached[0] == key:
+                self._tables.move_to_end(abs_path)
+                self.hits += 1
+                return cached[1]
+            self.misses += 1
+
+        if abs_path.lower().endswith(('.json', '.jsonl', '.ndjson')):
+            table = ColumnarTable.from_json(abs_path)
+        else:
+            table = ColumnarTable.from_csv(abs_path, delimiter)
+        with self._lock:
+            self._tables[abs_path] = (key, table)
+            self._tables.move_to_end(abs_path)
+            while len(self._tables) > self.max_tables:
+                self._tables.popitem(last=False)
+        return table
+
+    def invalidate(self, abs_path: str = None):
+        with self._lock:
+            if abs_path is None:
+                self._tables.clear()
+            else:
+                self._tables.pop(abs_path, None)
+
+    def stats(self):
+        with self._lock:
+            return {
+                "tables": len(self._tables),
+                "max_tables": self.max_tables,
+                "hits": self.hits,
+                "misses": self.misses
+            }
+
+    def query(self, abs_path: str, filters=None, group_by=None, aggregations=None, columns=None,
+              sort_by: str = None, descending: bool = False, limit: int = None, delimiter: str = None) -> dict:
+        """在缓存的表上执行过滤/分组聚合/排序取前k，返回{columns, rows, matched_rows, total_rows}"""
+        table = self.get(abs_path, delimiter)
+        rows = _apply_filters(table, _normalize_filters(filters))
+        group_by = [group_by] if isinstance(group_by, str) else list(group_by or [])
+        aggregations = _normalize_aggregations(aggregations)
+        for column in group_by + [spec["column"] for spec in aggregations if spec["column"] != "*"]:
+            _check_column(table, column)
+
+        if group_by or aggregations:
+            result_columns, result_rows = _group(table, rows, group_by, aggregations)
+            matched = len(result_rows)
+            if sort_by:
+                if sort_by not in result_columns:
+                    raise ValueError(f"排序列不存在: {sort_by}，可选: {', '.join(result_columns)}")
+                index = result_columns.index(sort_by)
+                result_rows = _top_k(result_rows, lambda row: row[index], descending, limit)
+        else:
+            # 不聚合时在行号上排序取前k，只物化需要返回的行
+            result_columns = list(columns or table.column_names)
+            for column in result_columns:
+                _check_column(table, column)
+            matched = len(rows)
+            if sort_by:
+                _check_column(table, sort_by)
+                rows = _top_k(rows, lambda row: table.value(sort_by, row), descending, limit)
+            if limit is not None:
+                rows = rows[:max(0, limit)]
+            result_rows = [[_normalize_number(table.value(column, row)) for column in result_columns] for row in rows]
+
+        if limit is not None:
+            result_rows = result_rows[:max(0, limit)]
+        return {
+            "columns": result_columns,
+            "rows": result_rows,
+            "matched_rows": matched,
+            "total_rows": table.row_count
+        }
+
+
+def _check_column(table: ColumnarTable, column: str):
+    if column not in table.columns:
+        raise ValueError(f"列不存在: {column}，可选: {', '.join(table.column_names)}")
+
+
+def _top_k(items: list, value_of, descending: bool, limit: Optional[int]) -> list:
+    """按value_of排序，有limit时用堆只做部分排序；空值无论升降序都排在最后"""
+    def key(item):
+        value = value_of(item)
+        return ((value is None) != descending, isinstance(value, str), value if value is not None else 0)
+
+    if limit is not None and limit < len(items):
+        select = heapq.nlargest if descending else heapq.nsmallest
+        return select(max(0, limit), items, key=key)
+    return sorted(items, key=key, reverse=descending)
+
+
+def _normalize_filters(filters) -> list:
+    """支持 {"列": 值} 的相等过滤，以及 [{"column", "op", "value"}] 的完整形式"""
+    if not filters:
+        return []
+    if isinstance(filters, dict):
+        return [{"column": column, "op": "==", "value": value} for column, value in filters.items()]
+    return list(filters)
+
+
+def _normalize_aggregations(aggregations) -> list:
+    """支持 {"列": "函数"}、{"列": ["函数", ...]} 以及 [{"column", "func", "as"}]"""
+    if not aggregations:
+        return []
+    specs = []
+    if isinstance(aggregations, dict):
+        for column, funcs in aggregations.items():
+            for func in ([funcs] if isinstance(funcs, str) else funcs):
+                specs.append({"column": column, "func": func})
+    else:
+        specs = [dict(spec) for spec in aggregations]
+    for spec in specs:
+        spec.setdefault("column", "*")
+        spec["func"] = str(spec.get("func", "count")).lower()
+        if spec["func"] not in _AGGREGATIONS:
+            raise ValueError(f"不支持的聚合函数: {spec['func']}，可选: {', '.join(_AGGREGATIONS)}")
+        spec.setdefault("as", spec["func"] if spec["column"] == "*" else f"{spec['column']}_{spec['func']}")
+    return specs
+
+
+def _apply_filters(table: ColumnarTable, filters: list) -> List[int]:
+    rows = range(table.row_count)
+    for spec in filters:
+        column = spec.get("column")
+        _check_column(table, column)
+        op = spec.get("op", "==")
+        if op not in _FILTER_OPS:
+            raise ValueError(f"不支持的过滤操作: {op}，可选: {', '.join(_FILTER_OPS)}")
+        target = spec.get("value")
+        if table.is_numeric(column) and op != "contains":
+            target = _coerce_number(target)
+        if op in ("in", "not_in"):
+            target = set(target if isinstance(target, (list, tuple, set)) else [target])
+        compare = _FILTER_OPS[op]
+        values = table.columns[column]
+        numeric = table.is_numeric(column)
+        matched = []
+        for row in rows:
+            value = values[row]
+            if numeric and math.isnan(value):
+                value = None
+            try:
+                if compare(value, target):
+                    matched.append(row)
+            except TypeError:
+                continue
+        rows = matched
+    return list(rows)
+
+
+def _coerce_number(target):
+    if isinstance(target, (list, tuple, set)):
+        return [_coerce_number(item) for item in target]
+    if isinstance(target, str):
+        try:
+            return float(target)
+        except ValueError:
+            return target
+    return target
+
+
+def _group(table: ColumnarTable, rows: List[int], group_by: List[str], aggregations: list) -> tuple:
+    if not aggregations:
+        aggregations = _normalize_aggregations([{"column": "*", "func": "count"}])
+    groups: Dict[tuple, List[int]] = {}
+    for row in rows:
+        key = tuple(table.value(column, row) for column in group_by)
+        groups.setdefault(key, []).append(row)
+    if not group_by and not groups:
+        groups[()] = []
+
+    result_rows = []
+    for key, members in groups.items():
+        result = [_normalize_number(value) for value in key]
+        for spec in aggregations:
+            column = spec["column"]
+            if column == "*":
+                values = members
+            else:
+                values = [value for value in (table.value(column, row) for row in members) if value is not None]
+            try:
+                result.append(_round(_AGGREGATIONS[spec["func"]](values)))
+            except TypeError:
+                raise ValueError(f"列 {column} 不是数值列，不支持 {spec['func']}")
+        result_rows.append(result)
+    return group_by + [spec["as"] for spec in aggregations], result_rows
+
+
+def _round(value):
+    if isinstance(value, float):
+        return _normalize_number(round(value, 6))
+    return value
+
+
+_default_store: Optional[TableStore] = None
+_default_store_lock = threading.Lock()
+
+
+def get_table_store() -> TableStore:
+    """获取进程级共享的表缓存"""
+    global _default_store
+    with _default_store_lock:
+        if _default_store is None:
+            _default_store = TableStore()
+        return _default_store
@@ -0,0 +1,22 @@
+import time
+
+from sandbox import SandboxPool
+
+
+def test_output_streams_before_sleep_ends():
+    """打印后进入sleep时，已打印的行应在sleep结束前送达，而不是等到下一次写入"""
+    pool = SandboxPool(size=1)
+    try:
+        pool.start()
+        received = []
+        start = time.monotonic()
+        result = pool.execute(
+            'import time\nprint("step1")\ntime.sleep(2)\nprint("step2")',
+            on_output=lambda stream, text: received.append((time.monotonic() - start, stream, text))
+        )
+        assert result == "step1\nstep2\n"
+        first_at, stream, text = received[0]
+        assert (stream, text) == ("stdout", "step1\n")
+        assert first_at < 1.5
+    finally:
+        pool.shutdown()
@@ -1,7 +1,12 @@
 import os
 import json
-from typing import Dict, Any
+import mmap
+import importlib
+import threading
+from typing import Dict, Any, Callable, List, Optional, Union
 from config import Config
+from tracing import trace_span
+from file_edit import PatchError, apply_search_replace, apply_unified_diff, atomic_write
 
 # 工具定义结构版本
 TOOLS_VERSION = "1.0.0"
@@ -9,12 +14,21 @@ TOOLS_VERSION = "1.0.0"
 # 标准化工具定义模板
 class ToolDefinition:
     """工具定义的标准化结构"""
-    def __init__(self, name: str, description: str, required_params: list, optional_params: dict = None):
+    def __init__(self, name: str, description: str, required_params: list, optional_params: dict = None,
+                 handler: Union[Callable, str] = None):
         self.name = name
         self.description = description
         self.required_params = required_params
         self.optional_params = optional_params or {}
         self.all_params = {**{param: f"必需参数: {param}" for param in required_params}, **self.optional_params}
+        # 执行函数 handler(arguments, context) -> str；写成"模块:函数"时在首次调用才导入该模块
+        self.handler = handler
+    
+    def resolve_handler(self) -> Callable:
+        if isinstance(self.handler, str):
+            module_name, _, attr = self.handler.partition(":")
+            self.handler = getattr(importlib.import_module(module_name), attr)
+        return self.handler
     
     def to_dict(self):
         return {
@@ -39,68 +53,36 @@ class ToolDefinition:
                 lines.append(f"    - {param}: {desc}")
         
         return "\n".join(lines)
-
-# 使用标准化结构定义工具
-_TOOL_DEFINITIONS = [
-    ToolDefinition(
-        name="write_file",
-        description="将内容写入文件",
-        required_params=["file_path", "content"],
-        optional_params={
-            "file_path": "文件路径（相对于工作区）",
-            "content": "要写入的文件内容"
-        }
-    ),
-    ToolDefinition(
-        name="read_file",
-        description="读取文件内容",
-        required_params=["file_path"],
-        optional_params={
-            "file_path": "文件路径（相对于工作区）"
-        }
-    ),
-    ToolDefinition(
-        name="list_files",
-        description="列出目录中的文件",
-        required_params=[],
-        optional_params={
-            "directory": "目录路径（可选，默认为工作区根目录）"
-        }
-    ),
-    ToolDefinition(
-        name="execute_code",
-        description="执行Python代码",
-        required_params=["code"],
-        optional_params={
-            "code": "要执行的Python代码"
-        }
-    ),
-    ToolDefinition(
-        name="final_answer",
-        description="提供最终答案并结束任务",
-        required_params=["answer"],
-        optional_params={
-            "answer": "最终答案内容"
-        }
-    ),
-    ToolDefinition(
-        name="create_echarts_visualization",
-        description="根据输入数据和图表类型快速创建ECharts可视化HTML文件",
-        required_params=["data", "chart_type", "output_filename"],
-        optional_params={
-            "data": "图表数据，支持多种格式：列表、字典、JSON字符串等",
-            "chart_type": "图表类型：bar(柱状图)、line(折线图)、pie(饼图)、scatter(散点图)、radar(雷达图)、funnel(漏斗图)等",
-            "output_filename": "输出HTML文件名（相对于工作区）",
-            "title": "图表标题（可选）",
-            "x_axis_name": "X轴名称（可选）",
-            "y_axis_name": "Y轴名称（可选）",
-            "theme": "图表主题：light、dark、vintage、roma、shine、infographic等（可选，默认light）"
+    
+    def to_function_schema(self) -> dict:
+        """生成chat接口tools参数使用的函数定义（原生函数调用模式）
+        
+        参数说明没有类型信息，不声明type，模型按说明传入字符串、数字、列表或对象均可。
+        """
+        return {
+            "type": "function",
+            "function": {
+                "name": self.name,
+                "description": self.description,
+                "parameters": {
+                    "type": "object",
+                    "properties": {param: {"description": desc} for param, desc in self.all_params.items()},
+                    "required": list(self.required_params)
+                }
+            }
         }
-    )
-]
 
-# 生成向后兼容的TOOLS字典
-TOOLS = {tool_def.name: tool_def.to_dict() for tool_def in _TOOL_DEFINITIONS}
+class ToolContext:
+    """工具执行时的调用方上下文"""
+    def __init__(self, session_id: str = None, on_output=None, cancel_token=None):
+        self.session_id = session_id
+        # 执行过程中的输出回调 on_output(stream, text)，用于实时推送到前端
+        self.on_output = on_output
+        # 任务的取消标记，耗时的工具据此提前结束
+        self.cancel_token = cancel_token
+
+    def cancelled(self) -> bool:
+        return self.cancel_token is not None and self.cancel_token.cancelled
 
 def get_workspace_path(file_path: str) -> str:
     """获取工作空间内的文件路径"""
@@ -110,289 +92,616 @@ def write_file(file_path: str, content: str) -> str:
     """写入文件"""
     try:
         abs_path = get_workspace_path(file_path)
-        os.makedirs(os.path.dirname(abs_path), exist_ok=True)
-        
-        with open(abs_path, 'w', encoding='utf-8') as f:
-            f.write(content)
+        atomic_write(abs_path, content)
+        _notify_workspace_change(abs_path)
         
         return f"成功写入文件: {file_path}"
     except Exception as e:
         return f"写入文件失败: {str(e)}"
 
-def read_file(file_path: str) -> str:
-    """读取文件"""
+def edit_file(file_path: str, search: str = None, replace: str = None, replace_all: bool = False,
+              edits: list = None, patch: str = None, append: str = None) -> str:
+    """局部编辑文件：精确替换、应用unified diff或追加，修改通过临时文件+重命名原子生效"""
+    try:
+        abs_path = get_workspace_path(file_path)
+        
+        if append is not None:
+            # 追加使用O_APPEND单次写入，不需要重写整个文件
+            os.makedirs(os.path.dirname(abs_path), exist_ok=True)
+            with open(abs_path, 'a', encoding='utf-8') as f:
+                f.write(append)
+            _notify_workspace_change(abs_path)
+            return f"成功编辑文件: {file_path}（追加{len(append)}个字符）"
+        
+        with open(abs_path, 'r', encoding='utf-8', newline='') as f:
+            content = f.read()
+        
+        if patch:
+            content, hunks = apply_unified_diff(content, patch)
+            summary = f"应用{hunks}个补丁块"
+        else:
+            if isinstance(edits, str):
+                edits = json.loads(edits)
+            if not edits and search is not None:
+                edits = [{"search": search, "replace": replace, "replace_all": replace_all}]
+            if not edits:
+                return "编辑文件失败: 需要提供search/replace、edits、patch或append之一"
+            # 缺少replace多半是参数被截断或遗漏，不能当作删除；删除内容需显式传入空字符串
+            for number, edit in enumerate(edits, start=1):
+                if edit.get("replace") is None:
+                    target = "replace" if len(edits) == 1 else f"edits第{number}项的replace"
+                    return f"编辑文件失败: 缺少{target}（删除内容请传入空字符串），文件未修改"
+            total = 0
+            for edit in edits:
+                content, count = apply_search_replace(
+                    content, edit.get("search", ""), edit.get("replace", ""),
+                    _to_bool(edit.get("replace_all", replace_all))
+                )
+                total += count
+            summary = f"替换{total}处"
+        
+        atomic_write(abs_path, content)
+        _notify_workspace_change(abs_path)
+        return f"成功编辑文件: {file_path}（{summary}）"
+    except PatchError as e:
+        return f"编辑文件失败: {str(e)}，文件未修改"
+    except Exception as e:
+        return f"编辑文件失败: {str(e)}"
+
+def read_file(file_path: str, offset: int = None, limit: int = None, unit: str = "line", mode: str = None) -> str:
+    """读取文件，大文件或指定范围时通过mmap随机访问，只读取需要的部分"""
     try:
         abs_path = get_workspace_path(file_path)
+        paged = offset is not None or limit is not None or mode in ("head", "tail")
         
-        with open(abs_path, 'r', encoding='utf-8') as f:
-            return f.read()
+        # 小文件且未指定范围时保持原行为，直接返回全文
+        if not paged and os.path.getsize(abs_path) <= Config.READ_FILE_MAX_BYTES:
+            with open(abs_path, 'r', encoding='utf-8') as f:
+                return f.read()
+        
+        with open(abs_path, 'rb') as f:
+            stat = os.fstat(f.fileno())
+            if stat.st_size == 0:
+                return f"[文件: {file_path} | 总大小: 0字节 | 总行数: 0]\n"
+            with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+                total_lines = _count_lines(abs_path, stat, mm)
+                if unit == "byte":
+                    start, end = _byte_range(mm, offset, limit, mode)
+                    position = f"显示第{start}-{end}字节"
+                    next_offset = end
+                    total = stat.st_size
+                    truncated = False
+                else:
+                    start_line, end_line, start, end, truncated = _line_range(mm, total_lines, offset, limit, mode)
+                    position = f"显示第{start_line + 1}-{end_line}行"
+                    next_offset = end_line
+                    total = total_lines
+                content = mm[start:end].decode('utf-8', errors='replace')
+        
+        header = f"[文件: {file_path} | 总大小: {stat.st_size}字节 | 总行数: {total_lines} | {position}]"
+        footer = ""
+        if truncated:
+            # 单行超过单页上限时只显示了开头，按字节偏移继续读取该行剩余部分
+            footer = (f"\n[第{end_line}行超过{Config.READ_FILE_MAX_BYTES}字节，只显示了前{end - start}字节；"
+                      f"继续读取该行请使用 offset={end}, unit=byte")
+            footer += f"，读取后续行请使用 offset={next_offset}, unit=line]" if next_offset < total else "]"
+        elif next_offset < total:
+            footer = f"\n[未读完，继续读取请使用 offset={next_offset}, unit={'byte' if unit == 'byte' else 'line'}]"
+        return f"{header}\n{content}{footer}"
     except Exception as e:
         return f"读取文件失败: {str(e)}"
 
-def list_files(directory: str = "") -> str:
-    """列出文件"""
+# 行数统计缓存：(路径, 修改时间, 大小) -> 行数
+_line_count_cache: Dict[tuple, int] = {}
+_LINE_SCAN_CHUNK = 1024 * 1024
+
+def _count_lines(abs_path: str, stat, mm) -> int:
+    """按块统计换行符，结果按文件版本缓存"""
+    key = (abs_path, stat.st_mtime_ns, stat.st_size)
+    if key not in _line_count_cache:
+        if len(_line_count_cache) > 256:
+            _line_count_cache.clear()
+        count = sum(mm[i:i + _LINE_SCAN_CHUNK].count(b'\n') for i in range(0, len(mm), _LINE_SCAN_CHUNK))
+        if mm[-1:] != b'\n':
+            count += 1
+        _line_count_cache[key] = count
+    return _line_count_cache[key]
+
+def _line_offset(mm, line_index: int) -> int:
+    """返回第line_index行（从0开始）的起始字节位置"""
+    if line_index <= 0:
+        return 0
+    remaining = line_index
+    for chunk_start in range(0, len(mm), _LINE_SCAN_CHUNK):
+        chunk = mm[chunk_start:chunk_start + _LINE_SCAN_CHUNK]
+        newlines = chunk.count(b'\n')
+        if newlines < remaining:
+            remaining -= newlines
+            continue
+        pos = -1
+        for _ in range(remaining):
+            pos = chunk.find(b'\n', pos + 1)
+        return chunk_start + pos + 1
+    return len(mm)
+
+def _line_range(mm, total_lines: int, offset: int, limit: int, mode: str) -> tuple:
+    """计算按行读取的行范围和对应的字节范围，单页字节数不超过READ_FILE_MAX_BYTES
+
+    返回(起始行, 结束行, 起始字节, 结束字节, 是否截断)；第一行本身超过上限时只取前面部分并标记截断。
+    """
+    limit = limit if limit and limit > 0 else Config.READ_FILE_DEFAULT_LINES
+    if mode == "tail":
+        start_line = max(0, total_lines - limit)
+    else:
+        start_line = min(max(0, offset or 0), total_lines)
+    end_line = min(total_lines, start_line + limit)
+    
+    start = _line_offset(mm, start_line)
+    end = start
+    for line in range(start_line, end_line):
+        newline = mm.find(b'\n', end)
+        next_end = len(mm) if newline == -1 else newline + 1
+        if next_end - start > Config.READ_FILE_MAX_BYTES and line > start_line:
+            end_line = line
+            break
+        end = next_end
+    truncated = end - start > Config.READ_FILE_MAX_BYTES
+    if truncated:
+        end_line = start_line + 1
+        end = start + Config.READ_FILE_MAX_BYTES
+        # 截断位置对齐到UTF-8字符边界
+        while end > start and mm[end] & 0xC0 == 0x80:
+            end -= 1
+    return start_line, end_line, start, end, truncated
+
+def _byte_range(mm, offset: int, limit: int, mode: str) -> tuple:
+    """计算按字节读取的范围，边界对齐到UTF-8字符"""
+    limit = min(limit if limit and limit > 0 else Config.READ_FILE_DEFAULT_BYTES, Config.READ_FILE_MAX_BYTES)
+    size = len(mm)
+    if mode == "tail":
+        start = max(0, size - limit)
+    else:
+        start = min(max(0, offset or 0), size)
+    end = min(size, start + limit)
+    # 跳过UTF-8续字节，避免从字符中间开始或结束
+    while start < end and mm[start] & 0xC0 == 0x80:
+        start += 1
+    while start < end < size and mm[end] & 0xC0 == 0x80:
+        end -= 1
+    return start, end
+
+def list_files(directory: str = "", pattern: str = None, recursive: bool = False, offset: int = 0, limit: int = None) -> str:
+    """列出文件（从工作空间索引中查询）"""
+    from workspace_index import get_workspace_index
+    
     try:
-        abs_path = get_workspace_path(directory)
-        files = os.listdir(abs_path)
-        return json.dumps(files, ensure_ascii=False, indent=2)
+        entries, total = get_workspace_index().list(
+            directory, pattern=pattern, recursive=recursive,
+            include_dirs=not recursive, offset=offset, limit=limit
+        )
+        key = "path" if recursive else "name"
+        result = json.dumps([entry[key] for entry in entries], ensure_ascii=False, indent=2)
+        if len(entries) < total:
+            result += f"\n[共{total}项，当前显示{offset or 0}-{(offset or 0) + len(entries)}项]"
+        return result
     except Exception as e:
         return f"列出文件失败: {str(e)}"
 
-def execute_code(code: str) -> str:
-    """执行Python代码"""
-    import sys
-    from io import StringIO
-    
-    # 重定向输出
-    old_stdout = sys.stdout
-    captured_output = StringIO()
+def query_table(file_path: str, filters=None, group_by=None, aggregations=None, columns=None,
+                sort_by: str = None, descending: bool = False, limit: int = None) -> str:
+    """在缓存的列式表上查询，只返回结果行"""
+    from table_store import get_table_store
     
     try:
-        sys.stdout = captured_output
-        
-        # 创建执行环境，包含工作区相关的辅助函数
-        exec_globals = {
-            '__builtins__': __builtins__,
-            'WORKSPACE_PATH': Config.WORKSPACE_PATH,
-            'get_workspace_file_path': lambda filename: os.path.join(Config.WORKSPACE_PATH, filename),
-            'os': os,
-            'json': json
-        }
-        
-        # 执行代码
-        exec(code, exec_globals)
+        abs_path = get_workspace_path(file_path)
+        filters, group_by, aggregations, columns = (
+            json.loads(value) if isinstance(value, str) and value.strip()[:1] in ("[", "{") else value
+            for value in (filters, group_by, aggregations, columns)
+        )
+        store = get_table_store()
         
-        # 获取输出结果
-        output = captured_output.getvalue()
-        return output if output else "代码执行成功，无输出"
+        if not any((filters, group_by, aggregations, columns, sort_by, limit)):
+            table = store.get(abs_path)
+            preview = store.query(abs_path, limit=5)
+            return json.dumps({
+                "rows": table.row_count,
+                "columns": table.schema(),
+                "sample": preview["rows"]
+            }, ensure_ascii=False)
         
+        max_rows = Config.QUERY_TABLE_MAX_ROWS
+        limit = max_rows if limit is None else min(limit, max_rows)
+        result = store.query(
+            abs_path, filters=filters, group_by=group_by, aggregations=aggregations,
+            columns=columns, sort_by=sort_by, descending=descending, limit=limit
+        )
+        output = json.dumps({"columns": result["columns"], "rows": result["rows"]}, ensure_ascii=False)
+        output += f"\n[匹配{result['matched_rows']}行（全表{result['total_rows']}行），返回{len(result['rows'])}行]"
+        return output
+    except FileNotFoundError:
+        return f"查询表格失败: 文件不存在: {file_path}"
+    except Exception as e:
+        return f"查询表格失败: {str(e)}"
+
+def _notify_workspace_change(abs_path: str):
+    """工具写入文件后立即更新工作空间索引"""
+    from workspace_index import get_workspace_index
+    get_workspace_index().notify(abs_path)
+
+def execute_code(code: str, reset: bool = False, session_id: str = None, on_output=None, cancelled=None) -> str:
+    """执行Python代码（在沙箱进程中运行，带超时和资源限制）"""
+    from sandbox import get_sandbox, get_kernel_manager
+    
+    from workspace_index import get_workspace_index
+    
+    try:
+        # 持久化内核模式下，同一会话的多次执行共享变量
+        if Config.EXECUTE_CODE_STATEFUL and session_id:
+            return get_kernel_manager().execute(session_id, code, reset=reset, on_output=on_output, cancelled=cancelled)
+        return get_sandbox().execute(code, on_output=on_output, cancelled=cancelled)
     except Exception as e:
         return f"代码执行错误: {str(e)}"
     finally:
-        # 确保输出被恢复
-        sys.stdout = old_stdout
+        # 代码可能创建或修改了文件
+        get_workspace_index().invalidate()
 
-def create_echarts_visualization(data, chart_type: str, output_filename: str, title: str = "", x_axis_name: str = "", y_axis_name: str = "", theme: str = "light") -> str:
-    """根据输入数据和图表类型快速创建ECharts可视化HTML文件"""
+def read_tool_result(result_id: str, offset: int = None, limit: int = None, unit: str = "line", session_id: str = None) -> str:
+    """分段读取转存的大块工具结果"""
+    from blob_store import get_blob_store
+    
     try:
-        # 确保文件名以.html结尾
-        if not output_filename.endswith('.html'):
-            output_filename += '.html'
-        
-        # 获取输出文件的绝对路径
-        abs_path = get_workspace_path(output_filename)
-        os.makedirs(os.path.dirname(abs_path), exist_ok=True)
-        
-        # 数据预处理
-        if isinstance(data, str):
-            try:
-                data = json.loads(data)
-            except json.JSONDecodeError:
-                return "数据格式错误：无法解析JSON字符串"
-        
-        # 数据格式化
-        chart_type = chart_type.lower()
-        processed_data = _process_chart_data(data, chart_type)
-        
-        # 生成图表配置
-        chart_option = _generate_chart_config(chart_type, processed_data, title, x_axis_name, y_axis_name)
-        
-        # 生成HTML
-        html_content = _generate_html_template(chart_option, title, chart_type, theme)
-        
-        # 写入文件
-        with open(abs_path, 'w', encoding='utf-8') as f:
-            f.write(html_content)
-        
-        result = f"成功创建{chart_type}图表: {output_filename}"
-        if title:
-            result += f"\n标题: {title}"
-        result += f"\n文件路径: {abs_path}"
-        return result
-        
+        store = get_blob_store()
+        blob = store.get(session_id, result_id)
+        if blob is None:
+            return f"读取工具结果失败: 结果不存在或已过期: {result_id}"
+        offset = offset or 0
+        max_chars = Config.TOOL_RESULT_SPILL_CHARS
+        if unit == "char":
+            limit = min(limit or max_chars, max_chars)
+            content = store.read_chars(blob, offset, limit)
+            end = offset + len(content)
+            header = f"[{result_id} 第{offset}-{end}字符，共{blob.chars}字符]"
+            more = end < blob.chars
+        else:
+            content, end = store.read_lines(blob, offset, limit or Config.TOOL_RESULT_PAGE_LINES)
+            # 单页同样不超过转存阈值，按整行截断
+            if len(content) > max_chars:
+                cut = content.rfind("\n", 0, max_chars) + 1
+                if cut <= 0:
+                    return f"读取工具结果失败: 第{offset}行过长，请使用unit=char按字符读取"
+                end = offset + content.count("\n", 0, cut)
+                content = content[:cut]
+            header = f"[{result_id} 第{offset}-{end}行，共{blob.lines}行]"
+            more = end < blob.lines
+        if more:
+            header += f" 继续读取请使用offset={end}"
+        return f"{header}\n{content}"
     except Exception as e:
-        return f"图表创建失败: {str(e)}"
+        return f"读取工具结果失败: {str(e)}"
 
+def _to_int(value):
+    """兼容模型以字符串形式传入的整数参数，未提供时返回None"""
+    if value is None or value == "":
+        return None
+    return int(value)
 
-def _process_chart_data(data, chart_type):
-    """处理不同图表类型的数据格式"""
-    if chart_type in ['bar', 'line']:
-        return _process_bar_line_data(data)
-    elif chart_type == 'pie':
-        return _process_pie_data(data)
-    elif chart_type == 'scatter':
-        return _process_scatter_data(data)
-    else:
-        return _process_bar_line_data(data)  # 默认处理为柱状图
+def _to_bool(value) -> bool:
+    """兼容模型以字符串形式传入的布尔参数"""
+    if isinstance(value, str):
+        return value.strip().lower() in ("true", "1", "yes")
+    return bool(value)
 
+def _run_write_file(arguments: Dict[str, Any], context: ToolContext) -> str:
+    return write_file(arguments.get("file_path", ""), arguments.get("content", ""))
 
-def _process_bar_line_data(data):
-    """处理柱状图和折线图数据"""
-    if isinstance(data, dict):
-        return list(data.keys()), list(data.values())
-    elif isinstance(data, list) and len(data) > 0:
-        if isinstance(data[0], dict) and 'name' in data[0] and 'value' in data[0]:
-            return [item['name'] for item in data], [item['value'] for item in data]
-        else:
-            return [f'项目{i+1}' for i in range(len(data))], data
-    else:
-        return ['A', 'B', 'C', 'D', 'E'], [20, 30, 40, 50, 60]
+def _run_edit_file(arguments: Dict[str, Any], context: ToolContext) -> str:
+    return edit_file(
+        arguments.get("file_path", ""),
+        arguments.get("search"),
+        arguments.get("replace"),
+        _to_bool(arguments.get("replace_all", False)),
+        arguments.get("edits"),
+        arguments.get("patch"),
+        arguments.get("append")
+    )
 
+def _run_read_file(arguments: Dict[str, Any], context: ToolContext) -> str:
+    return read_file(
+        arguments.get("file_path", ""),
+        _to_int(arguments.get("offset")),
+        _to_int(arguments.get("limit")),
+        arguments.get("unit") or "line",
+        arguments.get("mode")
+    )
 
-def _process_pie_data(data):
-    """处理饼图数据"""
-    if isinstance(data, dict):
-        return [{'name': k, 'value': v} for k, v in data.items()]
-    elif isinstance(data, list) and len(data) > 0:
-        if isinstance(data[0], dict) and 'name' in data[0] and 'value' in data[0]:
-            return data
-        else:
-            return [{'name': f'类别{i+1}', 'value': data[i]} for i in range(len(data))]
-    else:
-        return [{'name': 'A', 'value': 20}, {'name': 'B', 'value': 30}, {'name': 'C', 'value': 40}, {'name': 'D', 'value': 50}]
+def _run_list_files(arguments: Dict[str, Any], context: ToolContext) -> str:
+    return list_files(
+        arguments.get("directory", ""),
+        arguments.get("pattern"),
+        _to_bool(arguments.get("recursive", False)),
+        _to_int(arguments.get("offset")) or 0,
+        _to_int(arguments.get("limit"))
+    )
 
+def _run_query_table(arguments: Dict[str, Any], context: ToolContext) -> str:
+    return query_table(
+        arguments.get("file_path", ""),
+        arguments.get("filters"),
+        arguments.get("group_by"),
+        arguments.get("aggregations"),
+        arguments.get("columns"),
+        arguments.get("sort_by"),
+        _to_bool(arguments.get("descending", False)),
+        _to_int(arguments.get("limit"))
+    )
 
-def _process_scatter_data(data):
-    """处理散点图数据"""
-    if isinstance(data, list) and len(data) > 0:
-        if isinstance(data[0], list) and len(data[0]) >= 2:
-            return data
-        elif isinstance(data[0], dict) and 'x' in data[0] and 'y' in data[0]:
-            return [[item['x'], item['y']] for item in data]
-        else:
-            return [[i, data[i]] for i in range(len(data))]
-    else:
-        return [[10, 20], [15, 25], [20, 30], [25, 35], [30, 40]]
+def _run_execute_code(arguments: Dict[str, Any], context: ToolContext) -> str:
+    return execute_code(
+        arguments.get("code", ""),
+        _to_bool(arguments.get("reset", False)),
+        context.session_id,
+        context.on_output,
+        context.cancelled
+    )
+
+def _run_read_tool_result(arguments: Dict[str, Any], context: ToolContext) -> str:
+    return read_tool_result(
+        arguments.get("result_id", ""),
+        _to_int(arguments.get("offset")),
+        _to_int(arguments.get("limit")),
+        arguments.get("unit") or "line",
+        context.session_id
+    )
 
+def _run_final_answer(arguments: Dict[str, Any], context: ToolContext) -> str:
+    return f"任务完成: {arguments.get('answer', '')}"
 
-def _generate_chart_config(chart_type, processed_data, title, x_axis_name, y_axis_name):
-    """生成ECharts配置"""
-    # 基础配置
-    option = {
-        'title': {
-            'text': title or f'{chart_type.capitalize()}图表',
-            'left': 'center'
+# 使用标准化结构定义工具，每个工具绑定自己的执行函数
+_TOOL_DEFINITIONS = [
+    ToolDefinition(
+        name="write_file",
+        description="将内容写入文件",
+        required_params=["file_path", "content"],
+        optional_params={
+            "file_path": "文件路径（相对于工作区）",
+            "content": "要写入的文件内容"
+        },
+        handler=_run_write_file
+    ),
+    ToolDefinition(
+        name="edit_file",
+        description="局部修改文件，无需重新输出整个文件。三种方式任选其一：search/replace精确替换、patch应用unified diff、append追加内容",
+        required_params=["file_path"],
+        optional_params={
+            "file_path": "文件路径（相对于工作区）",
+            "search": "要被替换的原文片段，必须与文件内容完全一致且唯一（与replace配合使用）",
+            "replace": "替换后的内容（与search配合使用，删除内容时传入空字符串）",
+            "replace_all": "search匹配到多处时是否全部替换（可选，默认false）",
+            "edits": "多组替换，格式为[{\"search\": \"...\", \"replace\": \"...\"}]，按顺序依次应用",
+            "patch": "unified diff格式的补丁（@@ -起始行,行数 +起始行,行数 @@ 开头的hunk，行首为空格/-/+）",
+            "append": "追加到文件末尾的内容，文件不存在时会创建"
+        },
+        handler=_run_edit_file
+    ),
+    ToolDefinition(
+        name="read_file",
+        description="读取文件内容。小文件直接返回全文；大文件或指定范围时按页返回，并附带文件总大小和总行数，可根据提示继续翻页",
+        required_params=["file_path"],
+        optional_params={
+            "file_path": "文件路径（相对于工作区）",
+            "offset": "起始位置：跳过的行数或字节数，从0开始（可选，默认0）",
+            "limit": "读取的行数或字节数（可选，默认200行或16384字节）",
+            "unit": "offset和limit的单位：line(按行)或byte(按字节)（可选，默认line）",
+            "mode": "读取模式：head(从开头读取)或tail(读取末尾limit行/字节)（可选）"
+        },
+        handler=_run_read_file
+    ),
+    ToolDefinition(
+        name="list_files",
+        description="列出目录中的文件",
+        required_params=[],
+        optional_params={
+            "directory": "目录路径（可选，默认为工作区根目录）",
+            "pattern": "文件名或路径的通配符过滤，如*.csv（可选）",
+            "recursive": "是否递归列出子目录中的文件，递归时返回相对路径（可选，默认false）",
+            "offset": "分页起始位置（可选，默认0）",
+            "limit": "最多返回的条目数（可选，默认返回全部）"
+        },
+        handler=_run_list_files
+    ),
+    ToolDefinition(
+        name="query_table",
+        description="直接查询CSV/TSV/JSON表格数据（过滤、分组聚合、排序取前N），只返回查询结果而不是全部原始数据。表格解析后会缓存，重复查询无需重新读取；不带查询条件时返回列名、类型和样例行",
+        required_params=["file_path"],
+        optional_params={
+            "file_path": "表格文件路径（相对于工作区）",
+            "filters": "过滤条件，{\"列\": 值}表示相等，或[{\"column\": \"列\", \"op\": \">=\", \"value\": 值}]，op支持==、!=、>、>=、<、<=、in、not_in、contains（可选）",
+            "group_by": "分组列名或列名列表（可选）",
+            "aggregations": "聚合，如{\"工资\": \"mean\"}或{\"工资\": [\"sum\", \"max\"]}，函数支持count、sum、mean、min、max、median、nunique（可选）",
+            "columns": "不聚合时要返回的列名列表（可选，默认全部列）",
+            "sort_by": "排序列名，可以是聚合结果列如\"工资_mean\"（可选）",
+            "descending": "是否降序（可选，默认false）",
+            "limit": "返回的最大行数（可选）"
+        },
+        handler=_run_query_table
+    ),
+    ToolDefinition(
+        name="execute_code",
+        description="执行Python代码。启用会话内核时，变量和已加载的数据会在多次调用之间保留，无需重复读取和解析文件",
+        required_params=["code"],
+        optional_params={
+            "code": "要执行的Python代码",
+            "reset": "是否在执行前清空会话内核中的变量（可选，默认false）"
+        },
+        handler=_run_execute_code
+    ),
+    ToolDefinition(
+        name="read_tool_result",
+        description="分段读取之前被转存的大块工具结果。工具结果过长时上下文中只保留预览和结果ID，需要查看其余部分时使用",
+        required_params=["result_id"],
+        optional_params={
+            "result_id": "工具结果中给出的结果ID，如r1a2b3c4d5e",
+            "offset": "起始位置：跳过的行数或字符数，从0开始（可选，默认0）",
+            "limit": "读取的行数或字符数（可选，默认200行）",
+            "unit": "offset和limit的单位：line(按行)或char(按字符)（可选，默认line）"
+        },
+        handler=_run_read_tool_result
+    ),
+    ToolDefinition(
+        name="final_answer",
+        description="提供最终答案并结束任务",
+        required_params=["answer"],
+        optional_params={
+            "answer": "最终答案内容"
+        },
+        handler=_run_final_answer
+    ),
+    ToolDefinition(
+        name="create_echarts_visualization",
+        description="根据输入数据和图表类型快速创建ECharts可视化HTML文件。数据在工作区文件中时，用source_file加列名直接作图，不要把数据逐个写进data",
+        required_params=["chart_type", "output_filename"],
+        optional_params={
+            "data": "图表数据，支持多种格式：列表、字典、JSON字符串等（与source_file二选一）",
+            "source_file": "数据文件路径（CSV/TSV/JSON，相对于工作区），服务端读取并聚合，与data二选一",
+            "x_column": "使用source_file时作为类别/X轴的列名",
+            "y_column": "使用source_file时作为数值/Y轴的列名（aggregation为count时可省略）",
+            "aggregation": "按x_column分组后对y_column的聚合：sum、mean、count、min、max、median（可选，不填则逐行取值）",
+            "filters": "使用source_file时的过滤条件，格式同query_table（可选）",
+            "limit": "使用source_file时保留的类别数：聚合后按数值从大到小取前N个（可选）",
+            "chart_type": "图表类型：bar(柱状图)、line(折线图)、pie(饼图)、scatter(散点图)、radar(雷达图)、funnel(漏斗图)等",
+            "output_filename": "输出HTML文件名（相对于工作区）",
+            "title": "图表标题（可选）",
+            "x_axis_name": "X轴名称（可选）",
+            "y_axis_name": "Y轴名称（可选）",
+            "theme": "图表主题：light、dark、vintage、roma、shine、infographic等（可选，默认light）"
+        },
+        handler="chart_tools:run_visualization_tool"
+    ),
+    ToolDefinition(
+        name="create_echarts_dashboard",
+        description="把多个图表放进同一个HTML仪表盘页面，一次打开即可查看一批分析图表，屏幕外的图表滚动到时才渲染",
+        required_params=["charts", "output_filename"],
+        optional_params={
+            "charts": "图表列表，每项与create_echarts_visualization的参数相同（chart_type、title、data或source_file/x_column/y_column/aggregation等，不含output_filename）",
+            "output_filename": "输出HTML文件名（相对于工作区）",
+            "title": "仪表盘标题（可选）",
+            "theme": "页面主题（可选，默认light）",
+            "columns": "每行显示的图表数（可选，默认2）"
         },
-        'tooltip': {'trigger': 'item' if chart_type == 'pie' else 'axis'}
-    }
+        handler="chart_tools:run_dashboard_tool"
+    )
+]
+
+class ToolRegistry:
+    """工具注册表：工具名到定义（含执行函数）的映射，执行时按名称直接查表分发
     
-    if chart_type == 'bar':
-        x_data, y_data = processed_data
-        option.update({
-            'xAxis': {'type': 'category', 'data': x_data, 'name': x_axis_name},
-            'yAxis': {'type': 'value', 'name': y_axis_name},
-            'series': [{'name': y_axis_name or '数值', 'type': 'bar', 'data': y_data}]
-        })
-    elif chart_type == 'line':
-        x_data, y_data = processed_data
-        option.update({
-            'xAxis': {'type': 'category', 'data': x_data, 'name': x_axis_name},
-            'yAxis': {'type': 'value', 'name': y_axis_name},
-            'series': [{'name': y_axis_name or '数值', 'type': 'line', 'data': y_data}]
-        })
-    elif chart_type == 'pie':
-        option.update({
-            'legend': {'top': '10%'},
-            'series': [{
-                'name': '数据',
-                'type': 'pie',
-                'radius': '50%',
-                'data': processed_data,
-                'emphasis': {
-                    'itemStyle': {
-                        'shadowBlur': 10,
-                        'shadowOffsetX': 0,
-                        'shadowColor': 'rgba(0, 0, 0, 0.5)'
-                    }
-                }
-            }]
-        })
-    elif chart_type == 'scatter':
-        option.update({
-            'xAxis': {'type': 'value', 'name': x_axis_name},
-            'yAxis': {'type': 'value', 'name': y_axis_name},
-            'series': [{'name': y_axis_name or '数值', 'type': 'scatter', 'data': processed_data}]
-        })
-    else:
-        # 默认柱状图
-        option.update({
-            'xAxis': {'type': 'category', 'data': ['A', 'B', 'C', 'D', 'E']},
-            'yAxis': {'type': 'value'},
-            'series': [{'name': '数值', 'type': 'bar', 'data': [20, 30, 40, 50, 60]}]
-        })
+    工具描述和函数定义在首次使用时渲染并缓存，注册新工具后失效重建。
+    """
+    def __init__(self):
+        self._tools: Dict[str, ToolDefinition] = {}
+        self._lock = threading.Lock()
+        self._description: Optional[str] = None
+        self._function_schemas: Optional[List[dict]] = None
+        # 向后兼容的TOOLS字典，随注册同步更新
+        self.schemas: Dict[str, dict] = {}
+    
+    def register(self, tool_def: ToolDefinition, replace: bool = False):
+        with self._lock:
+            if tool_def.name in self._tools and not replace:
+                raise ValueError(f"工具名称重复: {tool_def.name}")
+            self._tools[tool_def.name] = tool_def
+            self.schemas[tool_def.name] = tool_def.to_dict()
+            self._description = None
+            self._function_schemas = None
+    
+    def unregister(self, name: str):
+        with self._lock:
+            self._tools.pop(name, None)
+            self.schemas.pop(name, None)
+            self._description = None
+            self._function_schemas = None
     
-    return option
-
-
-def _generate_html_template(chart_option, title, chart_type, theme):
-    """生成HTML模板"""
-    # 主题样式
-    theme_styles = {
-        'light': 'background-color: #fff; color: #333;',
-        'dark': 'background-color: #2c3e50; color: #ecf0f1;',
-        'vintage': 'background-color: #fef8e8; color: #8b4513;',
-        'roma': 'background-color: #f5f5dc; color: #8b0000;',
-        'shine': 'background-color: #f0f8ff; color: #4682b4;',
-        'infographic': 'background-color: #f8f9fa; color: #495057;'
-    }
+    def get(self, name: str) -> Optional[ToolDefinition]:
+        return self._tools.get(name)
     
-    body_style = theme_styles.get(theme, theme_styles['light'])
+    def __contains__(self, name: str) -> bool:
+        return name in self._tools
     
-    return f"""<!DOCTYPE html>
-<html lang="zh-CN">
-<head>
-    <meta charset="UTF-8">
-    <meta name="viewport" content="width=device-width, initial-scale=1.0">
-    <title>{title or f'{chart_type.capitalize()}图表'}</title>
-    <script src="https://cdn.jsdelivr.net/npm/echarts@5.4.3/dist/echarts.min.js"></script>
-    <style>
-        body {{
-            margin: 0;
-            padding: 20px;
-            font-family: 'Microsoft YaHei', Arial, sans-serif;
-            {body_style}
-        }}
-        #chart {{
-            width: 100%;
-            height: 600px;
-        }}
-    </style>
-</head>
-<body>
-    <div id="chart"></div>
-    <script>
-        var chartDom = document.getElementById('chart');
-        var myChart = echarts.init(chartDom);
-        var option = {json.dumps(chart_option, ensure_ascii=False, indent=2)};
-        myChart.setOption(option);
-        window.addEventListener('resize', function() {{
-            myChart.resize();
-        }});
-    </script>
-</body>
-</html>"""
+    def definitions(self) -> List[ToolDefinition]:
+        with self._lock:
+            return list(self._tools.values())
+    
+    def description(self) -> str:
+        description = self._description
+        if description is None:
+            descriptions = [tool_def.to_prompt_format() for tool_def in self.definitions()]
+            header = f"# 可用工具 (版本: {TOOLS_VERSION})\n"
+            footer = "\n\n注意：所有文件操作都相对于工作区目录进行。"
+            description = self._description = header + "\n\n".join(descriptions) + footer
+        return description
+    
+    def function_schemas(self) -> List[dict]:
+        schemas = self._function_schemas
+        if schemas is None:
+            schemas = self._function_schemas = [tool_def.to_function_schema() for tool_def in self.definitions()]
+        return schemas
+    
+    def load_plugins(self, group: str = None) -> List[str]:
+        """从entry points加载第三方工具，返回加载成功的工具名
+        
+        entry point可以指向ToolDefinition、ToolDefinition列表，或返回它们的函数。
+        插件的handler写成"模块:函数"字符串时，执行模块同样延迟到首次调用才导入。
+        """
+        from importlib.metadata import entry_points
+        
+        loaded = []
+        for entry_point in entry_points(group=group or Config.TOOL_PLUGIN_GROUP):
+            try:
+                tools = entry_point.load()
+                if callable(tools) and not isinstance(tools, ToolDefinition):
+                    tools = tools()
+                for tool_def in tools if isinstance(tools, (list, tuple)) else [tools]:
+                    if not isinstance(tool_def, ToolDefinition) or tool_def.handler is None:
+                        raise TypeError(f"{tool_def!r} 不是带handler的ToolDefinition")
+                    self.register(tool_def)
+                    loaded.append(tool_def.name)
+            except Exception as e:
+                print(f"加载工具插件 {entry_point.name} 失败: {str(e)}")
+        return loaded
 
 
+_registry = ToolRegistry()
+for _tool_def in _TOOL_DEFINITIONS:
+    _registry.register(_tool_def)
+_plugins_loaded = False
+_plugins_lock = threading.Lock()
 
+# 向后兼容的TOOLS字典
+TOOLS = _registry.schemas
+
+def get_tool_registry() -> ToolRegistry:
+    """获取工具注册表，首次调用时加载插件工具"""
+    global _plugins_loaded
+    if not _plugins_loaded:
+        with _plugins_lock:
+            if not _plugins_loaded:
+                if Config.TOOL_PLUGINS_ENABLED:
+                    _registry.load_plugins()
+                _plugins_loaded = True
+    return _registry
 
 def get_tools_description() -> str:
     """获取工具的详细描述，用于prompt - 使用标准化格式确保稳定性"""
     try:
-        # 使用标准化的工具定义生成描述
-        descriptions = []
-        for tool_def in _TOOL_DEFINITIONS:
-            descriptions.append(tool_def.to_prompt_format())
-        
-        # 添加版本信息和一致性检查
-        header = f"# 可用工具 (版本: {TOOLS_VERSION})\n"
-        footer = "\n\n注意：所有文件操作都相对于工作区目录进行。"
-        
-        return header + "\n\n".join(descriptions) + footer
-    
+        return get_tool_registry().description()
     except Exception as e:
         # 降级到基础格式，确保系统稳定性
         return get_tools_description_fallback()
 
+def get_tool_schemas() -> List[dict]:
+    """获取全部工具的函数定义，原生函数调用模式下通过tools参数发送"""
+    return get_tool_registry().function_schemas()
+
 def get_tools_description_fallback() -> str:
     """降级版本的工具描述生成，确保系统稳定性"""
     descriptions = []
@@ -410,16 +719,14 @@ def get_tools_description_fallback() -> str:
 def validate_tools_consistency() -> tuple[bool, str]:
     """验证工具定义的一致性"""
     try:
-        # 检查工具名称唯一性
-        tool_names = [tool_def.name for tool_def in _TOOL_DEFINITIONS]
-        if len(tool_names) != len(set(tool_names)):
-            return False, "工具名称存在重复"
-        
-        # 检查每个工具定义的完整性
-        for tool_def in _TOOL_DEFINITIONS:
+        # 注册表按名称存放，重复名称在注册时已被拒绝
+        for tool_def in get_tool_registry().definitions():
             if not tool_def.name or not tool_def.description:
                 return False, f"工具 {tool_def.name} 缺少必要信息"
             
+            if tool_def.handler is None:
+                return False, f"工具 {tool_def.name} 未绑定执行函数"
+            
             # 检查必需参数是否在参数列表中
             for param in tool_def.required_params:
                 if param not in tool_def.all_params:
@@ -432,48 +739,31 @@ def validate_tools_consistency() -> tuple[bool, str]:
 
 def validate_tool_arguments(tool_name: str, arguments: Dict[str, Any]) -> tuple[bool, str]:
     """验证工具参数"""
-    if tool_name not in TOOLS:
+    tool_def = get_tool_registry().get(tool_name)
+    if tool_def is None:
         return False, f"未知工具: {tool_name}"
     
-    tool_info = TOOLS[tool_name]
-    required_params = tool_info.get('required_parameters', [])
-    
     # 检查必需参数
-    for param_name in required_params:
+    for param_name in tool_def.required_params:
         if param_name not in arguments:
             return False, f"缺少必需参数: {param_name}"
     
     return True, "参数验证通过"
 
-def execute_tool(tool_name: str, arguments: Dict[str, Any]) -> str:
+def execute_tool(tool_name: str, arguments: Dict[str, Any], context: ToolContext = None) -> str:
     """执行工具 - 增强版本，包含参数验证和错误处理"""
+    context = context or ToolContext()
+    
     # 验证参数
     is_valid, message = validate_tool_arguments(tool_name, arguments)
     if not is_valid:
         return f"参数验证失败: {message}"
     
-    try:
-        if tool_name == "write_file":
-            return write_file(arguments.get("file_path", ""), arguments.get("content", ""))
-        elif tool_name == "read_file":
-            return read_file(arguments.get("file_path", ""))
-        elif tool_name == "list_files":
-            return list_files(arguments.get("directory", ""))
-        elif tool_name == "execute_code":
-             return execute_code(arguments.get("code", ""))
-        elif tool_name == "final_answer":
-            return f"任务完成: {arguments.get('answer', '')}"
-        elif tool_name == "create_echarts_visualization":
-            return create_echarts_visualization(
-                arguments.get("data", {}),
-                arguments.get("chart_type", "bar"),
-                arguments.get("output_filename", ""),
-                arguments.get("title", ""),
-                arguments.get("x_axis_name", ""),
-                arguments.get("y_axis_name", ""),
-                arguments.get("theme", "light")
-            )
-        else:
-            return f"未知工具: {tool_name}"
-    except Exception as e:
-        return f"工具执行错误 [{tool_name}]: {str(e)}"
\ No newline at end of file
+    with trace_span("tool.execute", tool=tool_name, session_id=context.session_id) as span:
+        try:
+            result = get_tool_registry().get(tool_name).resolve_handler()(arguments, context)
+        except Exception as e:
+            span.status = "error"
+            result = f"工具执行错误 [{tool_name}]: {str(e)}"
+        span.set(result_chars=len(result))
+        return result
@@ -0,0 +1,295 @@
+import contextvars
+import json
+import threading
+import time
+import uuid
+from bisect import bisect_left
+from contextlib import contextmanager
+from typing import Callable, Dict, List, Optional, Tuple
+from cancellation import TaskCancelled
+from config import Config
+
+# 延迟类直方图的默认分桶（秒）
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+# 生成速度直方图的分桶（token/秒）
+RATE_BUCKETS = (1, 5, 10, 20, 50, 100, 200, 500, 1000)
+
+_current_span: contextvars.ContextVar = contextvars.ContextVar("current_span", default=None)
+
+
+class Span:
+    """一段带属性的计时区间，结束后交给所有sink"""
+
+    def __init__(self, name: str, parent: Optional["Span"] = None, **attributes):
+        self.name = name
+        self.span_id = uuid.uuid4().hex[:16]
+        self.trace_id = parent.trace_id if parent else uuid.uuid4().hex
+        self.parent_id = parent.span_id if parent else None
+        self.attributes = dict(attributes)
+        self.status = "ok"
+        self.start_time = time.time()
+        self.started = time.perf_counter()  # 单调时钟，用于计算耗时
+        self.duration: Optional[float] = None
+
+    def set(self, **attributes):
+        self.attributes.update(attributes)
+
+    def to_dict(self) -> dict:
+        return {
+            "name": self.name,
+            "trace_id": self.trace_id,
+            "span_id": self.span_id,
+            "parent_id": self.parent_id,
+            "start_time": self.start_time,
+            "duration": self.duration,
+            "status": self.status,
+            "attributes": self.attributes
+        }
+
+
+_sinks: List[Callable[[Span], None]] = []
+_sinks_lock = threading.Lock()
+
+
+def add_sink(sink: Callable[[Span], None]):
+    """注册span接收方，每个结束的span都会以sink(span)的形式传入"""
+    with _sinks_lock:
+        _sinks.append(sink)
+
+
+def remove_sink(sink: Callable[[Span], None]):
+    with _sinks_lock:
+        if sink in _sinks:
+            _sinks.remove(sink)
+
+
+@contextmanager
+def trace_span(name: str, **attributes):
+    """记录一段span，嵌套调用时自动关联父span；代码块抛出异常时状态记为error，任务被取消时记为cancelled"""
+    span = Span(name, _current_span.get(), **attributes)
+    token = _current_span.set(span)
+    try:
+        yield span
+    except BaseException as e:
+        span.status = "cancelled" if isinstance(e, TaskCancelled) else "error"
+        span.attributes.setdefault("error", str(e) or type(e).__name__)
+        raise
+    finally:
+        span.duration = time.perf_counter() - span.started
+        _current_span.reset(token)
+        with _sinks_lock:
+            sinks = list(_sinks)
+        for sink in sinks:
+            try:
+                sink(span)
+            except Exception as e:
+                print(f"span sink处理失败: {str(e)}")
+
+
+class JsonLinesSink:
+    """把span逐行写入JSONL文件"""
+
+    def __init__(self, path: str):
+        self.path = path
+        self._lock = threading.Lock()
+
+    def __call__(self, span: Span):
+        line = json.dumps(span.to_dict(), ensure_ascii=False, default=str)
+        with self._lock:
+            with open(self.path, 'a', encoding='utf-8') as f:
+                f.write(line + "\n")
+
+
+def console_sink(span: Span):
+    """在控制台打印span摘要"""
+    attributes = " ".join(f"{key}={value}" for key, value in span.attributes.items())
+    print(f"[span] {span.name} {span.duration * 1000:.1f}ms {span.status} {attributes}")
+
+
+# ---------------------------------------------------------------- Prometheus指标
+
+def _format_labels(names: Tuple[str, ...], values: Tuple[str, ...], extra: str = "") -> str:
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    def __init__(self, name: str, documentation: str, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+
+    def inc(self, amount: float = 1, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} counter"]
+        with self._lock:
+            for key, value in sorted(self._values.items()):
+                lines.append(f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(value)}")
+        return lines
+
+
+class Histogram:
+    def __init__(self, name: str, documentation: str, buckets=LATENCY_BUCKETS, labelnames: Tuple[str, ...] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.buckets = tuple(sorted(buckets))
+        self.labelnames = tuple(labelnames)
+        self._series: Dict[Tuple[str, ...], list] = {}
+        self._lock = threading.Lock()
+
+    def observe(self, value: float, **labels):
+        key = tuple(str(labels.get(name, "")) for name in self.labelnames)
+        index = bisect_left(self.buckets, value)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # [各桶计数..., +Inf计数, 总和]
+                series = self._series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+            series[index] += 1
+            series[-1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            items = [(key, list(series)) for key, series in sorted(self._series.items())]
+        for key, series in items:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), series[:-1]):
+                cumulative += count
+                le = f'le="{_format_value(float(bound))}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labelnames, key)} {_format_value(series[-1])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labelnames, key)} {cumulative}")
+        return lines
+
+
+class Gauge:
+    """取值时调用回调函数的仪表，用于导出连接池、会话数等当前状态
+
+    kind为counter时导出只增不减的累计值（如其他模块自行统计的重试次数），名称应以_total结尾。
+    """
+
+    def __init__(self, name: str, documentation: str, callback: Callable[[], float], kind: str = "gauge"):
+        self.name = name
+        self.documentation = documentation
+        self.callback = callback
+        self.kind = kind
+
+    def render(self) -> List[str]:
+        try:
+            value = self.callback()
+        except Exception:
+            return []
+        return [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}",
+                f"{self.name} {_format_value(value)}"]
+
+
+class MetricsRegistry:
+    def __init__(self):
+        self._metrics: Dict[str, object] = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            return self._metrics.setdefault(metric.name, metric)
+
+    def render(self) -> str:
+        """Prometheus文本格式（version 0.0.4）"""
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+ITERATION_SECONDS = REGISTRY.register(Histogram(
+    "agent_iteration_seconds", "一轮Agent迭代（模型调用+工具执行）的耗时"))
+LLM_CALL_SECONDS = REGISTRY.register(Histogram(
+    "llm_call_seconds", "一次模型调用（含重试）的总耗时", labelnames=("status",)))
+LLM_TTFT_SECONDS = REGISTRY.register(Histogram(
+    "llm_time_to_first_token_seconds", "发出请求到收到第一段模型输出的时间"))
+LLM_TOKENS_PER_SECOND = REGISTRY.register(Histogram(
+    "llm_tokens_per_second", "首token之后的生成速度（估算token数）", buckets=RATE_BUCKETS))
+LLM_PARSE_SECONDS = REGISTRY.register(Histogram(
+    "llm_action_parse_seconds", "一次模型调用中流式解析Action花费的时间",
+    buckets=(0.0001, 0.0005, 0.001, 0.005, 0.01, 0.05, 0.1)))
+LLM_CALLS = REGISTRY.register(Counter("llm_calls_total", "模型调用次数", ("status",)))
+LLM_PROMPT_TOKENS = REGISTRY.register(Counter("llm_prompt_tokens_total", "发送给模型的上下文token数（估算）"))
+LLM_COMPLETION_TOKENS = REGISTRY.register(Counter("llm_completion_tokens_total", "模型输出的token数（估算）"))
+LLM_PROMPT_TOKENS_SAVED = REGISTRY.register(Counter(
+    "llm_prompt_tokens_saved_total", "原生函数调用模式相比文本Action模式少发送的上下文token数（估算）"))
+TOOL_SECONDS = REGISTRY.register(Histogram(
+    "tool_execution_seconds", "工具执行耗时", labelnames=("tool",)))
+TOOL_CALLS = REGISTRY.register(Counter("tool_calls_total", "工具调用次数", ("tool", "status")))
+
+
+def metrics_sink(span: Span):
+    """把span汇总进直方图和计数器"""
+    attributes = span.attributes
+    if span.name == "agent.iteration":
+        ITERATION_SECONDS.observe(span.duration)
+    elif span.name == "llm.call":
+        LLM_CALL_SECONDS.observe(span.duration, status=span.status)
+        LLM_CALLS.inc(status=span.status)
+        if attributes.get("ttft") is not None:
+            LLM_TTFT_SECONDS.observe(attributes["ttft"])
+        if attributes.get("tokens_per_second"):
+            LLM_TOKENS_PER_SECOND.observe(attributes["tokens_per_second"])
+        if attributes.get("parse_seconds") is not None:
+            LLM_PARSE_SECONDS.observe(attributes["parse_seconds"])
+        LLM_PROMPT_TOKENS.inc(attributes.get("prompt_tokens", 0))
+        LLM_COMPLETION_TOKENS.inc(attributes.get("completion_tokens", 0))
+        LLM_PROMPT_TOKENS_SAVED.inc(attributes.get("prompt_tokens_saved", 0))
+    elif span.name == "tool.execute":
+        tool = attributes.get("tool", "")
+        TOOL_SECONDS.observe(span.duration, tool=tool)
+        TOOL_CALLS.inc(tool=tool, status=span.status)
+
+
+def register_gauge(name: str, documentation: str, callback: Callable[[], float]):
+    REGISTRY.register(Gauge(name, documentation, callback))
+
+
+def register_counter(name: str, documentation: str, callback: Callable[[], float]):
+    """导出由回调取值的累计计数器"""
+    REGISTRY.register(Gauge(name, documentation, callback, kind="counter"))
+
+
+def render_metrics() -> str:
+    return REGISTRY.render()
+
+
+def _install_configured_sinks():
+    for name in Config.TRACE_SINKS:
+        if name == "metrics":
+            add_sink(metrics_sink)
+        elif name == "console":
+            add_sink(console_sink)
+        elif name == "jsonl":
+            add_sink(JsonLinesSink(Config.TRACE_JSONL_PATH))
+        else:
+            print(f"未知的span sink: {name}")
+
+
+_install_configured_sinks()
@@ -0,0 +1,236 @@
+import fnmatch
+import os
+import threading
+import time
+from collections import defaultdict
+from typing import Dict, List, Optional
+from config import Config
+
+try:
+    from watchdog.events import FileSystemEventHandler
+    from watchdog.observers import Observer
+except ImportError:  # 未安装watchdog时退回定期mtime扫描
+    Observer = None
+    FileSystemEventHandler = object
+
+
+def _is_hidden(rel_path: str) -> bool:
+    return any(part.startswith(".") for part in rel_path.split("/"))
+
+
+class _IndexEventHandler(FileSystemEventHandler):
+    """把文件系统通知转交给索引"""
+
+    def __init__(self, index: "WorkspaceIndex"):
+        self.index = index
+
+    def on_any_event(self, event):
+        self.index.notify(event.src_path)
+        dest_path = getattr(event, "dest_path", None)
+        if dest_path:
+            self.index.notify(dest_path)
+
+
+class WorkspaceIndex:
+    """工作空间文件索引：在内存中维护文件元数据（大小、修改时间、类型）
+
+    优先通过watchdog的文件系统通知增量更新；没有watchdog时，查询前按
+    WORKSPACE_INDEX_SCAN_INTERVAL节流做一次全量扫描。工具写入文件后调用notify，
+    保证新文件立即可见。以.开头的文件和目录（本地图表资源、写入中的临时文件等）不进入索引。
+    """
+
+    def __init__(self, root: str = None, scan_interval: float = None):
+        self.root = os.path.abspath(root or Config.WORKSPACE_PATH)
+        self.scan_interval = Config.WORKSPACE_INDEX_SCAN_INTERVAL if scan_interval is None else scan_interval
+        self._entries: Dict[str, dict] = {}
+        self._children: Dict[str, set] = defaultdict(set)
+        self._sorted_paths: Optional[List[str]] = None
+        self._lock = threading.RLock()
+        self._last_scan = 0.0
+        self._dirty = True
+        self._observer = None
+
+    @property
+    def watching(self) -> bool:
+        return self._observer is not None
+
+    def start(self):
+        """首次全量扫描，并在可用时启动文件系统监听"""
+        os.makedirs(self.root, exist_ok=True)
+        self.refresh(force=True)
+        if Observer is not None and self._observer is None:
+            try:
+                observer = Observer()
+                observer.schedule(_IndexEventHandler(self), self.root, recursive=True)
+                observer.daemon = True
+                observer.start()
+                self._observer = observer
+            except OSError as e:
+                print(f"工作空间监听启动失败，改用定期扫描: {str(e)}")
+
+    def stop(self):
+        if self._observer is not None:
+            self._observer.stop()
+            self._observer = None
+
+    def invalidate(self):
+        """标记索引可能过期（例如执行了可能写文件的代码），下次查询时重新扫描"""
+        self._dirty = True
+
+    def refresh(self, force: bool = False):
+        """按需重新扫描：有文件系统监听时只在被标记过期后扫描"""
+        now = time.time()
+        if not force:
+            if self.watching and not self._dirty:
+                return
+            if not self._dirty and now - self._last_scan < self.scan_interval:
+                return
+        entries, children = self._scan()
+        with self._lock:
+            self._entries = entries
+            self._children = children
+            self._sorted_paths = None
+            self._last_scan = now
+            self._dirty = False
+
+    def notify(self, path: str):
+        """某个路径发生变化，立即更新它（目录会连同子树一起更新）"""
+        rel_path = self._relative(path)
+        if rel_path is None or rel_path == "" or _is_hidden(rel_path):
+            return
+        try:
+            stat = os.stat(os.path.join(self.root, rel_path), follow_symlinks=False)
+        except OSError:
+            self._remove(rel_path)
+            return
+
+        is_dir = os.path.isdir(os.path.join(self.root, rel_path))
+        with self._lock:
+            self._upsert(rel_path, stat, is_dir)
+            # 补全可能缺失的上级目录
+            parent = os.path.dirname(rel_path)
+            while parent and parent not in self._entries:
+                parent_stat = os.stat(os.path.join(self.root, parent))
+                self._upsert(parent, parent_stat, True)
+                parent = os.path.dirname(parent)
+        if is_dir:
+            entries, children = self._scan(rel_path)
+            with self._lock:
+                self._entries.update(entries)
+                for directory, names in children.items():
+                    self._children[directory].update(names)
+                self._sorted_paths = None
+
+    def list(self, directory: str = "", pattern: str = None, recursive: bool = True,
+             include_dirs: bool = False, offset: int = 0, limit: int = None) -> tuple[list, int]:
+        """查询索引，返回(条目列表, 匹配总数)，条目按路径排序"""
+        self.refresh()
+        directory = self._relative(os.path.join(self.root, directory or ""))
+        if directory is None:
+            raise ValueError("目录不在工作区内")
+        with self._lock:
+            if directory and self._entries.get(directory, {}).get("type") != "directory":
+                raise FileNotFoundError(f"目录不存在: {directory}")
+            if recursive:
+                prefix = directory + "/" if directory else ""
+                paths = [path for path in self._sorted() if path.startswith(prefix)]
+            else:
+                names = sorted(self._children.get(directory, ()))
+                paths = [f"{directory}/{name}" if directory else name for name in names]
+            entries = [self._entries[path] for path in paths if path in self._entries]
+
+        if not include_dirs:
+            entries = [entry for entry in entries if entry["type"] == "file"]
+        if pattern:
+            entries = [
+                entry for entry in entries
+                if fnmatch.fnmatch(entry["path"], pattern) or fnmatch.fnmatch(entry["name"], pattern)
+            ]
+        total = len(entries)
+        offset = max(0, offset or 0)
+        end = None if limit is None else offset + max(0, limit)
+        return [dict(entry) for entry in entries[offset:end]], total
+
+    def _sorted(self) -> List[str]:
+        if self._sorted_paths is None:
+            self._sorted_paths = sorted(self._entries)
+        return self._sorted_paths
+
+    def _relative(self, path: str) -> Optional[str]:
+        abs_path = os.path.abspath(path)
+        if abs_path != self.root and not abs_path.startswith(self.root + os.sep):
+            return None
+        rel_path = os.path.relpath(abs_path, self.root)
+        return "" if rel_path == "." else rel_path.replace(os.sep, "/")
+
+    def _upsert(self, rel_path: str, stat, is_dir: bool):
+        parent, name = os.path.split(rel_path)
+        if rel_path not in self._entries:
+            self._sorted_paths = None
+        self._entries[rel_path] = {
+            "path": rel_path,
+            "name": name,
+            "type": "directory" if is_dir else "file",
+            "size": 0 if is_dir else stat.st_size,
+            "mtime": stat.st_mtime
+        }
+        self._children[parent].add(name)
+
+    def _remove(self, rel_path: str):
+        with self._lock:
+            if rel_path not in self._entries:
+                return
+            prefix = rel_path + "/"
+            for path in [path for path in self._entries if path == rel_path or path.startswith(prefix)]:
+                del self._entries[path]
+                self._children.pop(path, None)
+            parent, name = os.path.split(rel_path)
+            self._children[parent].discard(name)
+            self._sorted_paths = None
+
+    def _scan(self, rel_root: str = "") -> tuple[dict, dict]:
+        """用os.scandir扫描子树，返回(条目, 目录子项)"""
+        entries = {}
+        children = defaultdict(set)
+        stack = [rel_root]
+        while stack:
+            rel_dir = stack.pop()
+            try:
+                iterator = os.scandir(os.path.join(self.root, rel_dir))
+            except OSError:
+                continue
+            with iterator:
+                for entry in iterator:
+                    if entry.name.startswith("."):
+                        continue
+                    rel_path = f"{rel_dir}/{entry.name}" if rel_dir else entry.name
+                    try:
+                        is_dir = entry.is_dir(follow_symlinks=False)
+                        stat = entry.stat(follow_symlinks=False)
+                    except OSError:
+                        continue
+                    entries[rel_path] = {
+                        "path": rel_path,
+                        "name": entry.name,
+                        "type": "directory" if is_dir else "file",
+                        "size": 0 if is_dir else stat.st_size,
+                        "mtime": stat.st_mtime
+                    }
+                    children[rel_dir].add(entry.name)
+                    if is_dir:
+                        stack.append(rel_path)
+        return entries, children
+
+
+_default_index = None
+_default_index_lock = threading.Lock()
+
+
+def get_workspace_index() -> WorkspaceIndex:
+    """获取进程级共享的工作空间索引"""
+    global _default_index
+    with _default_index_lock:
+        if _default_index is None:
+            _default_index = WorkspaceIndex()
+            _default_index.start()
+        return _default_index